@@ -10,6 +10,7 @@ class UserAdmin(BaseUserAdmin):
     """Admin configuration for the custom User model."""
     
     list_display = ('email', 'name', 'is_staff', 'is_google_user')
+    readonly_fields = ('friend_count', 'pending_incoming_count')
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'is_google_user')
     search_fields = ('email', 'name')
     ordering = ('email',)
@@ -17,6 +18,7 @@ class UserAdmin(BaseUserAdmin):
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_('Personal info'), {'fields': ('name', 'bio', 'profile_picture')}),
+        (_('Friends'), {'fields': ('friend_count', 'pending_incoming_count')}),
         (_('Authentication'), {'fields': ('is_google_user', 'google_id')}),
         (
             _('Permissions'),
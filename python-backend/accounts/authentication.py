@@ -0,0 +1,178 @@
+"""
+JWT authentication without a user lookup on every request.
+
+``ClaimsJWTAuthentication`` builds ``request.user`` from the token claims
+(id, email and name, see ``accounts.tokens``) as a ``User`` instance whose
+other fields are deferred, so it works with the ORM and serializers and
+only queries the database if one of those fields is actually read.
+
+Users that do have to be fetched (tokens issued without the claims) are
+kept in a small per-process LRU with a TTL. A fresh cached row is also
+preferred over the claims. Entries are evicted when the user is saved or
+deleted in this process; other processes see changes once the TTL runs out.
+
+Neither kind of user proves the account is still live, so every
+authentication also checks whether the user is active. The answer is kept
+in the shared cache for ``AUTH_USER_CACHE_TTL`` seconds and replaced when
+the user is saved or deleted, so it is usually a cache read; when the entry
+is missing, evicted or expired, the user is looked up instead of trusted.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from copy import copy
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .tokens import USER_CLAIM_FIELDS
+
+User = get_user_model()
+
+
+class RecentUserCache:
+    """Thread-safe LRU of fully loaded users that expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=4096, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        """Return a private copy of the cached user, or ``None``."""
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+        # Callers may modify the user, so never hand out the shared instance
+        return copy(user)
+
+    def put(self, user):
+        with self.lock:
+            self.entries[user.pk] = (copy(user), time.monotonic() + self.ttl)
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+recent_users = RecentUserCache(
+    maxsize=getattr(settings, 'AUTH_USER_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 60),
+)
+
+
+def user_active_key(user_id):
+    return f'user-active:{user_id}'
+
+
+def set_user_active(user_id, active):
+    """Record whether the user's tokens are accepted."""
+    cache.set(user_active_key(user_id), active, recent_users.ttl)
+
+
+def lookup_user_active(user_id):
+    # The primary, so a lagging replica cannot bring a deactivated user back
+    active = User.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id, is_active=True).exists()
+    # add() rather than set(), so a read older than a concurrent save does not win
+    cache.add(user_active_key(user_id), active, recent_users.ttl)
+    return active
+
+
+def is_user_active(user_id):
+    """Return whether the user exists and is active, looking them up if the cache does not say."""
+    active = cache.get(user_active_key(user_id))
+    if active is None:
+        active = lookup_user_active(user_id)
+    return active
+
+
+async def ais_user_active(user_id):
+    """Async variant of ``is_user_active``."""
+    active = await cache.aget(user_active_key(user_id))
+    if active is None:
+        active = await sync_to_async(lookup_user_active)(user_id)
+    return active
+
+
+def user_from_claims(validated_token, using=DEFAULT_DB_ALIAS):
+    """Build a ``User`` holding only the claim fields; the rest load on first access."""
+    field_names = [User._meta.pk.attname, *USER_CLAIM_FIELDS]
+    values = [validated_token[api_settings.USER_ID_CLAIM]]
+    values.extend(validated_token[field] for field in USER_CLAIM_FIELDS)
+    user = User.from_db(using, field_names, values)
+    # Claims can be older than the row, so they do not tell what is stored
+    user._stored_public = {}
+    return user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` that trusts the token claims instead of fetching the user."""
+
+    def get_user(self, validated_token):
+        user = self.get_user_without_lookup(validated_token)
+        if user is None:
+            # Tokens issued before the claims were added need one lookup
+            user = super().get_user(validated_token)
+            recent_users.put(user)
+            return self.check_active(user, user.is_active)
+        return self.check_active(user, is_user_active(user.pk))
+
+    async def aget_user(self, validated_token):
+        """Async ``get_user``; only tokens without claims touch the database."""
+        user = self.get_user_without_lookup(validated_token)
+        if user is None:
+            user = await sync_to_async(super().get_user)(validated_token)
+            recent_users.put(user)
+            return self.check_active(user, user.is_active)
+        return self.check_active(user, await ais_user_active(user.pk))
+
+    async def aauthenticate(self, request):
+        """Async ``authenticate`` for views running on the event loop."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    def get_user_without_lookup(self, validated_token):
+        """Return the cached or claims-built user, or ``None`` if it must be fetched."""
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = recent_users.get(user_id)
+        if user is None and all(field in validated_token for field in USER_CLAIM_FIELDS):
+            # Claims users are built per request and never cached
+            user = user_from_claims(validated_token)
+        return user
+
+    def check_active(self, user, active):
+        if not active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,160 @@
+"""
+Google ID token verification with process-wide caching of Google's certs.
+
+``google.oauth2.id_token.verify_oauth2_token`` downloads Google's public
+certificates on every call. ``GoogleCertCache`` keeps them for as long as
+the ``Cache-Control: max-age`` of the response allows and refreshes them in
+a background thread shortly before they expire, so logins normally verify
+against certificates already in memory.
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+from google.auth import exceptions as google_exceptions
+from google.auth import jwt
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# Used when Google's response carries no usable max-age
+DEFAULT_MAX_AGE = 300
+
+# Certificates are refreshed in the background this many seconds before
+# they expire
+REFRESH_MARGIN = 60
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+def parse_max_age(headers):
+    """Return how many seconds a response may be cached, from its headers."""
+    match = MAX_AGE_RE.search(headers.get('Cache-Control') or '')
+    if not match:
+        return DEFAULT_MAX_AGE
+    try:
+        age = int(headers.get('Age') or 0)
+    except ValueError:
+        age = 0
+    return max(int(match.group(1)) - age, 0)
+
+
+class GoogleCertCache:
+    """Thread-safe cache of the certificates Google signs ID tokens with."""
+
+    def __init__(self, url=None, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.certs = None
+        self.expires_at = 0
+        self.refreshing = False
+        self.fetch_count = 0
+
+    def get_url(self):
+        return self.url or settings.GOOGLE_CERTS_URL
+
+    def fetch(self):
+        """Download the certificates and return them with their lifetime."""
+        with urllib.request.urlopen(self.get_url(), timeout=self.timeout) as response:
+            certs = json.loads(response.read().decode('utf-8'))
+            return certs, parse_max_age(response.headers)
+
+    def refresh(self):
+        """Download the certificates and store them."""
+        try:
+            certs, max_age = self.fetch()
+            with self.lock:
+                self.certs = certs
+                self.expires_at = time.monotonic() + max_age
+                self.fetch_count += 1
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def _state(self):
+        """Return the cached certs, whether they expired and whether to refresh them early."""
+        with self.lock:
+            remaining = self.expires_at - time.monotonic()
+            expired = self.certs is None or remaining <= 0
+            refresh_soon = not expired and remaining <= REFRESH_MARGIN and not self.refreshing
+            if refresh_soon:
+                self.refreshing = True
+            return self.certs, expired, refresh_soon
+
+    def _refresh_in_background(self):
+        thread = threading.Thread(target=self._background_refresh, daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            # The current certs stay valid until they expire; the next
+            # request past that point fetches them in the foreground
+            pass
+
+    def refresh_if_expired(self):
+        """Download the certificates unless another thread just did."""
+        with self.fetch_lock:
+            with self.lock:
+                expired = self.certs is None or self.expires_at <= time.monotonic()
+            if expired:
+                self.refresh()
+        return self.certs
+
+    def get_certs(self):
+        """Return the certificates, downloading them only if they expired."""
+        certs, expired, refresh_soon = self._state()
+        if refresh_soon:
+            self._refresh_in_background()
+        if not expired:
+            return certs
+        return self.refresh_if_expired()
+
+    async def aget_certs(self):
+        """Async variant of ``get_certs`` that downloads off the event loop."""
+        certs, expired, refresh_soon = self._state()
+        if refresh_soon:
+            self._refresh_in_background()
+        if not expired:
+            return certs
+        return await asyncio.to_thread(self.refresh_if_expired)
+
+    def clear(self):
+        with self.lock:
+            self.certs = None
+            self.expires_at = 0
+            self.refreshing = False
+
+
+google_certs = GoogleCertCache()
+
+
+def decode_google_token(token, certs, audience):
+    """Verify a Google ID token against the given certs and return its claims.
+
+    Raises ``ValueError`` if the token is invalid.
+    """
+    try:
+        idinfo = jwt.decode(token, certs=certs, audience=audience)
+    except google_exceptions.GoogleAuthError as e:
+        raise ValueError(str(e))
+    if idinfo.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError('Wrong issuer.')
+    return idinfo
+
+
+def verify_google_token(token, audience):
+    """Verify a Google ID token using the cached certs."""
+    return decode_google_token(token, google_certs.get_certs(), audience)
+
+
+async def averify_google_token(token, audience):
+    """Verify a Google ID token without blocking the event loop."""
+    return decode_google_token(token, await google_certs.aget_certs(), audience)
@@ -0,0 +1,142 @@
+"""
+Password hashing tuned for login bursts.
+
+The tuned hashers keep the algorithm names of Django's Argon2 and scrypt
+hashers, so their hashes stay readable by the stock classes, but use a cost
+that keeps one verification in the tens of milliseconds instead of the
+hundreds PBKDF2 needs at Django's default iteration count. Hashes made with
+other parameters or algorithms are upgraded the next time the user logs in.
+
+``verify_password`` runs the hash verification on a bounded thread pool.
+The hash functions release the GIL, so the pool caps the number of hashes
+computed at once per process at ``PASSWORD_HASH_WORKERS`` regardless of how
+many request threads are waiting, and logins beyond the queue limit are
+turned away instead of piling up behind each other. The request thread
+still waits for the result; ``averify_password`` awaits it instead, so an
+async view keeps its event loop free while the hash runs.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    ScryptPasswordHasher,
+    check_password,
+    make_password,
+)
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2id with OWASP's 19 MiB, two pass, single lane parameters."""
+
+    time_cost = 2
+    memory_cost = 19 * 1024
+    parallelism = 1
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """scrypt with a work factor taken from ``PASSWORD_SCRYPT_WORK_FACTOR``."""
+
+    @property
+    def work_factor(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_WORK_FACTOR', 2 ** 14)
+
+
+class PasswordHashPoolBusy(Exception):
+    """Raised when too many password hashes are already waiting to run."""
+
+
+class PasswordHashPool:
+    """Thread pool running password hashing with a bounded queue."""
+
+    def __init__(self, max_workers, max_pending, timeout):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='password-hash')
+            return self.executor
+
+    def submit(self, func, *args, timeout=None):
+        """Queue ``func`` and return its future, waiting at most ``timeout`` for room."""
+        if not self.slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise PasswordHashPoolBusy()
+        try:
+            future = self.get_executor().submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, func, *args):
+        return self.submit(func, *args).result()
+
+    async def arun(self, func, *args):
+        """Await ``func`` on the pool without blocking the event loop."""
+        try:
+            future = self.submit(func, *args, timeout=0)
+        except PasswordHashPoolBusy:
+            # Wait for room on a thread rather than on the event loop
+            future = await sync_to_async(self.submit, thread_sensitive=False)(func, *args)
+        return await asyncio.wrap_future(future)
+
+
+def _default_workers():
+    return getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1
+
+
+password_hash_pool = PasswordHashPool(
+    max_workers=_default_workers(),
+    max_pending=getattr(settings, 'PASSWORD_HASH_MAX_PENDING', 64),
+    timeout=getattr(settings, 'PASSWORD_HASH_QUEUE_TIMEOUT', 5),
+)
+
+
+def check_encoded_password(raw_password, encoded):
+    """Return whether the password matches and whether its hash is outdated.
+
+    Safe to run off the request thread: it never touches the database.
+    """
+    outdated = []
+    valid = check_password(raw_password, encoded, setter=lambda raw: outdated.append(True))
+    return valid, bool(outdated)
+
+
+def _save_password(user, encoded):
+    user.password = encoded
+    # A plain update: a new hash of the same password changes nothing the
+    # user's post_save receivers care about
+    get_user_model().objects.filter(pk=user.pk).update(password=encoded)
+
+
+def verify_password(user, raw_password, pool=password_hash_pool):
+    """Check a user's password on the hashing pool, upgrading an outdated hash.
+
+    Raises ``PasswordHashPoolBusy`` if the pool has no room.
+    """
+    valid, outdated = pool.run(check_encoded_password, raw_password, user.password)
+    if valid and outdated:
+        _save_password(user, pool.run(make_password, raw_password))
+    return valid
+
+
+async def averify_password(user, raw_password, pool=password_hash_pool):
+    """Async variant of ``verify_password``."""
+    valid, outdated = await pool.arun(check_encoded_password, raw_password, user.password)
+    if valid and outdated:
+        await sync_to_async(_save_password)(user, await pool.arun(make_password, raw_password))
+    return valid
@@ -0,0 +1,307 @@
+"""
+Bulk loading of users and friendships for community migrations.
+
+Records are streamed from CSV or NDJSON files and loaded in chunks, so
+memory use does not grow with the size of the import:
+
+* Users need ``email`` and ``name`` and may carry ``bio``,
+  ``profile_picture`` and either a plain ``password`` or a ``password_hash``
+  already in Django's format. Plain passwords are hashed on a process pool
+  while the previous chunk is being written; users without one get an
+  unusable password.
+* Friendships are ``user1_email``/``user2_email`` pairs of existing or
+  just imported users.
+
+On PostgreSQL each chunk is ``COPY``-ed into a temporary table and moved
+over with ``INSERT ... ON CONFLICT DO NOTHING``; other databases use
+``bulk_create(ignore_conflicts=True)``. Either way, emails and friendships
+that already exist are skipped, so an interrupted import can be rerun.
+
+Rows are written without ``save()``, so no signals are sent. For each chunk
+of new friendships the importer adjusts the friend counters, invalidates
+the cached data of both users and records the outbox events that refresh
+their friends' suggestions, as the friend request endpoints do. Workers
+sharing the cache are told to reload their friend graph; their search
+indexes pick up imported users by id.
+"""
+
+import csv
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from friends.counters import adjust_counter
+from friends.graph import request_reload
+from friends.models import Friendship
+from friends.signals import FRIENDSHIP_CREATED, enqueue_friendship_events, friend_data_changed
+
+User = get_user_model()
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+def read_records(path, format=None):
+    """Yield one dict per CSV row or NDJSON line of the file at ``path``."""
+    format = format or FORMATS.get(os.path.splitext(path)[1].lower())
+    if format not in ('csv', 'ndjson'):
+        raise ValueError(f'Cannot tell the format of {path}; pass csv or ndjson explicitly.')
+    with open(path, newline='', encoding='utf-8') as file:
+        if format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def hash_passwords(passwords):
+    """Hash a list of plain passwords; runs in the pool's worker processes."""
+    return [make_password(password) for password in passwords]
+
+
+class InlineExecutor:
+    """Executor running each task as it is submitted, for ``workers=0``."""
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def _init_worker(settings_module):
+    # Only needed where workers are spawned rather than forked
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+class ImportProgress:
+    """Running totals of one import."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.read = 0
+        self.created = 0
+        # Records missing an email or name, or repeating one
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    @property
+    def rate(self):
+        return self.read / max(time.perf_counter() - self.started, 1e-9)
+
+    def __str__(self):
+        return (f'{self.kind}: {self.read} read, {self.created} created, '
+                f'{self.skipped} skipped, {self.rate:.0f} rows/s')
+
+
+class BulkImporter:
+    """Load users and friendships in chunks of ``batch_size`` records.
+
+    ``workers`` processes hash passwords; with ``0`` they are hashed in
+    this process. ``progress`` is called with the running totals after
+    every chunk.
+    """
+
+    def __init__(self, connection, batch_size=5000, workers=None, progress=None):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.progress = progress or (lambda totals: None)
+        self.use_copy = connection.vendor == 'postgresql'
+
+    def import_users(self, records):
+        totals = ImportProgress('users')
+        executor = InlineExecutor()
+        if self.workers:
+            executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(settings.SETTINGS_MODULE,))
+        try:
+            for users, skipped in self._hashed_chunks(chunked(records, self.batch_size), executor):
+                with transaction.atomic(using=self.connection.alias):
+                    created = self._copy_users(users) if self.use_copy else self._bulk_create_users(users)
+                totals.read += len(users) + skipped
+                totals.skipped += skipped
+                totals.created += created
+                self.progress(totals)
+        finally:
+            executor.shutdown()
+        return totals
+
+    def _hashed_chunks(self, chunks, executor):
+        """Yield ``(users, skipped_count)`` per chunk, hashing one chunk ahead of the caller."""
+        in_flight = deque()
+        for records in chunks:
+            in_flight.append(self._build_users(records, executor))
+            if len(in_flight) > 1:
+                yield self._finish_users(*in_flight.popleft())
+        while in_flight:
+            yield self._finish_users(*in_flight.popleft())
+
+    def _build_users(self, records, executor):
+        users = {}
+        plain = []
+        for record in records:
+            email = (record.get('email') or '').strip()
+            name = (record.get('name') or '').strip()
+            if not email or not name:
+                continue
+            email = User.objects.normalize_email(email)
+            if email in users:
+                # A repeated email keeps its first record
+                continue
+            user = users[email] = User(
+                email=email,
+                name=name,
+                bio=record.get('bio') or '',
+                profile_picture=record.get('profile_picture') or '',
+                password=record.get('password_hash') or make_password(None),
+            )
+            if record.get('password') and not record.get('password_hash'):
+                plain.append((user, record['password']))
+        passwords = [password for _, password in plain]
+        # One task per worker keeps the pickling overhead per chunk low
+        size = -(-len(passwords) // max(self.workers, 1)) or 1
+        futures = [executor.submit(hash_passwords, part) for part in chunked(passwords, size)]
+        return list(users.values()), len(records) - len(users), plain, futures
+
+    @staticmethod
+    def _finish_users(users, skipped, plain, futures):
+        hashes = [encoded for future in futures for encoded in future.result()]
+        for (user, _), encoded in zip(plain, hashes):
+            user.password = encoded
+        return users, skipped
+
+    def _bulk_create_users(self, users):
+        emails = [user.email for user in users]
+        existing = User.objects.using(self.connection.alias).filter(email__in=emails).count()
+        User.objects.using(self.connection.alias).bulk_create(users, ignore_conflicts=True)
+        return len(users) - existing
+
+    def _copy_users(self, users):
+        fields = [field for field in User._meta.concrete_fields if not field.primary_key]
+        rows = (
+            [field.get_db_prep_save(getattr(user, field.attname), self.connection) for field in fields]
+            for user in users
+        )
+        return self._copy_insert(
+            User._meta.db_table, [field.column for field in fields], rows, conflict='(email)')
+
+    def import_friendships(self, records):
+        totals = ImportProgress('friendships')
+        for chunk in chunked(records, self.batch_size):
+            pairs = []
+            for record in chunk:
+                email1 = User.objects.normalize_email((record.get('user1_email') or '').strip())
+                email2 = User.objects.normalize_email((record.get('user2_email') or '').strip())
+                if email1 and email2 and email1 != email2:
+                    pairs.append((email1, email2))
+            with transaction.atomic(using=self.connection.alias):
+                created = self._copy_friendships(pairs) if self.use_copy else self._bulk_create_friendships(pairs)
+                user_ids = [user_id for f in created for user_id in (f.user1_id, f.user2_id)]
+                adjust_counter('friend_count', user_ids)
+                friend_data_changed(*user_ids)
+                enqueue_friendship_events(FRIENDSHIP_CREATED, created)
+            totals.read += len(chunk)
+            totals.created += len(created)
+            totals.skipped += len(chunk) - len(pairs)
+            self.progress(totals)
+        if totals.created:
+            request_reload()
+        return totals
+
+    def _bulk_create_friendships(self, pairs):
+        """Create friendships between known emails and return the new ones."""
+        ids = dict(
+            User.objects.using(self.connection.alias)
+            .filter(email__in={email for pair in pairs for email in pair})
+            .values_list('email', 'id')
+        )
+        new = {
+            Friendship.canonical_pair(ids[email1], ids[email2])
+            for email1, email2 in pairs
+            if email1 in ids and email2 in ids
+        }
+        new -= set(
+            Friendship.objects.using(self.connection.alias)
+            .filter(user1_id__in={user1_id for user1_id, _ in new})
+            .values_list('user1_id', 'user2_id')
+        )
+        friendships = [Friendship(user1_id=user1_id, user2_id=user2_id) for user1_id, user2_id in new]
+        # Fills in created_at
+        Friendship.objects.using(self.connection.alias).bulk_create(friendships, ignore_conflicts=True)
+        return friendships
+
+    def _copy_friendships(self, pairs):
+        """COPY the email pairs and insert the friendships they resolve to."""
+        quote = self.connection.ops.quote_name
+        friendships, users = quote(Friendship._meta.db_table), quote(User._meta.db_table)
+        with self.connection.cursor() as cursor:
+            # Inside an outer transaction the table outlives the chunk
+            cursor.execute('DROP TABLE IF EXISTS pg_temp.import_friendships')
+            cursor.execute('CREATE TEMPORARY TABLE import_friendships (email1 text, email2 text) ON COMMIT DROP')
+            cursor.copy_expert('COPY import_friendships FROM STDIN', copy_buffer(pairs))
+            cursor.execute(
+                f'INSERT INTO {friendships} (user1_id, user2_id, created_at) '
+                f'SELECT DISTINCT LEAST(a.id, b.id), GREATEST(a.id, b.id), %s '
+                f'FROM import_friendships i '
+                f'JOIN {users} a ON a.email = i.email1 JOIN {users} b ON b.email = i.email2 '
+                f'WHERE a.id <> b.id ON CONFLICT DO NOTHING RETURNING user1_id, user2_id, created_at',
+                [timezone.now()],
+            )
+            return [
+                Friendship(user1_id=user1_id, user2_id=user2_id, created_at=created_at)
+                for user1_id, user2_id, created_at in cursor.fetchall()
+            ]
+
+    def _copy_insert(self, table, columns, rows, conflict):
+        """COPY rows into a temporary copy of ``table`` and insert the ones without conflicts."""
+        quote = self.connection.ops.quote_name
+        column_list = ', '.join(quote(column) for column in columns)
+        with self.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS pg_temp.import_rows')
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE import_rows ON COMMIT DROP AS '
+                f'SELECT {column_list} FROM {quote(table)} WITH NO DATA'
+            )
+            cursor.copy_expert(f'COPY import_rows ({column_list}) FROM STDIN', copy_buffer(rows))
+            cursor.execute(
+                f'INSERT INTO {quote(table)} ({column_list}) SELECT {column_list} FROM import_rows '
+                f'ON CONFLICT {conflict} DO NOTHING'
+            )
+            return cursor.rowcount
+
+
+def copy_value(value):
+    """Format a value for ``COPY``'s text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def copy_buffer(rows):
+    return io.StringIO(''.join('\t'.join(map(copy_value, row)) + '\n' for row in rows))
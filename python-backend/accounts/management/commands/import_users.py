@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from accounts.importing import BulkImporter, read_records
+
+
+class Command(BaseCommand):
+    help = 'Bulk import users and friendships from CSV or NDJSON files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help='file of users: email, name, and optionally password, '
+                                            'password_hash, bio, profile_picture')
+        parser.add_argument('--friendships', help='file of friendships: user1_email, user2_email')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='file format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='records written per transaction')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='password hashing processes (default: one per CPU, 0 to hash inline)')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, users, friendships, format, batch_size, workers, database, **options):
+        if not users and not friendships:
+            raise CommandError('Pass --users and/or --friendships.')
+        importer = BulkImporter(
+            connections[database], batch_size=batch_size, workers=workers,
+            progress=self.report if options['verbosity'] > 0 else None,
+        )
+        try:
+            if users:
+                totals = importer.import_users(read_records(users, format))
+                self.stdout.write(self.style.SUCCESS(f'Done. {totals}'))
+            if friendships:
+                totals = importer.import_friendships(read_records(friendships, format))
+                self.stdout.write(self.style.SUCCESS(f'Done. {totals}'))
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+    def report(self, totals):
+        self.stderr.write(str(totals))
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# icontains compiles to UPPER(column) LIKE UPPER(pattern) on PostgreSQL, so the
+# trigram indexes are built on the same expression
+TRIGRAM_INDEXES = {
+    'accounts_user_name_trgm': 'name',
+    'accounts_user_email_trgm': 'email',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """Create pg_trgm GIN indexes for user search; other databases are skipped."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index_name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} '
+            f'ON accounts_user USING gin (UPPER({column}) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field):
+    counts = queryset.order_by().values(field).annotate(count=Count('id')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def count_existing_friends(apps, schema_editor):
+    """Fill the new counters from the friend tables in one UPDATE."""
+    User = apps.get_model('accounts', 'User')
+    Friendship = apps.get_model('friends', 'Friendship')
+    FriendRequest = apps.get_model('friends', 'FriendRequest')
+    User.objects.update(
+        friend_count=(
+            _count(Friendship.objects.filter(user1=OuterRef('pk')), 'user1')
+            + _count(Friendship.objects.filter(user2=OuterRef('pk')), 'user2')
+        ),
+        pending_incoming_count=_count(
+            FriendRequest.objects.filter(receiver=OuterRef('pk'), status='pending'), 'receiver'
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_search_trgm_indexes'),
+        ('friends', '0003_friendrequest_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='friend_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='friends'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='pending_incoming_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='pending friend requests'),
+        ),
+        migrations.RunPython(count_existing_friends, migrations.RunPython.noop),
+    ]
@@ -40,11 +40,59 @@ class User(AbstractUser):
     profile_picture = models.URLField(_('profile picture URL'), blank=True)
     is_google_user = models.BooleanField(_('Google authenticated user'), default=False)
     google_id = models.CharField(_('Google ID'), max_length=100, blank=True, null=True)
+    # Denormalized by friends.services; not positive-constrained so that a
+    # drifted counter never blocks a friend request transaction
+    friend_count = models.IntegerField(_('friends'), default=0, editable=False)
+    pending_incoming_count = models.IntegerField(_('pending friend requests'), default=0, editable=False)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name']
     
+    # Fields other users see in their friend and friend request lists
+    PUBLIC_FIELDS = ('name', 'email', 'profile_picture')
+    
     objects = UserManager()
     
     def __str__(self):
-        return self.email
\ No newline at end of file
+        return self.email
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        user._stored_public = user.public_values()
+        return user
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        stored = {
+            field: value for field, value in self.public_values().items()
+            if update_fields is None or field in update_fields
+        }
+        self._stored_public = {**getattr(self, '_stored_public', {}), **stored}
+    
+    def public_values(self):
+        deferred = self.get_deferred_fields()
+        return {field: getattr(self, field) for field in self.PUBLIC_FIELDS if field not in deferred}
+    
+    def changed_public_fields(self, update_fields=None):
+        """Return the public fields a save writes with values other than the stored ones.
+        
+        Fields whose stored value is unknown count as changed.
+        """
+        stored = getattr(self, '_stored_public', {})
+        fields = set(self.PUBLIC_FIELDS).difference(self.get_deferred_fields())
+        if update_fields is not None:
+            fields.intersection_update(update_fields)
+        return {field for field in fields if field not in stored or stored[field] != getattr(self, field)}
+    
+    def refresh_from_db(self, using=None, fields=None):
+        """Reload field values from the database.
+        
+        Touching one deferred field loads every deferred field in the same
+        query, so a user built from token claims costs at most one lookup.
+        """
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.intersection(fields):
+            fields = list(deferred)
+        super().refresh_from_db(using=using, fields=fields)
\ No newline at end of file
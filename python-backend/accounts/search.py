@@ -0,0 +1,302 @@
+"""
+Indexed user search.
+
+``UserSearchFilter`` keeps the ``?search=`` semantics of DRF's ``SearchFilter``
+(every term must appear in the name or the email, case-insensitively) but
+hands the matching to a backend chosen for the database in use:
+
+* PostgreSQL: ``ILIKE`` served by ``pg_trgm`` GIN indexes (created by
+  migration ``0002``), ranked by trigram similarity.
+* SQLite: an in-process inverted n-gram index, loaded on first use and kept
+  current by ``post_save``/``post_delete`` signals on ``User``. Saves and
+  deletes are also appended to a change log in the cache, and before each
+  search a worker re-reads the users logged since its last search along
+  with users inserted without signals (ids above the highest it indexed),
+  so it finds what other workers and bulk imports wrote. Code changing
+  names or emails with ``QuerySet.update()`` must call ``log_user_change``.
+* Anything else: a plain ``icontains`` scan.
+
+A different backend can be forced with the ``USER_SEARCH_BACKEND`` setting.
+"""
+
+import threading
+from array import array
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+User = get_user_model()
+
+# Most matches the n-gram index ranks; broader searches fall back to a scan
+SEARCH_RESULT_LIMIT = 1000
+
+# Seconds change log entries are kept; far longer than workers take to replay them
+CHANGE_LOG_TIMEOUT = 60 * 10
+
+CHANGE_LOG_SEQUENCE_KEY = 'user-index:sequence'
+
+
+def change_log_key(sequence):
+    return f'user-index:change:{sequence}'
+
+
+def log_user_change(user_id):
+    """Have every worker's index re-read a saved or deleted user."""
+    try:
+        sequence = cache.incr(CHANGE_LOG_SEQUENCE_KEY)
+    except ValueError:
+        cache.add(CHANGE_LOG_SEQUENCE_KEY, 0, None)
+        sequence = cache.incr(CHANGE_LOG_SEQUENCE_KEY)
+    cache.set(change_log_key(sequence), user_id, CHANGE_LOG_TIMEOUT)
+
+
+def matches_any_field(terms, fields):
+    """Return the ``icontains`` condition requiring every term in one of the fields."""
+    condition = Q()
+    for term in terms:
+        term_condition = Q()
+        for field in fields:
+            term_condition |= Q(**{f'{field}__icontains': term})
+        condition &= term_condition
+    return condition
+
+
+def rank_by_scores(queryset, scores):
+    """Restrict a queryset to the scored ids, highest score first then by id.
+
+    Ids are grouped by score so the ranking expression has one ``IN`` branch
+    per distinct score rather than one branch per row.
+    """
+    if not scores:
+        return queryset.none()
+    by_score = {}
+    for user_id, score in scores.items():
+        by_score.setdefault(score, []).append(user_id)
+    rank = Case(
+        *[When(id__in=ids, then=Value(score)) for score, ids in by_score.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return queryset.filter(id__in=list(scores)).annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+
+class DatabaseScanBackend:
+    """Unindexed ``icontains`` matching, the behaviour of DRF's ``SearchFilter``."""
+
+    def search(self, queryset, terms, fields):
+        return queryset.filter(matches_any_field(terms, fields))
+
+
+class TrigramSearchBackend(DatabaseScanBackend):
+    """PostgreSQL backend using the ``pg_trgm`` indexes on name and email."""
+
+    def search(self, queryset, terms, fields):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        query = ' '.join(terms)
+        similarities = [TrigramSimilarity(field, query) for field in fields]
+        rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+        return (
+            super().search(queryset, terms, fields)
+            .annotate(search_rank=rank)
+            .order_by('-search_rank', 'id')
+        )
+
+
+class NgramIndex:
+    """Inverted index from character n-grams of names and emails to user ids.
+
+    Posting lists are append-only integer arrays; stale entries left behind by
+    updates are ignored because every candidate is verified against the
+    current text held in ``documents``.
+    """
+
+    n = 3
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    @classmethod
+    def ngrams(cls, text):
+        return {text[i:i + cls.n] for i in range(len(text) - cls.n + 1)}
+
+    def load(self, queryset):
+        """Build the index from scratch from ``(id, name, email)`` rows."""
+        with self.lock:
+            self.clear()
+            # Changes logged from here on are replayed on top; replaying one
+            # the rows already include is harmless
+            self.sequence = cache.get(CHANGE_LOG_SEQUENCE_KEY, 0)
+            for user_id, name, email in queryset.values_list('id', 'name', 'email').iterator(chunk_size=10000):
+                self._add(user_id, name, email)
+            self.loaded = True
+
+    def ensure_current(self, queryset):
+        """Load the index if needed, or re-read the users changed since the last call."""
+        with self.lock:
+            if not self.loaded:
+                self.load(queryset)
+            else:
+                self.refresh(queryset)
+
+    def refresh(self, queryset):
+        latest = cache.get(CHANGE_LOG_SEQUENCE_KEY, 0)
+        if latest < self.sequence:
+            # The log was lost with the cache, and changes along with it
+            self.load(queryset)
+            return
+        sequences = range(self.sequence + 1, latest + 1)
+        entries = cache.get_many([change_log_key(sequence) for sequence in sequences]) if sequences else {}
+        changed = set()
+        for sequence in sequences:
+            user_id = entries.get(change_log_key(sequence))
+            if user_id is None:
+                # The writer may not have stored it yet; still missing at the
+                # next refresh, it expired
+                if self.missing == sequence:
+                    self.load(queryset)
+                    return
+                self.missing = sequence
+                break
+            changed.add(user_id)
+            self.sequence = sequence
+        else:
+            self.missing = None
+        found = set()
+        rows = queryset.filter(Q(id__gt=self.max_id) | Q(id__in=changed)).values_list('id', 'name', 'email')
+        for user_id, name, email in rows:
+            self._add(user_id, name, email)
+            found.add(user_id)
+        for user_id in changed - found:
+            self.documents.pop(user_id, None)
+
+    def add(self, user_id, name, email):
+        with self.lock:
+            if self.loaded:
+                self._add(user_id, name, email)
+
+    def remove(self, user_id):
+        with self.lock:
+            self.documents.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.postings = {}
+            self.documents = {}
+            self.max_id = 0
+            self.sequence = 0
+            self.missing = None
+            self.loaded = False
+
+    def _add(self, user_id, name, email):
+        self.max_id = max(self.max_id, user_id)
+        document = ((name or '').lower(), (email or '').lower())
+        previous = self.documents.get(user_id)
+        self.documents[user_id] = document
+        known = set()
+        if previous is not None:
+            known = self.ngrams(previous[0]) | self.ngrams(previous[1])
+        for gram in (self.ngrams(document[0]) | self.ngrams(document[1])) - known:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('q')
+            posting.append(user_id)
+
+    @staticmethod
+    def score(terms, name, email):
+        """Rank a match: name prefixes beat word prefixes beat any substring."""
+        total = 0
+        for term in terms:
+            if name.startswith(term):
+                total += 8
+            elif f' {term}' in name:
+                total += 4
+            elif term in name:
+                total += 2
+            if email.startswith(term):
+                total += 2
+            elif term in email:
+                total += 1
+        return total
+
+    def search(self, terms, limit=SEARCH_RESULT_LIMIT):
+        """Return ``{user_id: score}`` for the users matching every term.
+
+        Returns ``None`` if a term is too short to be looked up by n-grams,
+        or if more than ``limit`` users match.
+        """
+        terms = [term.lower() for term in terms]
+        if any(len(term) < self.n for term in terms):
+            return None
+        with self.lock:
+            # Scanning the rarest n-gram's posting list bounds the work
+            postings = [self.postings.get(gram, ()) for term in terms for gram in self.ngrams(term)]
+            rarest = min(postings, key=len)
+            scored = {}
+            for user_id in rarest:
+                if user_id in scored:
+                    continue
+                document = self.documents.get(user_id)
+                if document is None:
+                    continue
+                name, email = document
+                if all(term in name or term in email for term in terms):
+                    scored[user_id] = self.score(terms, name, email)
+                    if len(scored) > limit:
+                        return None
+        return scored
+
+
+user_index = NgramIndex()
+
+
+class NgramSearchBackend(DatabaseScanBackend):
+    """In-process n-gram index backend for SQLite deployments.
+
+    Each worker process keeps its own index, brought up to date from the
+    primary before every search; the final ``icontains`` filter drops
+    entries the database no longer matches. Searches the index cannot
+    narrow down run as plain scans, unranked.
+    """
+
+    index = user_index
+    result_limit = SEARCH_RESULT_LIMIT
+
+    def search(self, queryset, terms, fields):
+        # A lagging replica would leave the index stale for good
+        self.index.ensure_current(User.objects.using(DEFAULT_DB_ALIAS))
+        scores = self.index.search(terms, self.result_limit)
+        if scores is None:
+            return super().search(queryset, terms, fields)
+        return rank_by_scores(super().search(queryset, terms, fields), scores)
+
+
+def get_search_backend(using='default'):
+    """Return the search backend configured for a database alias."""
+    backend_path = getattr(settings, 'USER_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        return TrigramSearchBackend()
+    if vendor == 'sqlite':
+        return NgramSearchBackend()
+    return DatabaseScanBackend()
+
+
+class UserSearchFilter(filters.SearchFilter):
+    """``SearchFilter`` delegating to the indexed backend for the database."""
+
+    def filter_queryset(self, request, queryset, view):
+        fields = getattr(view, 'search_fields', None)
+        terms = self.get_search_terms(request)
+        if not fields or not terms:
+            return queryset
+        return get_search_backend(queryset.db).search(queryset, terms, fields)
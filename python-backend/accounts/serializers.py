@@ -11,8 +11,8 @@ class UserSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = User
-        fields = ['id', 'email', 'name', 'bio', 'profile_picture']
-        read_only_fields = ['id', 'email']
+        fields = ['id', 'email', 'name', 'bio', 'profile_picture', 'friend_count', 'pending_incoming_count']
+        read_only_fields = ['id', 'email', 'friend_count', 'pending_incoming_count']
 
 
 class UserListSerializer(serializers.ModelSerializer):
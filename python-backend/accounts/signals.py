@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from social_backend.cache import bump_user_versions
+from social_backend.replicas import pin_to_primary
+
+from .authentication import recent_users, set_user_active
+from .search import log_user_change, user_index
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, using, update_fields, **kwargs):
+    """Keep the search index, user cache and cached responses in step with saved users."""
+    user_index.add(instance.id, instance.name, instance.email)
+    if {'name', 'email'} & instance.changed_public_fields(update_fields):
+        transaction.on_commit(lambda: log_user_change(instance.id), using=using)
+    recent_users.discard(instance.id)
+    # Users built from token claims are saved without loading is_active, so it did not change
+    if 'is_active' not in instance.get_deferred_fields():
+        active = instance.is_active
+        set_user_active(instance.id, active)
+        # Again on commit, over anything looked up from the old row meanwhile
+        transaction.on_commit(lambda: set_user_active(instance.id, active), using=using)
+    pin_to_primary(instance.id)
+    bump_user_versions(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, using, **kwargs):
+    """Drop deleted users from the in-process search index and user cache, and revoke their tokens."""
+    user_index.remove(instance.id)
+    transaction.on_commit(lambda: log_user_change(instance.id), using=using)
+    recent_users.discard(instance.id)
+    set_user_active(instance.id, False)
+    transaction.on_commit(lambda: set_user_active(instance.id, False), using=using)
+    bump_user_versions(instance.id)
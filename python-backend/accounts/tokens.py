@@ -0,0 +1,20 @@
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# User fields copied into every token so that authenticated requests can
+# rebuild a lightweight user without a database lookup
+USER_CLAIM_FIELDS = ('email', 'name')
+
+
+class UserRefreshToken(RefreshToken):
+    """Refresh token that also carries the user's email and name.
+
+    Access tokens derived from it, including those minted by the refresh
+    endpoint, copy these claims.
+    """
+    
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for field in USER_CLAIM_FIELDS:
+            token[field] = getattr(user, field)
+        return token
@@ -4,12 +4,16 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     RegisterView,
     LoginView,
+    login_async,
     GoogleAuthView,
+    google_auth_async,
 )
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
+    path('login/async/', login_async, name='login-async'),
     path('google/', GoogleAuthView.as_view(), name='google-auth'),
+    path('google/async/', google_auth_async, name='google-auth-async'),
     path('refresh/', TokenRefreshView.as_view(), name='token-refresh'),
 ]
\ No newline at end of file
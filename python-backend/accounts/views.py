@@ -1,13 +1,25 @@
+import json
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.db.models import Q
-from rest_framework import generics, permissions, status, filters
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
-from google.oauth2 import id_token
-from google.auth.transport import requests
 
+from social_backend.async_views import acheck_throttles, error_response
+from social_backend.cache import CachedResponseMixin, ConditionalGetMixin
+from social_backend.pagination import SelectablePagination
+from social_backend.projections import Projection, ProjectedListMixin
+
+from .google import averify_google_token, verify_google_token
+from .hashers import PasswordHashPoolBusy, averify_password, verify_password
+from .search import UserSearchFilter
+from .tokens import UserRefreshToken
 from .serializers import (
     UserSerializer,
     UserListSerializer,
@@ -24,6 +36,7 @@ class RegisterView(generics.CreateAPIView):
     
     queryset = User.objects.all()
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
     serializer_class = RegisterSerializer
     
     def create(self, request, *args, **kwargs):
@@ -32,19 +45,17 @@ class RegisterView(generics.CreateAPIView):
         user = serializer.save()
         
         # Generate token for the new user
-        refresh = RefreshToken.for_user(user)
-        
-        return Response({
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
-            'user': UserSerializer(user).data
-        }, status=status.HTTP_201_CREATED)
+        return Response(token_response_data(user), status=status.HTTP_201_CREATED)
+
+
+LOGINS_BUSY = {'detail': 'Too many logins in progress, please retry shortly.'}
 
 
 class LoginView(APIView):
     """API view for user login with email and password."""
     
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
     
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
@@ -58,23 +69,109 @@ class LoginView(APIView):
         except User.DoesNotExist:
             return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
         
-        if not user.check_password(password):
+        try:
+            valid = verify_password(user, password)
+        except PasswordHashPoolBusy:
+            return Response(LOGINS_BUSY, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        
+        if not valid:
             return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
         
         # Generate token for the authenticated user
-        refresh = RefreshToken.for_user(user)
-        
-        return Response({
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
-            'user': UserSerializer(user).data
-        }, status=status.HTTP_200_OK)
+        return Response(token_response_data(user), status=status.HTTP_200_OK)
+
+
+async def login_async(request):
+    """Async login view for deployments served over ASGI.
+    
+    The password hash is awaited on the hashing pool, so the worker serves
+    other connections while it runs instead of holding a thread.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        await acheck_throttles(Request(request, authenticators=()), LoginView.throttle_scope)
+    except Throttled as exc:
+        return error_response(exc)
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = LoginSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    user = await User.objects.filter(email=serializer.validated_data['email']).afirst()
+    if user is None:
+        return JsonResponse({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    try:
+        valid = await averify_password(user, serializer.validated_data['password'])
+    except PasswordHashPoolBusy:
+        response = JsonResponse(LOGINS_BUSY, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = '1'
+        return response
+    
+    if not valid:
+        return JsonResponse({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+    return JsonResponse(token_response_data(user), status=status.HTTP_200_OK)
+
+
+# Token based like the DRF views; csrf_exempt only wraps async views from Django 5.0
+login_async.csrf_exempt = True
+
+
+def get_or_create_google_user(idinfo):
+    """Return the user for verified Google token claims, creating or linking it."""
+    # Extract user information from the verified token
+    google_id = idinfo['sub']
+    email = idinfo['email']
+    name = idinfo.get('name', '')
+    profile_picture = idinfo.get('picture', '')
+    
+    # Check if user exists
+    try:
+        user = User.objects.get(email=email)
+        # Update Google-specific fields if needed
+        updates = {'is_google_user': True, 'google_id': google_id}
+        if not user.name and name:
+            updates['name'] = name
+        if not user.profile_picture and profile_picture:
+            updates['profile_picture'] = profile_picture
+        # Most logins change nothing, and need not write or invalidate anything
+        changed = [field for field, value in updates.items() if getattr(user, field) != value]
+        for field in changed:
+            setattr(user, field, updates[field])
+        if changed:
+            user.save(update_fields=changed)
+    except User.DoesNotExist:
+        # Create a new user
+        user = User.objects.create_user(
+            email=email,
+            name=name,
+            is_google_user=True,
+            google_id=google_id,
+            profile_picture=profile_picture
+        )
+    return user
+
+
+def token_response_data(user):
+    """Return the token pair and profile sent back after authentication."""
+    refresh = UserRefreshToken.for_user(user)
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+        'user': UserSerializer(user).data
+    }
 
 
 class GoogleAuthView(APIView):
     """API view for Google authentication."""
     
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
     
     def post(self, request):
         serializer = GoogleAuthSerializer(data=request.data)
@@ -83,48 +180,11 @@ class GoogleAuthView(APIView):
         token_id = serializer.validated_data['token_id']
         
         try:
-            # Verify the Google token
-            idinfo = id_token.verify_oauth2_token(
-                token_id, 
-                requests.Request(),
-                settings.GOOGLE_CLIENT_ID
-            )
-            
-            # Extract user information from the verified token
-            google_id = idinfo['sub']
-            email = idinfo['email']
-            name = idinfo.get('name', '')
-            profile_picture = idinfo.get('picture', '')
+            # Verify the Google token against the cached Google certs
+            idinfo = verify_google_token(token_id, settings.GOOGLE_CLIENT_ID)
+            user = get_or_create_google_user(idinfo)
             
-            # Check if user exists
-            try:
-                user = User.objects.get(email=email)
-                # Update Google-specific fields if needed
-                user.is_google_user = True
-                user.google_id = google_id
-                if not user.name and name:
-                    user.name = name
-                if not user.profile_picture and profile_picture:
-                    user.profile_picture = profile_picture
-                user.save()
-            except User.DoesNotExist:
-                # Create a new user
-                user = User.objects.create_user(
-                    email=email,
-                    name=name,
-                    is_google_user=True,
-                    google_id=google_id,
-                    profile_picture=profile_picture
-                )
-            
-            # Generate token
-            refresh = RefreshToken.for_user(user)
-            
-            return Response({
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-                'user': UserSerializer(user).data
-            }, status=status.HTTP_200_OK)
+            return Response(token_response_data(user), status=status.HTTP_200_OK)
             
         except ValueError:
             return Response({'detail': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
@@ -132,24 +192,70 @@ class GoogleAuthView(APIView):
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserProfileView(generics.RetrieveUpdateAPIView):
+async def google_auth_async(request):
+    """Async Google authentication view for deployments served over ASGI.
+    
+    Certificate downloads run off the event loop and the database work runs
+    in Django's sync thread, so a slow Google round trip never blocks the
+    worker.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        # The caller is signing in, so their bucket is their IP address
+        await acheck_throttles(Request(request, authenticators=()), GoogleAuthView.throttle_scope)
+    except Throttled as exc:
+        return error_response(exc)
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = GoogleAuthSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    token_id = serializer.validated_data['token_id']
+    
+    try:
+        idinfo = await averify_google_token(token_id, settings.GOOGLE_CLIENT_ID)
+        user = await sync_to_async(get_or_create_google_user)(idinfo)
+        
+        return JsonResponse(token_response_data(user), status=status.HTTP_200_OK)
+        
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
+    except Exception as e:
+        return JsonResponse({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+# Token based like the DRF views; csrf_exempt only wraps async views from Django 5.0
+google_auth_async.csrf_exempt = True
+
+
+class UserProfileView(ConditionalGetMixin, CachedResponseMixin, generics.RetrieveUpdateAPIView):
     """API view for retrieving and updating user profile."""
     
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_object(self):
-        return self.request.user
+        # request.user may be built from token claims with most fields
+        # deferred; the profile needs every field, so load a fresh row once
+        return User.objects.get(pk=self.request.user.pk)
 
 
-class UserListView(generics.ListAPIView):
+class UserListView(ProjectedListMixin, generics.ListAPIView):
     """API view for listing users, excluding the authenticated user."""
     
     serializer_class = UserListSerializer
+    projection = Projection(UserListSerializer)
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
+    pagination_class = SelectablePagination
+    keyset_ordering = ('id',)
+    filter_backends = [UserSearchFilter]
     search_fields = ['name', 'email']
     
     def get_queryset(self):
         # Exclude the authenticated user from the list
-        return User.objects.exclude(id=self.request.user.id)
\ No newline at end of file
+        return User.objects.exclude(id=self.request.user.id).order_by('id')
\ No newline at end of file
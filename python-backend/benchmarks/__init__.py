@@ -0,0 +1,87 @@
+"""
+Benchmark scripts for the API.
+
+Each module is runnable with ``python -m benchmarks.<name>`` from the
+``python-backend`` directory. Benchmarks run against a throwaway test
+database created from ``DATABASE_URL`` (an in-memory database on SQLite),
+so they never touch development or production data.
+"""
+
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    """Configure Django for a standalone benchmark script."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_backend.settings')
+    # Benchmarks send far more requests per client than the throttles allow;
+    # servers they start inherit the environment
+    os.environ.setdefault('THROTTLE_ENABLED', 'False')
+    import django
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(keepdb=False, test_name=None):
+    """Create a test database for the duration of the block.
+
+    ``test_name`` overrides the test database name, e.g. to put a SQLite
+    database in a file that other processes can open.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    if test_name:
+        connection.settings_dict['TEST']['NAME'] = test_name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def seed_users(count, batch_size=10000, prefix='user', password='!'):
+    """Bulk insert ``count`` users and return their ids.
+
+    ``password`` is stored as is, so pass an already hashed value to make
+    the users able to log in; the default is an unusable password.
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+
+    for start in range(0, count, batch_size):
+        User.objects.bulk_create([
+            User(email=f'{prefix}{i}@bench.test', name=f'Bench User {i}', password=password)
+            for i in range(start, min(start + batch_size, count))
+        ], batch_size=batch_size)
+    return list(
+        User.objects.filter(email__startswith=prefix, email__endswith='@bench.test')
+        .order_by('id').values_list('id', flat=True)
+    )
+
+
+def percentiles(samples):
+    """Summarize latency samples given in milliseconds."""
+    samples = sorted(samples)
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+    }
+
+
+def measure(func, repeat=20, warmup=2):
+    """Run ``func`` repeatedly and return latency percentiles in milliseconds."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return percentiles(samples)
@@ -0,0 +1,520 @@
+"""
+Benchmark every API endpoint on a synthetic social graph.
+
+    python -m benchmarks.api --users 100000 --gunicorn --output report.json
+
+Seeds users whose friend counts follow a power law (a few users with
+thousands of friends, most with a handful), plus pending friend requests,
+then drives each endpoint of ``accounts.urls``, ``accounts.user_urls`` and
+``friends.urls`` with real JWTs:
+
+* through Django's test client, recording latency and the number of SQL
+  queries per request;
+* with ``--gunicorn``, over HTTP against a real gunicorn server, recording
+  latency and throughput under ``--concurrency`` parallel clients.
+
+The JSON report carries the commit and database it was produced on so
+reports from different commits can be compared. The Google endpoints need
+tokens signed by Google and are not benchmarked.
+
+With ``--gunicorn`` on SQLite the database is put in a temporary file. SQLite
+admits one writer across all workers, so expect write endpoints to report
+"database is locked" errors there; use PostgreSQL for write throughput.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from . import benchmark_database, percentiles, seed_users, setup_django
+
+BENCH_PASSWORD = 'bench-password-123'
+
+Call = namedtuple('Call', 'method path body token')
+
+
+def power_law_degrees(count, average, alpha, max_degree, rng):
+    """Draw ``count`` friend counts from a Pareto distribution with the given mean."""
+    # The mean of a Pareto(alpha) variate scaled by x_min is alpha * x_min / (alpha - 1)
+    x_min = average * (alpha - 1) / alpha
+    return [min(int(rng.paretovariate(alpha) * x_min), max_degree) for _ in range(count)]
+
+
+def seed_friendships(user_ids, average_degree, alpha, rng, batch_size=10000):
+    """Connect users at random so that their degrees follow a power law.
+
+    Uses the configuration model: every user gets as many "stubs" as their
+    drawn degree and shuffled stubs are paired up. Self loops and repeated
+    pairs are dropped, which slightly lowers the degree of the hubs.
+    """
+    from friends.models import Friendship
+
+    degrees = power_law_degrees(len(user_ids), average_degree, alpha, len(user_ids) - 1, rng)
+    stubs = array('q')
+    for user_id, degree in zip(user_ids, degrees):
+        stubs.extend(itertools.repeat(user_id, degree))
+    rng.shuffle(stubs)
+
+    pairs = set()
+    created = 0
+    for i in range(0, len(stubs) - 1, 2):
+        a, b = stubs[i], stubs[i + 1]
+        if a != b:
+            pairs.add(Friendship.canonical_pair(a, b))
+        if len(pairs) >= batch_size:
+            created += _insert_friendships(pairs)
+    return created + _insert_friendships(pairs)
+
+
+def _insert_friendships(pairs):
+    from friends.models import Friendship
+
+    Friendship.objects.bulk_create(
+        [Friendship(user1_id=a, user2_id=b) for a, b in pairs], ignore_conflicts=True)
+    count = len(pairs)
+    pairs.clear()
+    return count
+
+
+def seed_pending_requests(user_ids, per_user, rng, batch_size=10000):
+    """Create about ``per_user`` pending requests per user between random non-friends."""
+    from friends.models import FriendRequest, Friendship
+
+    created = 0
+    for start in range(0, len(user_ids), batch_size):
+        senders = user_ids[start:start + batch_size]
+        candidates = {
+            (sender, rng.choice(user_ids))
+            for sender in senders
+            for _ in range(per_user)
+        }
+        candidates = {(a, b) for a, b in candidates if a != b}
+        friends = set(
+            Friendship.objects.filter(user1_id__in=senders).values_list('user1_id', 'user2_id')
+        ) | set(
+            Friendship.objects.filter(user2_id__in=senders).values_list('user2_id', 'user1_id')
+        )
+        requests = [
+            FriendRequest(sender_id=a, receiver_id=b)
+            for a, b in candidates
+            if (a, b) not in friends
+        ]
+        FriendRequest.objects.bulk_create(requests, ignore_conflicts=True)
+        created += len(requests)
+    return created
+
+
+class Workload:
+    """Builds the calls each endpoint is driven with, creating the rows they need."""
+
+    def __init__(self, viewers, rng):
+        from accounts.tokens import UserRefreshToken
+
+        self.rng = rng
+        self.viewers = []
+        for viewer in viewers:
+            refresh = UserRefreshToken.for_user(viewer)
+            self.viewers.append((viewer, str(refresh.access_token), str(refresh)))
+        self.batches = itertools.count()
+        self.targets = None
+
+    def viewer_calls(self, count, method, path, body=None):
+        return [
+            Call(method, path, body, self.viewers[i % len(self.viewers)][1])
+            for i in range(count)
+        ]
+
+    def fresh_users(self, count):
+        """Create users without any friends or requests."""
+        return seed_users(count, prefix=f'fresh{next(self.batches)}-')
+
+    def connection_targets(self):
+        """Pick, once, a user two hops from each viewer, or another viewer if none is."""
+        from friends.models import Friendship
+
+        if self.targets is None:
+            self.targets = []
+            for i, (viewer, _, _) in enumerate(self.viewers):
+                friends = sorted(Friendship.objects.friend_ids(viewer.id))
+                candidates = set()
+                for friend_id in self.rng.sample(friends, min(len(friends), 5)):
+                    candidates |= Friendship.objects.friend_ids(friend_id)
+                candidates.difference_update(friends, [viewer.id])
+                fallback = self.viewers[(i + 1) % len(self.viewers)][0].id
+                self.targets.append(self.rng.choice(sorted(candidates)) if candidates else fallback)
+        return self.targets
+
+    def pending_requests(self, count, per_call):
+        """Create ``per_call`` pending requests to a viewer for each call."""
+        from friends.models import FriendRequest
+
+        senders = self.fresh_users(count * per_call)
+        requests = []
+        for i in range(count):
+            viewer = self.viewers[i % len(self.viewers)][0]
+            for sender_id in senders[i * per_call:(i + 1) * per_call]:
+                requests.append(FriendRequest(sender_id=sender_id, receiver_id=viewer.id))
+        FriendRequest.objects.bulk_create(requests)
+        ids = iter(FriendRequest.objects.filter(sender_id__in=senders).order_by('sender_id').values_list('id', flat=True))
+        return [[next(ids) for _ in range(per_call)] for _ in range(count)]
+
+    def register(self, count):
+        batch = next(self.batches)
+        return [
+            Call('POST', '/api/auth/register/', {
+                'email': f'register{batch}-{i}@bench.test',
+                'name': 'Bench Register',
+                'password': BENCH_PASSWORD,
+                'password_confirm': BENCH_PASSWORD,
+            }, None)
+            for i in range(count)
+        ]
+
+    def login(self, count):
+        return [
+            Call('POST', '/api/auth/login/', {
+                'email': self.viewers[i % len(self.viewers)][0].email,
+                'password': BENCH_PASSWORD,
+            }, None)
+            for i in range(count)
+        ]
+
+    def refresh(self, count):
+        return [
+            Call('POST', '/api/auth/refresh/', {'refresh': self.viewers[i % len(self.viewers)][2]}, None)
+            for i in range(count)
+        ]
+
+    def profile(self, count):
+        return self.viewer_calls(count, 'GET', '/api/users/me/')
+
+    def update_profile(self, count):
+        return [
+            Call('PATCH', '/api/users/me/', {'bio': f'Bio {i}'}, self.viewers[i % len(self.viewers)][1])
+            for i in range(count)
+        ]
+
+    def user_list(self, count):
+        return self.viewer_calls(count, 'GET', '/api/users/')
+
+    def user_list_deep(self, count):
+        return self.viewer_calls(count, 'GET', '/api/users/?page=50')
+
+    def user_search(self, count):
+        return self.viewer_calls(count, 'GET', '/api/users/?search=user12')
+
+    def friend_list(self, count):
+        return self.viewer_calls(count, 'GET', '/api/friends/')
+
+    def friend_request_list(self, count):
+        return self.viewer_calls(count, 'GET', '/api/friends/requests/')
+
+    def suggestions(self, count):
+        return self.viewer_calls(count, 'GET', '/api/friends/suggestions/')
+
+    def connection_calls(self, count, path):
+        targets = self.connection_targets()
+        return [
+            Call('GET', f'/api/friends/{path}/{target}/', None, token)
+            for (_, token, _), target in zip(itertools.islice(itertools.cycle(self.viewers), count),
+                                             itertools.cycle(targets))
+        ]
+
+    def mutual_friends(self, count):
+        return self.connection_calls(count, 'mutual')
+
+    def friend_path(self, count):
+        return self.connection_calls(count, 'path')
+
+    def send_request(self, count):
+        targets = self.fresh_users(count)
+        return [
+            Call('POST', f'/api/friends/requests/{target}/', None, self.viewers[i % len(self.viewers)][1])
+            for i, target in enumerate(targets)
+        ]
+
+    def respond(self, count, action):
+        return [
+            Call('PUT', f'/api/friends/requests/{ids[0]}/{action}/', None, self.viewers[i % len(self.viewers)][1])
+            for i, ids in enumerate(self.pending_requests(count, 1))
+        ]
+
+    def accept_request(self, count):
+        return self.respond(count, 'accept')
+
+    def reject_request(self, count):
+        return self.respond(count, 'reject')
+
+    def batch_send(self, count, per_call=10):
+        targets = self.fresh_users(count * per_call)
+        return [
+            Call('POST', '/api/friends/requests/batch/',
+                 {'user_ids': targets[i * per_call:(i + 1) * per_call]},
+                 self.viewers[i % len(self.viewers)][1])
+            for i in range(count)
+        ]
+
+    def batch_respond(self, count, action, per_call=10):
+        return [
+            Call('PUT', f'/api/friends/requests/batch/{action}/', {'request_ids': ids},
+                 self.viewers[i % len(self.viewers)][1])
+            for i, ids in enumerate(self.pending_requests(count, per_call))
+        ]
+
+    def batch_accept(self, count):
+        return self.batch_respond(count, 'accept')
+
+    def batch_reject(self, count):
+        return self.batch_respond(count, 'reject')
+
+
+ENDPOINTS = {
+    'register': 'register',
+    'login': 'login',
+    'token-refresh': 'refresh',
+    'user-profile': 'profile',
+    'user-profile-update': 'update_profile',
+    'user-list': 'user_list',
+    'user-list-page-50': 'user_list_deep',
+    'user-search': 'user_search',
+    'friend-list': 'friend_list',
+    'friend-request-list': 'friend_request_list',
+    'friend-suggestions': 'suggestions',
+    'mutual-friends': 'mutual_friends',
+    'friend-path': 'friend_path',
+    'send-friend-request': 'send_request',
+    'accept-friend-request': 'accept_request',
+    'reject-friend-request': 'reject_request',
+    'batch-send-friend-requests': 'batch_send',
+    'batch-accept-friend-requests': 'batch_accept',
+    'batch-reject-friend-requests': 'batch_reject',
+}
+
+
+def request_headers(call):
+    headers = {'Content-Type': 'application/json'}
+    if call.token:
+        headers['Authorization'] = f'Bearer {call.token}'
+    return headers
+
+
+def run_test_client(calls, warmup):
+    """Send the calls one by one through Django's test client."""
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client()
+    samples, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for i, call in enumerate(calls):
+        if i == warmup:
+            started = time.perf_counter()
+        extra = {'HTTP_AUTHORIZATION': f'Bearer {call.token}'} if call.token else {}
+        data = json.dumps(call.body) if call.body is not None else ''
+        with CaptureQueriesContext(connection) as captured:
+            sent = time.perf_counter()
+            response = client.generic(call.method, call.path, data, content_type='application/json', **extra)
+            elapsed = (time.perf_counter() - sent) * 1000
+        if i < warmup:
+            continue
+        samples.append(elapsed)
+        queries.append(len(captured.captured_queries))
+        errors += response.status_code >= 400
+    duration = time.perf_counter() - started
+    return dict(
+        percentiles(samples),
+        queries_per_request=round(sum(queries) / len(queries), 2),
+        throughput_rps=round(len(samples) / duration, 1),
+        errors=errors,
+    )
+
+
+def send_http(base_url, call):
+    body = json.dumps(call.body).encode('utf-8') if call.body is not None else None
+    request = urllib.request.Request(base_url + call.path, data=body, method=call.method,
+                                     headers=request_headers(call))
+    sent = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return (time.perf_counter() - sent) * 1000, status
+
+
+def run_http(base_url, calls, warmup, concurrency):
+    """Send the calls over HTTP from ``concurrency`` parallel clients."""
+    for call in calls[:warmup]:
+        send_http(base_url, call)
+    measured = calls[warmup:]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda call: send_http(base_url, call), measured))
+    duration = time.perf_counter() - started
+    return dict(
+        percentiles([elapsed for elapsed, _ in results]),
+        throughput_rps=round(len(results) / duration, 1),
+        errors=sum(status >= 400 for _, status in results),
+        statuses=sorted({status for _, status in results}),
+    )
+
+
+def database_url(settings_dict):
+    """Return a ``DATABASE_URL`` pointing other processes at the benchmark database."""
+    engine = settings_dict['ENGINE']
+    if 'sqlite' in engine:
+        return f"sqlite:///{settings_dict['NAME']}"
+    scheme = {'postgresql': 'postgres', 'mysql': 'mysql'}[engine.rsplit('.', 1)[-1]]
+    return (f"{scheme}://{settings_dict['USER']}:{settings_dict['PASSWORD']}"
+            f"@{settings_dict['HOST'] or 'localhost'}:{settings_dict['PORT'] or ''}/{settings_dict['NAME']}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(settings_dict, workers, threads, app='social_backend.wsgi:application',
+                   worker_class='sync', env=None):
+    """Start gunicorn on the benchmark database and wait until it answers."""
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url(settings_dict), DEBUG='False', **(env or {}))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', app, '--worker-class', worker_class,
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads),
+         '--log-level', 'warning'],
+        env=env,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            send_http(base_url, Call('GET', '/api/users/', None, None))
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--average-degree', type=float, default=20)
+    parser.add_argument('--alpha', type=float, default=2.1,
+                        help='Pareto exponent of the friend count distribution')
+    parser.add_argument('--pending', type=int, default=2, help='pending requests per user')
+    parser.add_argument('--viewers', type=int, default=50, help='distinct authenticated users')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--endpoints', nargs='*', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument('--gunicorn', action='store_true', help='also benchmark over HTTP')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.cache import cache
+    from django.db import connection
+
+    # Allow the test client's host and skip the per-request debug query log
+    settings.ALLOWED_HOSTS = ['*']
+    settings.DEBUG = False
+    User = get_user_model()
+    rng = random.Random(args.seed)
+
+    test_name = None
+    if args.gunicorn and connection.vendor == 'sqlite':
+        # gunicorn workers cannot see an in-memory database
+        test_name = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+
+    with benchmark_database(test_name=test_name):
+        print(f'Seeding {args.users} users...')
+        started = time.perf_counter()
+        user_ids = seed_users(args.users, password=make_password(BENCH_PASSWORD))
+        friendships = seed_friendships(user_ids, args.average_degree, args.alpha, rng)
+        pending = seed_pending_requests(user_ids, args.pending, rng)
+        print(f'Seeded {friendships} friendships and {pending} pending requests '
+              f'in {time.perf_counter() - started:.1f}s')
+
+        viewers = list(User.objects.filter(id__in=rng.sample(user_ids, min(args.viewers, len(user_ids)))))
+        workload = Workload(viewers, rng)
+
+        server = None
+        if args.gunicorn:
+            server = start_gunicorn(connection.settings_dict, args.workers, args.threads)
+
+        report = {
+            'commit': git_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'graph': {
+                'users': args.users,
+                'friendships': friendships,
+                'pending_requests': pending,
+                'average_degree': args.average_degree,
+                'alpha': args.alpha,
+            },
+            'requests_per_endpoint': args.requests,
+            'endpoints': {},
+        }
+        try:
+            print(f"{'endpoint':<30} {'p50 ms':>8} {'p99 ms':>8} {'queries':>8} {'req/s':>8}"
+                  + (f" {'http p50':>9} {'http p99':>9} {'http req/s':>10}" if server else ''))
+            for name in args.endpoints:
+                build = getattr(workload, ENDPOINTS[name])
+                cache.clear()
+                result = {'test_client': run_test_client(build(args.requests + args.warmup), args.warmup)}
+                line = (f"{name:<30} {result['test_client']['p50_ms']:>8} {result['test_client']['p99_ms']:>8} "
+                        f"{result['test_client']['queries_per_request']:>8} {result['test_client']['throughput_rps']:>8}")
+                if server:
+                    result['gunicorn'] = run_http(server[1], build(args.requests + args.warmup),
+                                                  args.warmup, args.concurrency)
+                    line += (f" {result['gunicorn']['p50_ms']:>9} {result['gunicorn']['p99_ms']:>9} "
+                             f"{result['gunicorn']['throughput_rps']:>10}")
+                report['endpoints'][name] = result
+                print(line)
+        finally:
+            if server:
+                server[0].terminate()
+                server[0].wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare the sync friend views under WSGI with the async ones under ASGI.
+
+    python -m benchmarks.asgi --users 10000 --concurrency 1 8 32 128
+
+Starts one gunicorn worker serving the WSGI application with the sync
+views, and one uvicorn worker (through gunicorn) serving the ASGI
+application with ``ASYNC_FRIEND_VIEWS=True``, then loads the read-only
+friend endpoints at growing numbers of concurrent connections. A sync worker
+serves ``--threads`` requests at a time; an async worker keeps accepting
+connections while its views wait on the database, so the difference grows
+with database latency and is smallest on a local SQLite file.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+
+from . import benchmark_database, seed_users, setup_django
+from .api import Workload, run_http, seed_friendships, seed_pending_requests, start_gunicorn
+
+DEPLOYMENTS = {
+    'wsgi': {'app': 'social_backend.wsgi:application', 'worker_class': 'sync',
+             'env': {'ASYNC_FRIEND_VIEWS': 'False'}},
+    'asgi': {'app': 'social_backend.asgi:application', 'worker_class': 'uvicorn.workers.UvicornWorker',
+             'env': {'ASYNC_FRIEND_VIEWS': 'True'}},
+}
+
+ENDPOINTS = {
+    'friend-list': 'friend_list',
+    'friend-request-list': 'friend_request_list',
+    'friend-suggestions': 'suggestions',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--viewers', type=int, default=500, help='distinct authenticated users')
+    parser.add_argument('--requests', type=int, default=500, help='requests per concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--threads', type=int, default=4, help='threads of the sync worker')
+    parser.add_argument('--endpoints', nargs='*', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+
+    rng = random.Random(args.seed)
+    test_name = None
+    if connection.vendor == 'sqlite':
+        # The servers cannot see an in-memory database
+        test_name = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+
+    with benchmark_database(test_name=test_name):
+        print(f'Seeding {args.users} users...')
+        user_ids = seed_users(args.users)
+        seed_friendships(user_ids, 20, 2.1, rng)
+        seed_pending_requests(user_ids, 2, rng)
+        viewers = get_user_model().objects.filter(id__in=rng.sample(user_ids, min(args.viewers, len(user_ids))))
+        workload = Workload(list(viewers), rng)
+
+        print(f"{'deployment':<10} {'endpoint':<22} {'conns':>6} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name, deployment in DEPLOYMENTS.items():
+            threads = args.threads if deployment['worker_class'] == 'sync' else 1
+            process, base_url = start_gunicorn(connection.settings_dict, 1, threads, **deployment)
+            try:
+                for endpoint in args.endpoints:
+                    build = getattr(workload, ENDPOINTS[endpoint])
+                    for concurrency in args.concurrency:
+                        result = run_http(base_url, build(args.requests), 0, concurrency)
+                        print(f"{name:<10} {endpoint:<22} {concurrency:>6} {result['throughput_rps']:>8} "
+                              f"{result['p50_ms']:>9} {result['p99_ms']:>9} {result['errors']:>7}")
+            finally:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == '__main__':
+    main()
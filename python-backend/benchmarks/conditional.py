@@ -0,0 +1,79 @@
+"""
+Measure what conditional GETs save on unchanged profile and list reads.
+
+    python -m benchmarks.conditional --friends 100 --repeat 500
+
+Seeds a user with ``--friends`` friendships and as many incoming friend
+requests, then sends ``--repeat`` GETs of ``/api/users/me/``,
+``/api/friends/`` and ``/api/friends/requests/`` through the test client
+twice: once as a client without a cached copy, and once revalidating its
+copy with ``If-None-Match``, which is answered with ``304 Not Modified``.
+
+Reports, per request, the bytes of the response (status line excluded),
+the CPU time spent in the process and the queries run. The friend list's
+plain GETs are served from the response cache, so its savings are those
+of a client revalidating a response the server already has cached.
+"""
+
+import argparse
+import time
+
+from . import benchmark_database, seed_users, setup_django
+
+
+def response_bytes(response):
+    headers = sum(len(f'{name}: {value}\r\n') for name, value in response.items())
+    return headers + len(response.content)
+
+
+def run(client, url, repeat, headers):
+    """Send ``repeat`` GETs; return bytes, CPU microseconds and queries per request."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    total_bytes = 0
+    with CaptureQueriesContext(connection) as queries:
+        started = time.process_time()
+        for _ in range(repeat):
+            response = client.get(url, headers=headers)
+            total_bytes += response_bytes(response)
+        cpu = time.process_time() - started
+    return total_bytes / repeat, cpu / repeat * 1e6, len(queries) / repeat, response.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--friends', type=int, default=100)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from rest_framework.test import APIClient
+
+    from friends.models import FriendRequest, Friendship
+
+    with benchmark_database():
+        ids = seed_users(args.friends * 2 + 1)
+        viewer_id, friends, senders = ids[0], ids[1:args.friends + 1], ids[args.friends + 1:]
+        Friendship.objects.bulk_create([Friendship(user1_id=viewer_id, user2_id=other) for other in friends])
+        FriendRequest.objects.bulk_create([FriendRequest(sender_id=other, receiver_id=viewer_id) for other in senders])
+        client = APIClient()
+        client.force_authenticate(user=get_user_model().objects.get(id=viewer_id))
+
+        print(f"{'endpoint':<40} {'request':<12} {'status':>6} {'bytes':>8} {'cpu us':>8} {'queries':>8}")
+        for url in ('/api/users/me/', f'/api/friends/?page_size={args.page_size}',
+                    f'/api/friends/requests/?page_size={args.page_size}'):
+            etag = client.get(url)['ETag']
+            results = {}
+            for label, headers in (('full', {}), ('conditional', {'If-None-Match': etag})):
+                results[label] = run(client, url, args.repeat, headers)
+                size, cpu, queries, status = results[label]
+                print(f'{url:<40} {label:<12} {status:>6} {size:>8.0f} {cpu:>8.0f} {queries:>8.1f}')
+            (full_size, full_cpu, *_), (size, cpu, *_) = results['full'], results['conditional']
+            print(f"{'':<40} {'saved':<12} {'':>6} {1 - size / full_size:>8.0%} {1 - cpu / full_cpu:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Measure the in-memory friend graph: memory per friendship and lookup latency.
+
+    python -m benchmarks.graph --edges 10000000
+
+Builds a ``friends.graph.FriendGraph`` straight from ``--edges`` synthetic
+friendships whose degrees follow a power law (no database involved) and
+reports:
+
+* build time and the bytes per friendship of the CSR arrays, next to a
+  ``dict`` of ``set`` adjacency measured on a sample of the same graph;
+* mean latency in microseconds of ``are_friends``, ``friend_ids``,
+  ``mutual_friend_ids`` and ``shortest_path`` (up to ``--hops``) on random
+  users.
+
+With ``--orm-users`` it also seeds that many users with friendships into a
+test database and times ``Friendship.objects.are_friends``/``friend_ids``
+against the graph loaded from the same rows.
+"""
+
+import argparse
+import itertools
+import random
+import sys
+import time
+from array import array
+
+from . import benchmark_database, seed_users, setup_django
+from .api import power_law_degrees, seed_friendships
+
+
+def power_law_edges(users, edges, alpha, rng):
+    """Return ``(user1_ids, user2_ids)`` of about ``edges`` configuration model friendships."""
+    degrees = power_law_degrees(users, 2 * edges / users, alpha, users - 1, rng)
+    stubs = array('q')
+    for user_id, degree in enumerate(degrees, start=1):
+        stubs.extend(itertools.repeat(user_id, degree))
+    rng.shuffle(stubs)
+    user1_ids, user2_ids = array('q'), array('q')
+    for a, b in zip(stubs[::2], stubs[1::2]):
+        # Repeated pairs are kept: they cost the same as distinct ones
+        if a != b:
+            user1_ids.append(min(a, b))
+            user2_ids.append(max(a, b))
+    return user1_ids, user2_ids
+
+
+def dict_of_sets_bytes_per_edge(user1_ids, user2_ids, sample):
+    """Measure the deep size of ``{user: {friends}}`` adjacency over the first ``sample`` edges."""
+    adjacency = {}
+    for a, b in zip(user1_ids[:sample], user2_ids[:sample]):
+        adjacency.setdefault(a, set()).add(b)
+        adjacency.setdefault(b, set()).add(a)
+    size = sys.getsizeof(adjacency)
+    for user_id, friends in adjacency.items():
+        size += sys.getsizeof(user_id) + sys.getsizeof(friends) + sum(map(sys.getsizeof, friends))
+    return size / min(sample, len(user1_ids))
+
+
+def per_call_us(func, args):
+    started = time.perf_counter()
+    for arg in args:
+        func(*arg)
+    return (time.perf_counter() - started) / len(args) * 1e6
+
+
+def time_lookups(graph, user_ids, samples, hops, rng):
+    users = [(rng.choice(user_ids),) for _ in range(samples)]
+    pairs = [(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(samples)]
+    friend_pairs = [(a, friends[rng.randrange(len(friends))]) for (a,) in users
+                    if (friends := graph.friend_ids(a))]
+    return {
+        'are_friends': per_call_us(graph.are_friends, pairs),
+        'friend_ids': per_call_us(graph.friend_ids, users),
+        'mutual_friend_ids': per_call_us(graph.mutual_friend_ids, friend_pairs),
+        f'path <= {hops} hops': per_call_us(lambda a, b: graph.shortest_path(a, b, hops),
+                                            pairs[:max(1, samples // 10)]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--edges', type=int, default=10_000_000)
+    parser.add_argument('--average-degree', type=float, default=20)
+    parser.add_argument('--alpha', type=float, default=2.1,
+                        help='Pareto exponent of the friend count distribution')
+    parser.add_argument('--samples', type=int, default=20000, help='lookups timed per operation')
+    parser.add_argument('--hops', type=int, default=3)
+    parser.add_argument('--orm-users', type=int, default=0, help='also compare with ORM lookups on this many users')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    setup_django()
+    from friends.graph import FriendGraph
+
+    rng = random.Random(args.seed)
+    users = int(2 * args.edges / args.average_degree)
+    started = time.perf_counter()
+    user1_ids, user2_ids = power_law_edges(users, args.edges, args.alpha, rng)
+    print(f'Generated {len(user1_ids)} friendships between {users} users in {time.perf_counter() - started:.1f}s')
+
+    graph = FriendGraph()
+    started = time.perf_counter()
+    graph.load_edges(user1_ids, user2_ids)
+    elapsed = time.perf_counter() - started
+    print(f'Built the graph in {elapsed:.1f}s ({graph.edge_count / elapsed:.0f} friendships/s)')
+    print(f'CSR arrays: {graph.memory_bytes() / 2 ** 20:.1f} MiB, '
+          f'{graph.memory_bytes() / graph.edge_count:.1f} bytes per friendship')
+    print(f'dict of sets: {dict_of_sets_bytes_per_edge(user1_ids, user2_ids, 200000):.1f} bytes per friendship')
+    del user1_ids, user2_ids
+
+    print(f"{'lookup':<18} {'us/call':>10}")
+    for label, us in time_lookups(graph, range(1, users + 1), args.samples, args.hops, rng).items():
+        print(f'{label:<18} {us:>10.2f}')
+
+    if args.orm_users:
+        from friends.models import Friendship
+
+        with benchmark_database():
+            user_ids = seed_users(args.orm_users)
+            seed_friendships(user_ids, args.average_degree, args.alpha, rng)
+            graph = FriendGraph()
+            graph.load()
+            pairs = [(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(min(args.samples, 5000))]
+            print(f"\n{args.orm_users} users in {Friendship.objects.db}, us/call")
+            print(f"{'lookup':<16} {'orm':>10} {'graph':>10}")
+            for label, orm, in_memory in (
+                ('are_friends', Friendship.objects.are_friends, graph.are_friends),
+                ('friend_ids', lambda a, b: Friendship.objects.friend_ids(a), lambda a, b: graph.friend_ids(a)),
+            ):
+                print(f'{label:<16} {per_call_us(orm, pairs):>10.2f} {per_call_us(in_memory, pairs):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
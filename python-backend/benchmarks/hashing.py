@@ -0,0 +1,89 @@
+"""
+Compare login password verification throughput per hasher.
+
+    python -m benchmarks.hashing --threads 8 --seconds 5
+
+For each hasher, ``--threads`` client threads verify a password for
+``--seconds``, either directly on the client thread (as ``check_password``
+did on the request thread) or through ``accounts.hashers.verify_password``
+and its bounded pool. Throughput is reported in logins per second and per
+CPU core, with the latency each client saw.
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from . import percentiles, setup_django
+
+PASSWORD = 'correct horse battery staple'
+
+HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'accounts.hashers.TunedScryptPasswordHasher',
+    'accounts.hashers.TunedArgon2PasswordHasher',
+]
+
+
+def run_clients(verify, threads, seconds):
+    """Call ``verify`` from ``threads`` threads for ``seconds``; return throughput and latencies."""
+    samples = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            assert verify()
+            local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(samples) / (time.perf_counter() - started), samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=8, help='concurrent logins')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.hashers import check_password, make_password
+    from django.utils.module_loading import import_string
+
+    from accounts.hashers import PasswordHashPool, check_encoded_password
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    pool = PasswordHashPool(max_workers=cores, max_pending=args.threads, timeout=60)
+    print(f'{cores} cores, {args.threads} client threads')
+    print(f"{'hasher':<28} {'path':<8} {'logins/s':>9} {'per core':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for path in HASHERS:
+        try:
+            hasher = import_string(path)()
+            encoded = make_password(PASSWORD, hasher=hasher)
+        except ValueError as e:
+            # Argon2 without argon2-cffi installed
+            print(f'{path.rsplit(".", 1)[-1]:<28} skipped: {e}')
+            continue
+
+        for label, verify in (
+            ('inline', lambda: check_password(PASSWORD, encoded)),
+            ('pool', lambda: pool.run(check_encoded_password, PASSWORD, encoded)[0]),
+        ):
+            throughput, samples = run_clients(verify, args.threads, args.seconds)
+            latency = percentiles(samples)
+            print(f'{path.rsplit(".", 1)[-1]:<28} {label:<8} {throughput:>9.1f} {throughput / cores:>9.1f} '
+                  f"{latency['p50_ms']:>8} {latency['p99_ms']:>8}")
+
+
+if __name__ == '__main__':
+    main()
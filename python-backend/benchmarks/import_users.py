@@ -0,0 +1,106 @@
+"""
+Measure bulk import throughput against one-at-a-time user creation.
+
+    python -m benchmarks.import_users --users 100000 --workers 8
+
+Writes a CSV of ``--users`` synthetic users with plain passwords and a CSV
+of power-law friendship edges between them, then reports rows per second
+for:
+
+* ``UserManager.create_user`` on the first ``--baseline`` users, one
+  hash and one ``INSERT`` per user, as onboarding did before;
+* ``accounts.importing.BulkImporter`` on all users (``COPY`` on PostgreSQL,
+  ``bulk_create`` elsewhere), with passwords hashed on ``--workers``
+  processes;
+* the same importer on the friendship edges.
+
+Pass ``--prehashed`` to ship every user with a ready ``password_hash`` and
+measure the loading path alone.
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import random
+import tempfile
+import time
+
+from . import benchmark_database, setup_django
+from .api import power_law_degrees
+
+
+def write_users(path, count, prehashed):
+    from django.contrib.auth.hashers import make_password
+
+    # Hashing once and reusing it keeps --prehashed files quick to write
+    encoded = make_password('import-password') if prehashed else ''
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['email', 'name', 'password', 'password_hash', 'bio'])
+        for i in range(count):
+            writer.writerow([f'import{i}@bench.test', f'Imported User {i}',
+                             '' if prehashed else f'password-{i}', encoded, 'Migrated account'])
+
+
+def write_friendships(path, count, average_degree, alpha, rng):
+    """Write configuration model edges between the users; return the number written."""
+    degrees = power_law_degrees(count, average_degree, alpha, count - 1, rng)
+    stubs = list(itertools.chain.from_iterable(itertools.repeat(i, d) for i, d in enumerate(degrees)))
+    rng.shuffle(stubs)
+    written = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user1_email', 'user2_email'])
+        for a, b in zip(stubs[::2], stubs[1::2]):
+            writer.writerow([f'import{a}@bench.test', f'import{b}@bench.test'])
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--average-degree', type=float, default=20)
+    parser.add_argument('--alpha', type=float, default=2.1,
+                        help='Pareto exponent of the friend count distribution')
+    parser.add_argument('--baseline', type=int, default=200, help='users created one at a time')
+    parser.add_argument('--workers', type=int, default=None, help='hashing processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--prehashed', action='store_true', help='import ready password hashes')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+
+    from accounts.importing import BulkImporter, read_records
+
+    User = get_user_model()
+    directory = tempfile.mkdtemp()
+    users_path = os.path.join(directory, 'users.csv')
+    edges_path = os.path.join(directory, 'friendships.csv')
+    write_users(users_path, args.users, args.prehashed)
+    edges = write_friendships(edges_path, args.users, args.average_degree, args.alpha, random.Random(args.seed))
+    print(f'{args.users} users and {edges} friendship edges on {connection.vendor}')
+
+    with benchmark_database():
+        started = time.perf_counter()
+        for i in range(args.baseline):
+            User.objects.create_user(email=f'baseline{i}@bench.test', password=f'password-{i}',
+                                     name=f'Baseline User {i}')
+        baseline = args.baseline / (time.perf_counter() - started)
+        print(f"{'create_user':<24} {baseline:>10.0f} rows/s")
+
+        importer = BulkImporter(connection, batch_size=args.batch_size, workers=args.workers)
+        for label, load, path in (
+            ('import users', importer.import_users, users_path),
+            ('import friendships', importer.import_friendships, edges_path),
+        ):
+            totals = load(read_records(path))
+            print(f'{label:<24} {totals.rate:>10.0f} rows/s  ({totals.created} created, {totals.skipped} skipped)')
+
+
+if __name__ == '__main__':
+    main()
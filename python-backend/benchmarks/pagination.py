@@ -0,0 +1,65 @@
+"""
+Compare page-number and keyset pagination on the user list at growing depths.
+
+    python -m benchmarks.pagination --users 1000000
+
+Page-number pages run ``COUNT(*)`` plus ``OFFSET n``, so their latency grows
+with the depth of the page; keyset pages resume from the cursor with an index
+range scan and should stay flat.
+"""
+
+import argparse
+import base64
+import json
+
+from . import benchmark_database, measure, seed_users, setup_django
+
+
+def make_cursor(user_id):
+    payload = json.dumps([str(user_id)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.settings import api_settings
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from accounts.views import UserListView
+
+    with benchmark_database():
+        print(f'Seeding {args.users} users...')
+        ids = seed_users(args.users)
+        viewer_id = ids[0]
+        from django.contrib.auth import get_user_model
+        viewer = get_user_model().objects.get(id=viewer_id)
+
+        factory = APIRequestFactory()
+        view = UserListView.as_view()
+        page_size = api_settings.PAGE_SIZE
+
+        def fetch(query):
+            request = factory.get('/api/users/', query)
+            force_authenticate(request, user=viewer)
+            response = view(request)
+            assert response.status_code == 200, response.status_code
+
+        print(f"{'offset':>10} {'page p50 ms':>12} {'page p99 ms':>12} {'keyset p50 ms':>14} {'keyset p99 ms':>14}")
+        max_offset = max(len(ids) - page_size - 1, 0)
+        for offset in sorted({0, max_offset // 100, max_offset // 10, max_offset // 2, max_offset}):
+            page = offset // page_size + 1
+            # The viewer (ids[0]) is excluded, so the page starts right after this id
+            cursor = make_cursor(ids[(page - 1) * page_size])
+            by_page = measure(lambda: fetch({'page': page}), repeat=args.repeat)
+            by_cursor = measure(lambda: fetch({'cursor': cursor}), repeat=args.repeat)
+            print(f"{(page - 1) * page_size:>10} {by_page['p50_ms']:>12} {by_page['p99_ms']:>12} "
+                  f"{by_cursor['p50_ms']:>14} {by_cursor['p99_ms']:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare indexed user search against an unindexed icontains scan.
+
+    python -m benchmarks.search --users 1000000
+
+On SQLite this exercises the in-process n-gram index; on PostgreSQL the
+pg_trgm indexes created by the accounts migrations. The scan returns the
+first ten matches unranked and stops early on common terms, so it is the
+rare and missing terms that show the full-table cost the index avoids.
+"""
+
+import argparse
+import random
+import time
+
+from . import benchmark_database, measure, setup_django
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda',
+               'David', 'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica',
+               'Aarav', 'Mei', 'Olusegun', 'Ingrid', 'Mateo', 'Yuki', 'Fatima', 'Nikolai']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas',
+              'Okafor', 'Lindqvist', 'Tanaka', 'Kowalski', 'Haddad', 'Novak', 'Sato', 'Dubois']
+DOMAINS = ['example.com', 'mail.test', 'corp.test', 'school.test']
+TERMS = ['smith', 'okafor', 'jennifer lopez', 'lindq', 'user123456@', 'zzzz']
+
+
+def seed_named_users(count, batch_size=10000, seed=42):
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    rng = random.Random(seed)
+    for start in range(0, count, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, count)):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            batch.append(User(
+                email=f'{first.lower()}.{last.lower()}{i}@{rng.choice(DOMAINS)}',
+                name=f'{first} {last}',
+                password='!',
+            ))
+        User.objects.bulk_create(batch, batch_size=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+
+    from accounts.search import DatabaseScanBackend, get_search_backend, user_index
+
+    User = get_user_model()
+    with benchmark_database():
+        print(f'Seeding {args.users} users...')
+        seed_named_users(args.users)
+
+        backend = get_search_backend()
+        scan = DatabaseScanBackend()
+        fields = ['name', 'email']
+        queryset = User.objects.order_by('id')
+
+        if backend.__class__.__name__ == 'NgramSearchBackend':
+            started = time.perf_counter()
+            user_index.load(User.objects.all())
+            print(f'n-gram index built in {time.perf_counter() - started:.2f}s '
+                  f'({len(user_index.postings)} grams)')
+
+        def first_page(search_backend, terms):
+            return list(search_backend.search(queryset, terms, fields)[:10])
+
+        print(f"backend: {backend.__class__.__name__}")
+        print(f"{'term':<16} {'matches':>8} {'scan p50 ms':>12} {'indexed p50 ms':>15} {'indexed p99 ms':>15}")
+        for term in TERMS:
+            terms = term.split()
+            matches = scan.search(queryset, terms, fields).count()
+            by_scan = measure(lambda: first_page(scan, terms), repeat=args.repeat)
+            by_index = measure(lambda: first_page(backend, terms), repeat=args.repeat)
+            print(f"{term:<16} {matches:>8} {by_scan['p50_ms']:>12} "
+                  f"{by_index['p50_ms']:>15} {by_index['p99_ms']:>15}")
+
+
+if __name__ == '__main__':
+    main()
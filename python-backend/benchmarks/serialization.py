@@ -0,0 +1,91 @@
+"""
+Compare serializer and projection throughput on a page of list rows.
+
+    python -m benchmarks.serialization --rows 1000
+
+Builds one page of ``--rows`` users, friendships and friend requests, then
+times turning the page into response bytes two ways:
+
+* ``serializer``: model instances (with ``select_related``) through the
+  list endpoint's ``ModelSerializer`` and DRF's ``JSONRenderer``;
+* ``projection``: ``.values()`` rows through the endpoint's compiled
+  projection and the orjson renderer.
+
+Fetching is timed apart from serializing and rendering, and each pair of
+outputs is checked to be byte-identical.
+"""
+
+import argparse
+
+from . import benchmark_database, measure, seed_users, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000, help='rows per page')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db.models import Q
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory
+
+    from accounts.serializers import UserListSerializer
+    from accounts.views import UserListView
+    from friends.models import FriendRequest, Friendship
+    from friends.serializers import FriendRequestSerializer, FriendshipSerializer
+    from friends.views import FriendListView, FriendRequestListView
+    from social_backend.renderers import ORJSONRenderer
+
+    with benchmark_database():
+        ids = seed_users(args.rows + 1)
+        viewer_id, others = ids[0], ids[1:]
+        Friendship.objects.bulk_create([Friendship(user1_id=viewer_id, user2_id=other) for other in others])
+        FriendRequest.objects.bulk_create([FriendRequest(sender_id=other, receiver_id=viewer_id) for other in others])
+        request = APIRequestFactory().get('/')
+        User = get_user_model()
+        request.user = User.objects.get(id=viewer_id)
+
+        cases = [
+            ('users', UserListSerializer, UserListView.projection,
+             User.objects.exclude(id=viewer_id).order_by('id'), ()),
+            ('friendships', FriendshipSerializer, FriendListView.projection,
+             Friendship.objects.for_user(viewer_id).order_by('-created_at', '-id'), ('user1', 'user2')),
+            ('friend requests', FriendRequestSerializer, FriendRequestListView.projection,
+             FriendRequest.objects.filter(Q(sender_id=viewer_id) | Q(receiver_id=viewer_id))
+             .order_by('-created_at', '-id'), ('sender', 'receiver')),
+        ]
+        print(f"{args.rows}-row page, rows/s")
+        print(f"{'list':<16} {'path':<11} {'fetch':>10} {'serialize':>10} {'render':>10} {'total':>10}")
+        for label, serializer_class, projection, base, related in cases:
+            objects = list(base.select_related(*related))
+            rows = list(projection.values(base))
+
+            def serialize_objects():
+                return serializer_class(objects, many=True, context={'request': request}).data
+
+            def serialize_rows():
+                return projection.serialize(rows, request)
+
+            outputs = {}
+            for path, fetch, serialize, renderer in (
+                ('serializer', lambda: list(base.select_related(*related)), serialize_objects, JSONRenderer()),
+                ('projection', lambda: list(projection.values(base)), serialize_rows, ORJSONRenderer()),
+            ):
+                data = serialize()
+                outputs[path] = renderer.render(data)
+                timings = {
+                    'fetch': measure(fetch, repeat=args.repeat)['p50_ms'],
+                    'serialize': measure(serialize, repeat=args.repeat)['p50_ms'],
+                    'render': measure(lambda: renderer.render(data), repeat=args.repeat)['p50_ms'],
+                }
+                timings['total'] = sum(timings.values())
+                print(f'{label:<16} {path:<11} ' + ' '.join(
+                    f'{args.rows / (ms / 1000):>10.0f}' for ms in timings.values()))
+            assert outputs['serializer'] == outputs['projection'], f'{label} output differs'
+
+
+if __name__ == '__main__':
+    main()
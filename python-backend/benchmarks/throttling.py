@@ -0,0 +1,129 @@
+"""
+Measure what a throttle check adds to a request.
+
+    python -m benchmarks.throttling --checks 100000 --redis-url redis://localhost:6379/15
+
+Reports the mean cost in microseconds of:
+
+* ``LocalBucketStore.consume`` alone, and from ``--threads`` threads at once;
+* the default throttle classes (``anon``, ``user`` and scoped token buckets)
+  checking an authenticated friend request, as ``APIView`` runs them;
+* DRF's ``UserRateThrottle``, which keeps a timestamp list per client in the
+  Django cache, for comparison;
+* with ``--redis-url``, ``RedisBucketStore.consume``;
+* a primary key lookup of a user, the cheapest query a throttle backed by the
+  database would run.
+
+The default throttles are checked to run no SQL.
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from . import benchmark_database, seed_users, setup_django
+
+
+def per_call_us(func, count):
+    started = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def threaded_per_call_us(func, count, threads):
+    """Run ``count`` calls split over ``threads`` threads; return wall time per call."""
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(offset):
+        barrier.wait()
+        for i in range(offset, count, threads):
+            func(i)
+
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--checks', type=int, default=100000)
+    parser.add_argument('--clients', type=int, default=1000, help='distinct buckets the checks spread over')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--redis-url', help='also measure RedisBucketStore on this server')
+    args = parser.parse_args()
+
+    os.environ['THROTTLE_ENABLED'] = 'True'
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.request import Request
+    from rest_framework.settings import api_settings
+    from rest_framework.test import APIRequestFactory
+    from rest_framework.throttling import UserRateThrottle
+
+    from friends.views import SendFriendRequestView
+    from social_backend.throttling import LocalBucketStore, RedisBucketStore, bucket_store
+
+    # Buckets never run dry, so every check takes the full path
+    huge = 10 ** 12
+    rows = []
+    store = LocalBucketStore()
+    rows.append(('local store', per_call_us(lambda i: store.consume(f'user:{i % args.clients}', huge, huge),
+                                            args.checks)))
+    rows.append((f'local store, {args.threads} threads',
+                 threaded_per_call_us(lambda i: store.consume(f'user:{i % args.clients}', huge, huge),
+                                      args.checks, args.threads)))
+
+    with benchmark_database():
+        User = get_user_model()
+        users = list(User.objects.filter(id__in=seed_users(args.clients)))
+        factory = APIRequestFactory()
+        requests = []
+        for user in users:
+            request = Request(factory.post(f'/api/friends/requests/{user.id}/'))
+            request.user = user
+            requests.append(request)
+        view = SendFriendRequestView()
+        rates = {scope: f'{huge}/s' for scope in ('anon', 'user', 'friend_requests')}
+        api_settings.DEFAULT_THROTTLE_RATES.update(rates)
+        bucket_store().clear()
+
+        def default_throttles(i):
+            request = requests[i % len(requests)]
+            for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+                assert throttle_class().allow_request(request, view)
+
+        with CaptureQueriesContext(connection) as queries:
+            rows.append(('default throttles', per_call_us(default_throttles, args.checks)))
+        assert not queries.captured_queries, 'throttle checks ran SQL'
+
+        UserRateThrottle.THROTTLE_RATES = {'user': f'{huge}/s'}
+        rows.append(('DRF UserRateThrottle', per_call_us(
+            lambda i: UserRateThrottle().allow_request(requests[i % len(requests)], view),
+            min(args.checks, 10000))))
+
+        if args.redis_url:
+            redis_store = RedisBucketStore(args.redis_url)
+            rows.append(('redis store', per_call_us(
+                lambda i: redis_store.consume(f'bench:{i % args.clients}', huge, huge), min(args.checks, 20000))))
+            redis_store.clear()
+
+        ids = [user.id for user in users]
+        rows.append(('user pk query', per_call_us(
+            lambda i: User.objects.filter(pk=ids[i % len(ids)]).exists(), min(args.checks, 20000))))
+
+    print(f"{'check':<28} {'us/check':>10}")
+    for label, us in rows:
+        print(f'{label:<28} {us:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import FriendRequest, Friendship
+from .models import FriendRequest, Friendship, OutboxEvent
 
 
 @admin.register(FriendRequest)
@@ -20,4 +20,14 @@ class FriendshipAdmin(admin.ModelAdmin):
     list_display = ('id', 'user1', 'user2', 'created_at')
     search_fields = ('user1__email', 'user1__name', 'user2__email', 'user2__name')
     raw_id_fields = ('user1', 'user2')
-    list_per_page = 20
\ No newline at end of file
+    list_per_page = 20
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    """Admin configuration for the OutboxEvent model."""
+    
+    list_display = ('id', 'topic', 'idempotency_key', 'attempts', 'available_at', 'processed_at')
+    list_filter = ('topic', 'processed_at')
+    search_fields = ('idempotency_key', 'last_error')
+    list_per_page = 20
@@ -0,0 +1,37 @@
+from django.urls import path
+
+from . import async_views
+from .views import (
+    BatchRespondToFriendRequestView,
+    BatchSendFriendRequestView,
+    FriendPathView,
+    MutualFriendsView,
+)
+
+# Same routes and names as friends.urls, served by the async views where
+# one exists; the batch and connection endpoints stay synchronous
+urlpatterns = [
+    path('', async_views.friend_list, name='friend-list'),
+    path('requests/', async_views.friend_request_list, name='friend-request-list'),
+    path('requests/batch/', BatchSendFriendRequestView.as_view(),
+         name='batch-send-friend-requests'),
+    path('requests/batch/accept/',
+         BatchRespondToFriendRequestView.as_view(),
+         {'action': 'accept'},
+         name='batch-accept-friend-requests'
+         ),
+    path('requests/batch/reject/',
+         BatchRespondToFriendRequestView.as_view(),
+         {'action': 'reject'},
+         name='batch-reject-friend-requests'
+         ),
+    path('requests/<int:user_id>/', async_views.send_friend_request_view,
+         name='send-friend-request'),
+    path('requests/<int:request_id>/accept/', async_views.accept_friend_request,
+         name='accept-friend-request'),
+    path('requests/<int:request_id>/reject/', async_views.reject_friend_request,
+         name='reject-friend-request'),
+    path('suggestions/', async_views.friend_suggestions, name='friend-suggestions'),
+    path('mutual/<int:user_id>/', MutualFriendsView.as_view(), name='mutual-friends'),
+    path('path/<int:user_id>/', FriendPathView.as_view(), name='friend-path'),
+]
@@ -0,0 +1,96 @@
+"""
+Async variants of the friend endpoints for ASGI deployments.
+
+Reads use the async ORM, so a worker keeps serving other connections while
+it waits for the database. Sending and answering friend requests need a
+transaction, which the async ORM cannot open in Django 4.2, so those run the
+same state machine as the sync views in Django's sync thread.
+
+The views are routed by ``friends.async_urls`` with the same URL names as
+``friends.urls``; ``ASYNC_FRIEND_VIEWS`` selects which one is served.
+"""
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.pagination import PageNumberPagination
+
+from social_backend.async_views import async_api_view
+from social_backend.cache import acached_response_data
+from social_backend.pagination import SelectablePagination
+
+from .models import FriendRequest, Friendship
+from .serializers import FriendRequestSerializer, FriendSuggestionSerializer
+from .services import respond_to_friend_request, send_friend_request
+from .suggestions import get_suggestions
+from .views import FriendListView, FriendRequestListView, FriendSuggestionView, SendFriendRequestView
+
+
+async def paginated_data(request, queryset, sync_view):
+    """Fetch and project one page the way the equivalent sync view does."""
+    paginator = SelectablePagination()
+    projection = sync_view.projection
+    # The paginator only reads keyset_ordering from the view
+    page = await paginator.apaginate_queryset(projection.values(queryset), request, view=sync_view)
+    return paginator.get_paginated_response(projection.serialize(page, request)).data
+
+
+@async_api_view('GET', conditional=FriendListView.__name__)
+async def friend_list(request):
+    """List the friends of the authenticated user."""
+    async def build():
+        return await paginated_data(request, Friendship.objects.for_user(request.user), FriendListView)
+
+    return await acached_response_data(FriendListView.__name__, request, build)
+
+
+@async_api_view('GET', conditional=FriendRequestListView.__name__)
+async def friend_request_list(request):
+    """List the friend requests the authenticated user sent or received."""
+    user = request.user
+    queryset = FriendRequest.objects.filter(Q(sender=user) | Q(receiver=user))
+    return await paginated_data(request, queryset, FriendRequestListView)
+
+
+def _send_friend_request(sender, user_id):
+    friend_request, accepted = send_friend_request(sender, user_id)
+    data = FriendRequestSerializer(friend_request).data
+    if accepted:
+        return {
+            "detail": "Friend request accepted automatically as they had already requested you.",
+            "friend_request": data,
+        }
+    return data
+
+
+@async_api_view('POST', throttle_scope=SendFriendRequestView.throttle_scope)
+async def send_friend_request_view(request, user_id):
+    """Send a friend request to another user."""
+    data = await sync_to_async(_send_friend_request)(request.user, user_id)
+    return data, status.HTTP_201_CREATED
+
+
+def respond_to_friend_request_view(action):
+    @async_api_view('PUT')
+    async def respond(request, request_id):
+        """Accept or reject a friend request."""
+        await sync_to_async(respond_to_friend_request)(request.user, request_id, action)
+        return {"detail": f"Friend request {action}ed successfully."}
+    return respond
+
+
+accept_friend_request = respond_to_friend_request_view('accept')
+reject_friend_request = respond_to_friend_request_view('reject')
+
+
+@async_api_view('GET')
+async def friend_suggestions(request):
+    """Suggest friends-of-friends, ranked by mutual friends."""
+    async def build():
+        users = await sync_to_async(get_suggestions)(request.user.id)
+        # Suggestions are a short list in memory; page it like the sync view
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(users, request)
+        return paginator.get_paginated_response(FriendSuggestionSerializer(page, many=True).data).data
+
+    return await acached_response_data(FriendSuggestionView.__name__, request, build)
@@ -0,0 +1,78 @@
+"""
+Denormalized friend counters on ``User``.
+
+``friend_count`` and ``pending_incoming_count`` let profiles show counts
+without counting rows. ``friends.services`` adjusts them with ``F()``
+updates in the same transaction as the write they count, so they stay
+exact as long as friend data only changes through the services. Writes
+made elsewhere (the admin, the shell, cascading deletes) are not counted;
+``reconcile_user_counters`` recounts and repairs them.
+"""
+
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from social_backend.cache import bump_user_versions
+
+from .models import FriendRequest, Friendship
+
+User = get_user_model()
+
+
+def adjust_counter(field, user_ids, delta=1):
+    """Add ``delta`` to a counter once per occurrence of each id in ``user_ids``.
+
+    Users changed by the same amount share one ``UPDATE``.
+    """
+    by_amount = defaultdict(list)
+    for user_id, occurrences in Counter(user_ids).items():
+        by_amount[occurrences * delta].append(user_id)
+    for amount, ids in by_amount.items():
+        User.objects.filter(id__in=ids).update(**{field: F(field) + amount})
+
+
+def _count(queryset, field):
+    counts = queryset.order_by().values(field).annotate(count=Count('id')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def expected_counts():
+    """Expressions computing each counter from the friend tables for the outer user."""
+    return {
+        'friend_count': (
+            _count(Friendship.objects.filter(user1=OuterRef('pk')), 'user1')
+            + _count(Friendship.objects.filter(user2=OuterRef('pk')), 'user2')
+        ),
+        'pending_incoming_count': _count(
+            FriendRequest.objects.filter(receiver=OuterRef('pk'), status=FriendRequest.Status.PENDING),
+            'receiver',
+        ),
+    }
+
+
+def reconcile_user_counters(batch_size=1000, dry_run=False):
+    """Recount the counters of every user in id batches; return the ids that had drifted."""
+    expected = expected_counts()
+    drifted = []
+    last_id = 0
+    while True:
+        ids = list(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return drifted
+        last_id = ids[-1]
+        batch = list(
+            User.objects.filter(id__in=ids)
+            .annotate(**{f'expected_{field}': expression for field, expression in expected.items()})
+            .exclude(**{field: F(f'expected_{field}') for field in expected})
+            .values_list('id', flat=True)
+        )
+        if batch and not dry_run:
+            # Recounted in the UPDATE itself so writes since the check are included
+            User.objects.filter(id__in=batch).update(**expected)
+            bump_user_versions(*batch)
+        drifted += batch
@@ -0,0 +1,71 @@
+"""
+Shared log of friend request events.
+
+Every friend request that is created, accepted or rejected records an
+outbox event in its transaction (see ``friends.outbox``), whose handler
+appends the event to a log in the cache. The request runs the handler as
+soon as it commits, and the outbox worker retries it if that fails, so an
+event can reach the log twice but is never lost with the cache write. The
+event streams of ``friends.streams`` follow the log, so they see the writes
+of every worker as long as the workers share a cache (``REDIS_URL``).
+
+Entries are ``(type, request_id, sender_id, receiver_id)`` tuples keyed by
+a sequence number and expire after ``EVENT_LOG_TIMEOUT`` seconds.
+"""
+
+from django.core.cache import cache
+
+from . import outbox
+from .models import FriendRequest
+
+# Seconds log entries are kept; far longer than streams take to read them
+EVENT_LOG_TIMEOUT = 60 * 10
+
+EVENT_LOG_SEQUENCE_KEY = 'friend-events:sequence'
+
+EVENT_TYPES = {
+    FriendRequest.Status.PENDING: 'friend_request.created',
+    FriendRequest.Status.ACCEPTED: 'friend_request.accepted',
+    FriendRequest.Status.REJECTED: 'friend_request.rejected',
+}
+
+
+def event_log_key(sequence):
+    return f'friend-events:event:{sequence}'
+
+
+def log_events(events):
+    """Append ``(type, request_id, sender_id, receiver_id)`` events to the shared log."""
+    if not events:
+        return
+    try:
+        last = cache.incr(EVENT_LOG_SEQUENCE_KEY, len(events))
+    except ValueError:
+        cache.add(EVENT_LOG_SEQUENCE_KEY, 0, None)
+        last = cache.incr(EVENT_LOG_SEQUENCE_KEY, len(events))
+    first = last - len(events) + 1
+    cache.set_many({event_log_key(first + i): event for i, event in enumerate(events)}, EVENT_LOG_TIMEOUT)
+
+
+def publish(friend_requests, using=None):
+    """Record an event for each request's current status in the current transaction."""
+    # A request is created and answered once, so its id and status identify the event
+    events = [
+        (
+            EVENT_TYPES[r.status],
+            f'{EVENT_TYPES[r.status]}:{r.id}',
+            {'request_id': r.id, 'sender_id': r.sender_id, 'receiver_id': r.receiver_id},
+        )
+        for r in friend_requests
+    ]
+    outbox.enqueue(events)
+    outbox.run_on_commit((key for _, key, _ in events), using)
+
+
+@outbox.handler(EVENT_TYPES[FriendRequest.Status.PENDING])
+@outbox.handler(EVENT_TYPES[FriendRequest.Status.ACCEPTED])
+@outbox.handler(EVENT_TYPES[FriendRequest.Status.REJECTED])
+def log_friend_request_event(event):
+    """Append a friend request event from the outbox to the log."""
+    payload = event.payload
+    log_events([(event.topic, payload['request_id'], payload['sender_id'], payload['receiver_id'])])
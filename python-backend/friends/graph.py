@@ -0,0 +1,547 @@
+"""
+In-process friendship graph.
+
+``FriendGraph`` answers friend graph questions (friend ids, "are these two
+friends", mutual friend counts, distances) from memory instead of querying
+``Friendship``. Each worker loads it once, at start up or on first use,
+and keeps it current afterwards:
+
+* Friendships are stored as CSR (compressed sparse row) adjacency indexed
+  by user id: ``adjacency[offsets[u]:offsets[u + 1]]`` holds the sorted ids
+  of ``u``'s friends, so a friendship check is a binary search. Both are
+  flat ``array`` buffers, about 8 bytes per friendship (stored in both
+  directions as 4-byte ids while ids fit) plus 4 to 8 bytes per user id.
+* Friendships created or deleted after loading are kept in per-user
+  ``added``/``removed`` sets on top of the arrays, which are rebuilt once
+  the changes pass a tenth of the graph.
+* Changes are applied when their transaction commits (see
+  ``friends.signals``) and appended to a change log in the cache, which
+  the other workers replay at most ``FRIEND_GRAPH_SYNC_SECONDS`` later. A
+  worker that finds entries missing from the log reloads the graph on a
+  background thread, and answers lookups from the database meanwhile
+  (``DatabaseGraph``).
+
+The database stays authoritative: writes still check it inside their
+transactions.
+"""
+
+import bisect
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.models import Q
+
+from .models import Friendship
+
+ADD, REMOVE, RELOAD = 'add', 'remove', 'reload'
+
+# Hops searched between two users unless asked otherwise, and at most
+PATH_DEFAULT_HOPS = 3
+PATH_MAX_HOPS = 6
+
+# Rebuild the arrays when changes since loading exceed this share of friendships
+COMPACT_RATIO = 0.1
+COMPACT_MIN_CHANGES = 10000
+
+# Seconds change log entries are kept; far longer than workers take to replay them
+CHANGE_LOG_TIMEOUT = 60 * 10
+
+CHANGE_LOG_SEQUENCE_KEY = 'friend-graph:sequence'
+
+
+class SearchBudgetExceeded(Exception):
+    """A graph search ran past its deadline."""
+
+
+def change_log_key(sequence):
+    return f'friend-graph:change:{sequence}'
+
+
+def current_sequence():
+    return cache.get(CHANGE_LOG_SEQUENCE_KEY, 0)
+
+
+def log_changes(changes):
+    """Append ``(operation, user1_id, user2_id)`` changes to the shared change log."""
+    if not changes:
+        return
+    try:
+        last = cache.incr(CHANGE_LOG_SEQUENCE_KEY, len(changes))
+    except ValueError:
+        cache.add(CHANGE_LOG_SEQUENCE_KEY, 0, None)
+        last = cache.incr(CHANGE_LOG_SEQUENCE_KEY, len(changes))
+    first = last - len(changes) + 1
+    cache.set_many({change_log_key(first + i): change for i, change in enumerate(changes)}, CHANGE_LOG_TIMEOUT)
+
+
+def request_reload():
+    """Make every worker reload its graph, e.g. after friendships were written in bulk."""
+    log_changes([(RELOAD, 0, 0)])
+
+
+def id_typecode(max_value):
+    """Return the smallest array typecode holding ids up to ``max_value``."""
+    return 'i' if max_value < 2 ** (8 * array('i').itemsize - 1) else 'q'
+
+
+def build_csr(user1_ids, user2_ids):
+    """Build ``(offsets, adjacency)`` from the two sides of each friendship.
+
+    A counting sort: count each user's friends, turn the counts into
+    offsets, then place every friendship in both users' slices.
+    """
+    max_id = max(max(user1_ids, default=0), max(user2_ids, default=0))
+    offsets = array(id_typecode(2 * len(user1_ids)), [0]) * (max_id + 2)
+    for user_id in user1_ids:
+        offsets[user_id + 1] += 1
+    for user_id in user2_ids:
+        offsets[user_id + 1] += 1
+    total = 0
+    for index in range(1, len(offsets)):
+        total += offsets[index]
+        offsets[index] = total
+
+    typecode = id_typecode(max_id)
+    adjacency = array(typecode, [0]) * total
+    cursor = offsets[:-1]
+    for user1_id, user2_id in zip(user1_ids, user2_ids):
+        adjacency[cursor[user1_id]] = user2_id
+        cursor[user1_id] += 1
+        adjacency[cursor[user2_id]] = user1_id
+        cursor[user2_id] += 1
+    for user_id in range(max_id + 1):
+        start, end = offsets[user_id], offsets[user_id + 1]
+        if end - start > 1:
+            adjacency[start:end] = array(typecode, sorted(adjacency[start:end]))
+    return offsets, adjacency
+
+
+class FriendGraph:
+    """The friendships of every user, in memory."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.load_lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.offsets = array('i', [0])
+            self.adjacency = array('i')
+            self.added = {}
+            self.removed = {}
+            self.edge_count = 0
+            self.changes = 0
+            # Changes made while compact() rebuilds the arrays, replayed on top
+            self.journal = None
+            self.sequence = 0
+            self.synced_at = 0.0
+            self.missing = None
+            self.loaded = False
+            self.reloading = False
+            self.reload_thread = None
+
+    def load(self, queryset=None):
+        """Build the graph from scratch from ``Friendship`` rows."""
+        if queryset is None:
+            # A lagging replica would miss changes logged before ``sequence``,
+            # which are then never replayed
+            queryset = Friendship.objects.using(DEFAULT_DB_ALIAS)
+        # Changes logged from here on are replayed on top; replaying one the
+        # rows already include is harmless
+        sequence = current_sequence()
+        user1_ids, user2_ids = array('q'), array('q')
+        for user1_id, user2_id in queryset.order_by().values_list('user1_id', 'user2_id').iterator(chunk_size=20000):
+            user1_ids.append(user1_id)
+            user2_ids.append(user2_id)
+        self.load_edges(user1_ids, user2_ids, sequence)
+
+    def load_edges(self, user1_ids, user2_ids, sequence=0):
+        """Replace the graph with the friendships ``zip(user1_ids, user2_ids)``."""
+        offsets, adjacency = build_csr(user1_ids, user2_ids)
+        with self.lock:
+            self.offsets, self.adjacency = offsets, adjacency
+            self.added, self.removed = {}, {}
+            self.edge_count = len(user1_ids)
+            self.changes = 0
+            self.sequence = sequence
+            self.synced_at = time.monotonic()
+            self.missing = None
+            self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self.load_lock:
+                if not self.loaded:
+                    self.load()
+
+    def ensure_current(self):
+        """Load the graph if needed, replay logged changes that are due, and return it.
+
+        While the graph reloads, returns ``database_graph`` instead.
+        """
+        self.ensure_loaded()
+        if not self.reloading and time.monotonic() - self.synced_at >= settings.FRIEND_GRAPH_SYNC_SECONDS:
+            self.sync()
+        return database_graph if self.reloading else self
+
+    def reload(self):
+        """Rebuild the graph from the database on a background thread."""
+        with self.lock:
+            if self.reloading:
+                return
+            self.reloading = True
+        self.reload_thread = threading.Thread(target=self._background_reload, daemon=True)
+        self.reload_thread.start()
+
+    def _background_reload(self):
+        try:
+            self.load()
+        except Exception:
+            # The log still asks for a reload, so the next sync tries again
+            pass
+        finally:
+            connections[DEFAULT_DB_ALIAS].close()
+            with self.lock:
+                self.reloading = False
+
+    def memory_bytes(self):
+        """Return the size of the arrays, which hold all but the recent changes."""
+        return (len(self.offsets) * self.offsets.itemsize
+                + len(self.adjacency) * self.adjacency.itemsize)
+
+    # Lookups
+
+    def _bounds(self, user_id):
+        if 0 <= user_id < len(self.offsets) - 1:
+            return self.offsets[user_id], self.offsets[user_id + 1]
+        return 0, 0
+
+    def _in_arrays(self, user_id, friend_id):
+        start, end = self._bounds(user_id)
+        index = bisect.bisect_left(self.adjacency, friend_id, start, end)
+        return index < end and self.adjacency[index] == friend_id
+
+    def _are_friends(self, user_id, friend_id):
+        if friend_id in self.added.get(user_id, ()):
+            return True
+        if friend_id in self.removed.get(user_id, ()):
+            return False
+        return self._in_arrays(user_id, friend_id)
+
+    def _friends(self, user_id):
+        start, end = self._bounds(user_id)
+        added, removed = self.added.get(user_id), self.removed.get(user_id)
+        if not added and not removed:
+            return self.adjacency[start:end].tolist()
+        return sorted(set(self.adjacency[start:end]).difference(removed or ()).union(added or ()))
+
+    def _degree(self, user_id):
+        start, end = self._bounds(user_id)
+        return end - start + len(self.added.get(user_id, ())) - len(self.removed.get(user_id, ()))
+
+    def are_friends(self, user_a, user_b):
+        with self.lock:
+            return self._are_friends(user_a, user_b)
+
+    def friend_ids(self, user_id):
+        """Return the ids of the user's friends in ascending order."""
+        with self.lock:
+            return self._friends(user_id)
+
+    def degree(self, user_id):
+        with self.lock:
+            return self._degree(user_id)
+
+    def mutual_friend_ids(self, user_a, user_b):
+        """Return the ids of the friends two users share, in ascending order.
+
+        Walks the friends of the user with fewer and binary searches the
+        other's, so a user with thousands of friends costs a few lookups.
+        """
+        with self.lock:
+            if self._degree(user_a) > self._degree(user_b):
+                user_a, user_b = user_b, user_a
+            return [friend_id for friend_id in self._friends(user_a) if self._are_friends(user_b, friend_id)]
+
+    def mutual_count(self, user_a, user_b):
+        return len(self.mutual_friend_ids(user_a, user_b))
+
+    def count_friends_of(self, user_ids):
+        """Return a ``Counter`` of how many of ``user_ids`` each user is a friend of."""
+        counts = Counter()
+        for user_id in user_ids:
+            counts.update(self.friend_ids(user_id))
+        return counts
+
+    def shortest_path(self, user_a, user_b, max_hops=PATH_DEFAULT_HOPS, deadline=None):
+        """Return the ids along a shortest chain of friends from ``user_a`` to ``user_b``.
+
+        Returns ``None`` if they are more than ``max_hops`` apart. A
+        bidirectional breadth-first search: each step expands the whole
+        frontier of the side with fewer friends to visit, and the search
+        raises ``SearchBudgetExceeded`` once ``time.monotonic()`` passes
+        ``deadline``. The lock is only held per user expanded, so a long
+        search does not hold up other lookups.
+        """
+        if user_a == user_b:
+            return [user_a]
+        # Each side maps the users it reached to the user it reached them from
+        forward = ({user_a: None}, [user_a])
+        backward = ({user_b: None}, [user_b])
+        for _ in range(max_hops):
+            if not forward[1] or not backward[1]:
+                return None
+            expand_forward = self._work(forward[1], deadline) <= self._work(backward[1], deadline)
+            (parents, frontier), (other_parents, _) = (forward, backward) if expand_forward else (backward, forward)
+            next_frontier = []
+            for user_id in frontier:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise SearchBudgetExceeded()
+                for friend_id in self.friend_ids(user_id):
+                    if friend_id in parents:
+                        continue
+                    parents[friend_id] = user_id
+                    if friend_id in other_parents:
+                        return self._join(forward[0], backward[0], friend_id)
+                    next_frontier.append(friend_id)
+            if expand_forward:
+                forward = (parents, next_frontier)
+            else:
+                backward = (parents, next_frontier)
+        return None
+
+    def _work(self, frontier, deadline):
+        """Return the friends to visit when expanding ``frontier``, minding the deadline."""
+        total = 0
+        for user_id in frontier:
+            if deadline is not None and time.monotonic() > deadline:
+                raise SearchBudgetExceeded()
+            total += self.degree(user_id)
+        return total
+
+    @staticmethod
+    def _join(forward_parents, backward_parents, meeting_id):
+        path = []
+        user_id = meeting_id
+        while user_id is not None:
+            path.append(user_id)
+            user_id = forward_parents[user_id]
+        path.reverse()
+        user_id = backward_parents[meeting_id]
+        while user_id is not None:
+            path.append(user_id)
+            user_id = backward_parents[user_id]
+        return path
+
+    def distance(self, user_a, user_b, max_hops=3):
+        """Return the fewest friendship hops between two users, or ``None`` beyond ``max_hops``."""
+        path = self.shortest_path(user_a, user_b, max_hops)
+        return None if path is None else len(path) - 1
+
+    # Changes
+
+    def _link(self, user_id, friend_id, present):
+        if present == self._in_arrays(user_id, friend_id):
+            # Back to what the arrays say
+            for deltas in (self.added, self.removed):
+                friends = deltas.get(user_id)
+                if friends is not None:
+                    friends.discard(friend_id)
+                    if not friends:
+                        del deltas[user_id]
+        else:
+            (self.added if present else self.removed).setdefault(user_id, set()).add(friend_id)
+
+    def _apply(self, operation, user1_id, user2_id):
+        present = operation == ADD
+        if self._are_friends(user1_id, user2_id) == present:
+            return
+        self._link(user1_id, user2_id, present)
+        self._link(user2_id, user1_id, present)
+        self.edge_count += 1 if present else -1
+        self.changes += 1
+        if self.journal is not None:
+            self.journal.append((operation, user1_id, user2_id))
+
+    def apply(self, changes):
+        """Apply ``(operation, user1_id, user2_id)`` changes; they are no-ops if already applied."""
+        with self.lock:
+            if not self.loaded:
+                return
+            for operation, user1_id, user2_id in changes:
+                self._apply(operation, user1_id, user2_id)
+            due = self.journal is None and self.changes > max(COMPACT_MIN_CHANGES, self.edge_count * COMPACT_RATIO)
+        if due:
+            self.compact()
+
+    def record(self, changes):
+        """Apply committed changes and log them for the other workers."""
+        self.apply(changes)
+        log_changes(changes)
+
+    def compact(self):
+        """Rebuild the arrays with the changes folded in.
+
+        The rebuild runs outside the lock so lookups continue meanwhile;
+        changes made during it are replayed on the new arrays.
+        """
+        with self.lock:
+            if self.journal is not None:
+                return
+            self.journal = []
+            base = offsets = self.offsets
+            adjacency = self.adjacency
+            added = {user_id: set(friends) for user_id, friends in self.added.items()}
+            removed = {user_id: set(friends) for user_id, friends in self.removed.items()}
+        try:
+            user1_ids, user2_ids = array('q'), array('q')
+            for user_id in range(len(offsets) - 1):
+                dropped = removed.get(user_id, ())
+                for friend_id in adjacency[offsets[user_id]:offsets[user_id + 1]]:
+                    if user_id < friend_id and friend_id not in dropped:
+                        user1_ids.append(user_id)
+                        user2_ids.append(friend_id)
+            for user_id, friends in added.items():
+                for friend_id in friends:
+                    if user_id < friend_id:
+                        user1_ids.append(user_id)
+                        user2_ids.append(friend_id)
+            offsets, adjacency = build_csr(user1_ids, user2_ids)
+        except BaseException:
+            with self.lock:
+                self.journal = None
+            raise
+        # Detach the journal and swap in the same critical section, so no
+        # change lands on the old sets unjournaled in between
+        with self.lock:
+            journal, self.journal = self.journal, None
+            if self.offsets is not base:
+                # Reloaded meanwhile
+                return
+            self.offsets, self.adjacency = offsets, adjacency
+            self.added, self.removed = {}, {}
+            self.edge_count = len(user1_ids)
+            self.changes = 0
+            for change in journal:
+                self._apply(*change)
+
+    def sync(self):
+        """Replay the changes other workers logged since the last sync."""
+        if not self.sync_lock.acquire(blocking=False):
+            # Another thread is already replaying them
+            return
+        try:
+            self.synced_at = time.monotonic()
+            latest = current_sequence()
+            if latest < self.sequence:
+                # The log was lost with the cache, and changes along with it
+                self.reload()
+                return
+            sequences = range(self.sequence + 1, latest + 1)
+            entries = cache.get_many([change_log_key(sequence) for sequence in sequences])
+            changes = []
+            for sequence in sequences:
+                change = entries.get(change_log_key(sequence))
+                if change is None:
+                    # The writer may not have stored it yet; still missing at
+                    # the next sync, it was evicted
+                    if self.missing == sequence:
+                        self.reload()
+                        return
+                    self.missing = sequence
+                    break
+                if change[0] == RELOAD:
+                    self.reload()
+                    return
+                changes.append(change)
+                self.sequence = sequence
+            else:
+                self.missing = None
+            self.apply(changes)
+        finally:
+            self.sync_lock.release()
+
+
+class DatabaseGraph:
+    """The lookups of ``FriendGraph`` answered with queries, for workers reloading theirs."""
+
+    def are_friends(self, user_a, user_b):
+        return Friendship.objects.are_friends(user_a, user_b)
+
+    def friend_ids(self, user_id):
+        return sorted(Friendship.objects.friend_ids(user_id))
+
+    def degree(self, user_id):
+        return len(Friendship.objects.friend_ids(user_id))
+
+    def mutual_friend_ids(self, user_a, user_b):
+        friends = Friendship.objects.friend_ids(user_a)
+        return sorted(friends.intersection(Friendship.objects.friend_ids(user_b)))
+
+    def mutual_count(self, user_a, user_b):
+        return len(self.mutual_friend_ids(user_a, user_b))
+
+    def friendships_of(self, user_ids):
+        """Yield ``(user_id, friend_id)`` for every friend of each of ``user_ids``, in one query."""
+        user_ids = set(user_ids)
+        pairs = Friendship.objects.filter(Q(user1_id__in=user_ids) | Q(user2_id__in=user_ids))
+        for user1_id, user2_id in pairs.order_by().values_list('user1_id', 'user2_id'):
+            if user1_id in user_ids:
+                yield user1_id, user2_id
+            if user2_id in user_ids:
+                yield user2_id, user1_id
+
+    def count_friends_of(self, user_ids):
+        return Counter(friend_id for _, friend_id in self.friendships_of(user_ids))
+
+    def shortest_path(self, user_a, user_b, max_hops=PATH_DEFAULT_HOPS, deadline=None):
+        """``FriendGraph.shortest_path`` with one query per frontier, the smaller side first."""
+        if user_a == user_b:
+            return [user_a]
+        forward = ({user_a: None}, [user_a])
+        backward = ({user_b: None}, [user_b])
+        for _ in range(max_hops):
+            if not forward[1] or not backward[1]:
+                return None
+            if deadline is not None and time.monotonic() > deadline:
+                raise SearchBudgetExceeded()
+            expand_forward = len(forward[1]) <= len(backward[1])
+            (parents, frontier), (other_parents, _) = (forward, backward) if expand_forward else (backward, forward)
+            next_frontier = []
+            for user_id, friend_id in self.friendships_of(frontier):
+                if friend_id in parents:
+                    continue
+                parents[friend_id] = user_id
+                if friend_id in other_parents:
+                    return FriendGraph._join(forward[0], backward[0], friend_id)
+                next_frontier.append(friend_id)
+            if expand_forward:
+                forward = (parents, next_frontier)
+            else:
+                backward = (parents, next_frontier)
+        return None
+
+    def distance(self, user_a, user_b, max_hops=3):
+        path = self.shortest_path(user_a, user_b, max_hops)
+        return None if path is None else len(path) - 1
+
+
+friend_graph = FriendGraph()
+database_graph = DatabaseGraph()
+
+
+def preload():
+    """Load the graph as a worker starts, if ``FRIEND_GRAPH_PRELOAD`` is set."""
+    if settings.FRIEND_GRAPH_PRELOAD:
+        try:
+            friend_graph.ensure_loaded()
+        except DatabaseError:
+            # Not migrated yet; the graph loads on first use instead
+            pass
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from friends import outbox
+
+
+class Command(BaseCommand):
+    help = "Run the side effects recorded in the outbox, in batches on a thread pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE, help='events claimed at a time')
+        parser.add_argument('--threads', type=int, default=outbox.THREADS, help='events run concurrently')
+        parser.add_argument('--lease', type=float, default=outbox.LEASE.total_seconds(),
+                            help='seconds before claimed events that are not done are run again')
+        parser.add_argument('--max-attempts', type=int, default=outbox.MAX_ATTEMPTS,
+                            help='failures after which an event is left alone')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds to wait when nothing is due')
+        parser.add_argument('--once', action='store_true', help='exit once no events are due')
+
+    def handle(self, *args, batch_size, threads, lease, max_attempts, poll_interval, once, **options):
+        succeeded = failed = 0
+        batches = outbox.work(
+            threads=threads,
+            once=once,
+            poll_interval=poll_interval,
+            batch_size=batch_size,
+            lease=timedelta(seconds=lease),
+            max_attempts=max_attempts,
+        )
+        try:
+            for batch_succeeded, batch_failed in batches:
+                succeeded += batch_succeeded
+                failed += batch_failed
+                if (batch_succeeded or batch_failed) and options['verbosity'] > 1:
+                    self.stdout.write(f'Ran {batch_succeeded} events, {batch_failed} failed.')
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Ran {succeeded} events, {failed} failed.'))
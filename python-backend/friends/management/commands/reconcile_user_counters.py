@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from friends.counters import reconcile_user_counters
+
+
+class Command(BaseCommand):
+    help = "Recount users' friend_count and pending_incoming_count and fix the ones that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='users checked per query')
+        parser.add_argument('--dry-run', action='store_true', help='report drifted users without fixing them')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        drifted = reconcile_user_counters(batch_size=batch_size, dry_run=dry_run)
+        if dry_run:
+            self.stdout.write(f'{len(drifted)} users have drifted counters.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Fixed the counters of {len(drifted)} users.'))
+        if drifted and options['verbosity'] > 1:
+            self.stdout.write('User ids: ' + ', '.join(map(str, drifted)))
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:16
+
+from django.db import migrations, models
+
+
+def canonicalize_friendships(apps, schema_editor):
+    """Store every existing pair with user1_id < user2_id, dropping mirrored duplicates."""
+    Friendship = apps.get_model('friends', 'Friendship')
+    if schema_editor.connection.vendor == 'postgresql':
+        # Foreign keys are checked at commit by default, and PostgreSQL will not
+        # alter the table below while those checks of the updates are pending
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    reversed_rows = list(
+        Friendship.objects.filter(user1__gt=models.F('user2'))
+        .order_by('created_at')
+        .values_list('pk', 'user1_id', 'user2_id')
+    )
+    for pk, user1_id, user2_id in reversed_rows:
+        if Friendship.objects.filter(user1_id=user2_id, user2_id=user1_id).exists():
+            Friendship.objects.filter(pk=pk).delete()
+        else:
+            Friendship.objects.filter(pk=pk).update(user1_id=user2_id, user2_id=user1_id)
+    # Self friendships cannot satisfy the new check constraint
+    Friendship.objects.filter(user1=models.F('user2')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_friendships, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['user2', 'user1'], name='friendship_user2_user1_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.CheckConstraint(check=models.Q(('user1__lt', models.F('user2'))), name='friendship_canonical_order'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -14,12 +15,16 @@ class FriendRequest(models.Model):
     sender = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        related_name='sent_requests'
+        related_name='sent_requests',
+        # Covered by the unique (sender, receiver) and (sender, created_at) indexes
+        db_index=False,
     )
     receiver = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        related_name='received_requests'
+        related_name='received_requests',
+        # Covered by the (receiver, status, created_at) index
+        db_index=False,
     )
     status = models.CharField(
         max_length=10,
@@ -32,6 +37,20 @@ class FriendRequest(models.Model):
     class Meta:
         unique_together = ('sender', 'receiver')
         ordering = ['-created_at']
+        indexes = [
+            # Incoming requests by status, newest first, and the receiver
+            # side of the "sent or received" list
+            models.Index(fields=['receiver', 'status', 'created_at'], name='friendreq_recv_status_created'),
+            # The sender side of the "sent or received" list
+            models.Index(fields=['sender', 'created_at'], name='friendreq_sender_created_idx'),
+            # Pending requests are the only ones still acted on and a small
+            # fraction of the table once answered requests pile up
+            models.Index(
+                fields=['receiver', 'created_at'],
+                name='friendreq_pending_recv_idx',
+                condition=models.Q(status='pending'),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.sender} -> {self.receiver} ({self.status})"
@@ -42,8 +61,58 @@ class FriendRequest(models.Model):
         return self.status == self.Status.PENDING
 
 
+def _pk(user):
+    """Return the primary key of a user instance, or the value if already an id."""
+    return getattr(user, 'pk', user)
+
+
+class FriendshipManager(models.Manager):
+    """Manager exposing friendship lookups on the (user1, user2) and (user2, user1) indexes."""
+    
+    def for_user(self, user):
+        """Return all friendships the user takes part in.
+        
+        A filter on either column rather than a union, so callers can still
+        filter, order and page it; the database combines both indexes for it.
+        """
+        user_id = _pk(user)
+        return self.filter(models.Q(user1_id=user_id) | models.Q(user2_id=user_id))
+    
+    def are_friends(self, user_a, user_b):
+        """Check whether two users are friends with one probe of the (user1, user2) index."""
+        user1_id, user2_id = Friendship.canonical_pair(user_a, user_b)
+        return self.filter(user1_id=user1_id, user2_id=user2_id).exists()
+    
+    def friend_ids(self, user):
+        """Return the set of ids of the user's friends."""
+        user_id = _pk(user)
+        # Each side of the union is answered by its own composite index
+        as_user1 = self.filter(user1_id=user_id).order_by().values_list('user2_id', flat=True)
+        as_user2 = self.filter(user2_id=user_id).order_by().values_list('user1_id', flat=True)
+        return set(as_user1.union(as_user2, all=True))
+    
+    def friends_among(self, user, user_ids):
+        """Return which of ``user_ids`` are friends of the user, in one query."""
+        user_id = _pk(user)
+        user_ids = list(user_ids)
+        pairs = self.filter(
+            models.Q(user1_id=user_id, user2_id__in=user_ids) |
+            models.Q(user2_id=user_id, user1_id__in=user_ids)
+        ).values_list('user1_id', 'user2_id')
+        return {user2_id if user1_id == user_id else user1_id for user1_id, user2_id in pairs}
+    
+    def create_friendship(self, user_a, user_b):
+        """Create the friendship between two users in canonical order."""
+        user1_id, user2_id = Friendship.canonical_pair(user_a, user_b)
+        return self.create(user1_id=user1_id, user2_id=user2_id)
+
+
 class Friendship(models.Model):
-    """Model for established friendships between users."""
+    """Model for established friendships between users.
+    
+    Each pair is stored once with ``user1_id < user2_id`` so that a friendship
+    check is a single lookup on the ``(user1, user2)`` unique index.
+    """
     
     user1 = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -57,9 +126,66 @@ class Friendship(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = FriendshipManager()
+    
     class Meta:
         unique_together = ('user1', 'user2')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user2', 'user1'], name='friendship_user2_user1_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(user1__lt=models.F('user2')),
+                name='friendship_canonical_order',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.user1} & {self.user2}"
+    
+    def save(self, *args, **kwargs):
+        """Store the pair in canonical order before saving."""
+        if self.user1_id is not None and self.user2_id is not None and self.user1_id > self.user2_id:
+            self.user1_id, self.user2_id = self.user2_id, self.user1_id
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def canonical_pair(user_a, user_b):
+        """Return the ids of two users ordered as they are stored."""
+        a, b = _pk(user_a), _pk(user_b)
+        return (a, b) if a < b else (b, a)
+
+
+class OutboxEvent(models.Model):
+    """A side effect of a friend data change, run later by the outbox worker.
+    
+    Events are written in the same transaction as the change, so one exists
+    exactly when the change committed (see ``friends.outbox``).
+    """
+    
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # When the event may next be claimed: pushed forward while a worker
+    # holds it and after failures
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Unprocessed events, the only ones workers look at
+            models.Index(
+                fields=['available_at', 'id'],
+                name='outbox_pending_idx',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+            models.Index(fields=['processed_at'], name='outbox_processed_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user1} & {self.user2}"
\ No newline at end of file
+        return f"{self.topic} ({self.idempotency_key})"
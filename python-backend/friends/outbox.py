@@ -0,0 +1,181 @@
+"""
+Transactional outbox for side effects of friend data changes.
+
+Work that does not have to finish before the response (fanning out cache
+invalidations, and later notifications) is recorded as an ``OutboxEvent``
+in the transaction that makes the change, and run by the ``drain_outbox``
+management command:
+
+* ``enqueue`` inserts events with the write they belong to, so an event
+  exists if and only if the change committed. Each event has an
+  idempotency key, and enqueueing a key that is already there does nothing.
+* The worker claims a batch of due events by pushing their
+  ``available_at`` forward by a lease, runs their handlers on a thread
+  pool, and marks the ones that succeeded as processed. Failed events are
+  retried with exponential backoff until ``max_attempts``, then left for
+  inspection in the admin.
+* ``run_on_commit`` also runs the events a request enqueued as soon as its
+  transaction commits, claiming them like a worker would, so their effects
+  do not wait for the next poll; the worker retries any that fail there.
+* Delivery is at least once: events of a worker that dies mid-batch are
+  claimed again when their lease runs out. Handlers get the whole event
+  and must tolerate running twice, using ``idempotency_key`` to deduplicate
+  anything that is not naturally idempotent.
+
+On PostgreSQL concurrent workers skip each other's locked rows while
+claiming. SQLite cannot, so run a single worker there.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Defaults of the drain_outbox command
+BATCH_SIZE = 100
+THREADS = 4
+LEASE = timedelta(seconds=60)
+MAX_ATTEMPTS = 10
+# Processed events are kept this long, so late duplicates of their keys are still ignored
+RETENTION = timedelta(days=7)
+
+# Seconds to wait before retrying an event that failed for the nth time, at most MAX_BACKOFF
+MAX_BACKOFF = 60 * 60
+
+# Seconds between purges of processed events by a running worker
+PURGE_INTERVAL = 60 * 60
+
+handlers = {}
+
+
+def handler(topic):
+    """Register the decorated function to run events of ``topic``."""
+    def register(func):
+        handlers[topic] = func
+        return func
+    return register
+
+
+def enqueue(events):
+    """Insert ``(topic, idempotency_key, payload)`` events in the current transaction."""
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(topic=topic, idempotency_key=key, payload=payload) for topic, key, payload in events],
+        ignore_conflicts=True,
+    )
+
+
+def run_on_commit(keys, using=None):
+    """Run the events with idempotency ``keys`` in this thread once the transaction commits."""
+    keys = list(keys)
+
+    def run_now():
+        events = claim(len(keys), keys=keys)
+        if events:
+            complete(events, [run(event) for event in events])
+
+    # A failure here leaves the events to the worker instead of failing the request
+    transaction.on_commit(run_now, using=using, robust=True)
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(2 ** attempts, MAX_BACKOFF))
+
+
+def claim(batch_size=BATCH_SIZE, lease=LEASE, max_attempts=MAX_ATTEMPTS, keys=None):
+    """Take up to ``batch_size`` due events, only those with ``keys`` if given, for ``lease``."""
+    now = timezone.now()
+    due = OutboxEvent.objects.select_for_update(skip_locked=True).filter(
+        processed_at__isnull=True, available_at__lte=now, attempts__lt=max_attempts,
+    )
+    if keys is not None:
+        due = due.filter(idempotency_key__in=keys)
+    with transaction.atomic():
+        events = list(due.order_by('available_at', 'id')[:batch_size])
+        OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(
+            available_at=now + lease, attempts=F('attempts') + 1,
+        )
+    for event in events:
+        event.attempts += 1
+    return events
+
+
+def run(event):
+    """Run an event's handler; return ``None``, or the error it failed with."""
+    try:
+        func = handlers.get(event.topic)
+        if func is None:
+            return f'No handler for {event.topic!r}.'
+        func(event)
+        return None
+    except Exception as exc:
+        logger.exception('Outbox event %s (%s) failed', event.id, event.topic)
+        return f'{type(exc).__name__}: {exc}'
+
+
+def run_on_pool(event):
+    try:
+        return run(event)
+    finally:
+        # Pool threads keep their own connections
+        close_old_connections()
+
+
+def drain(executor, batch_size=BATCH_SIZE, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+    """Claim one batch, run it on ``executor`` and record the outcomes.
+
+    Returns the numbers of events that succeeded and failed.
+    """
+    events = claim(batch_size, lease, max_attempts)
+    if not events:
+        return 0, 0
+    return complete(events, list(executor.map(run_on_pool, events)))
+
+
+def complete(events, errors):
+    """Record the outcome of each claimed event; return the numbers that succeeded and failed."""
+    now = timezone.now()
+    failed = []
+    for event, error in zip(events, errors):
+        if error is not None:
+            event.available_at = now + backoff(event.attempts)
+            event.last_error = error
+            failed.append(event)
+    succeeded = [event.id for event, error in zip(events, errors) if error is None]
+    OutboxEvent.objects.filter(id__in=succeeded).update(processed_at=now, last_error='')
+    OutboxEvent.objects.bulk_update(failed, ['available_at', 'last_error'])
+    return len(succeeded), len(failed)
+
+
+def purge(retention=RETENTION):
+    """Delete events processed longer than ``retention`` ago; return how many."""
+    deleted, _ = OutboxEvent.objects.filter(processed_at__lt=timezone.now() - retention).delete()
+    return deleted
+
+
+def work(threads=THREADS, once=False, poll_interval=1.0, **options):
+    """Drain the outbox until interrupted, or until it is empty with ``once``.
+
+    Yields the outcome of every batch, ``(0, 0)`` when nothing was due.
+    """
+    last_purge = None
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='outbox') as executor:
+        while True:
+            # On a timer, so a worker that never runs out of events still purges
+            if last_purge is None or time.monotonic() - last_purge > PURGE_INTERVAL:
+                purge()
+                last_purge = time.monotonic()
+            outcome = drain(executor, **options)
+            yield outcome
+            if outcome != (0, 0):
+                continue
+            if once:
+                return
+            time.sleep(poll_interval)
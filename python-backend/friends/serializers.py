@@ -3,6 +3,9 @@ from django.contrib.auth import get_user_model
 
 from .models import FriendRequest, Friendship
 from accounts.serializers import UserListSerializer
+from social_backend.projections import Projection
+from .graph import PATH_DEFAULT_HOPS, PATH_MAX_HOPS
+from .services import BATCH_LIMIT
 
 User = get_user_model()
 
@@ -33,16 +36,75 @@ class FriendshipSerializer(serializers.ModelSerializer):
         """Return the friend of the current user."""
         request = self.context.get('request')
         if request and request.user:
-            user = request.user
-            friend = obj.user2 if user == obj.user1 else obj.user1
+            # Compare raw ids so only the already joined friend row is read
+            friend = obj.user2 if obj.user1_id == request.user.id else obj.user1
             return UserListSerializer(friend).data
         return None
 
 
+class FriendshipProjection:
+    """Projection of ``FriendshipSerializer`` rows for the requesting user.
+    
+    The friend is whichever side of the row is not the requesting user, so
+    both sides are read and the matching one is projected.
+    """
+    
+    def __init__(self):
+        self.sides = [Projection(UserListSerializer, prefix=f'{side}__') for side in ('user1', 'user2')]
+        self.lookups = ['id', 'user1_id', 'created_at'] + [
+            lookup for side in self.sides for lookup in side.lookups
+        ]
+        self.created_at = FriendshipSerializer().fields['created_at'].to_representation
+    
+    def values(self, queryset):
+        return queryset.values(*self.lookups)
+    
+    def serialize(self, rows, request=None):
+        user_id = request.user.id if request and request.user else None
+        user1_to_dict, user2_to_dict = (side.to_dict for side in self.sides)
+        created_at = self.created_at
+        return [
+            {
+                'id': row['id'],
+                'friend': None if user_id is None else (
+                    user2_to_dict(row) if row['user1_id'] == user_id else user1_to_dict(row)
+                ),
+                'created_at': created_at(row['created_at']),
+            }
+            for row in rows
+        ]
+
+
 class FriendSuggestionSerializer(serializers.ModelSerializer):
     """Serializer for friend suggestions."""
     
     class Meta:
         model = User
         fields = ['id', 'name', 'email', 'profile_picture']
-        read_only_fields = ['id', 'name', 'email', 'profile_picture']
\ No newline at end of file
+        read_only_fields = ['id', 'name', 'email', 'profile_picture']
+
+
+class BatchSendFriendRequestSerializer(serializers.Serializer):
+    """Serializer for sending friend requests to several users at once."""
+    
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BATCH_LIMIT,
+    )
+
+
+class BatchRespondToFriendRequestSerializer(serializers.Serializer):
+    """Serializer for accepting or rejecting several friend requests at once."""
+    
+    request_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BATCH_LIMIT,
+    )
+
+
+class FriendPathQuerySerializer(serializers.Serializer):
+    """Query parameters of the friend path endpoint."""
+    
+    max_hops = serializers.IntegerField(min_value=1, max_value=PATH_MAX_HOPS, default=PATH_DEFAULT_HOPS)
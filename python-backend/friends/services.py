@@ -0,0 +1,312 @@
+"""
+Friend request state transitions.
+
+A request moves from ``pending`` to ``accepted`` or ``rejected`` exactly
+once. Every operation runs in a single transaction:
+
+* Sending locks both users' rows in id order, which serializes all
+  operations on the pair on databases with row locks. The insert is guarded
+  by the ``(sender, receiver)`` unique constraint, so a lost race surfaces
+  as "already sent" rather than an ``IntegrityError``.
+* Accepting and rejecting are compare-and-set updates that only match
+  pending rows, so a request cannot be answered twice.
+* Friendships are inserted with ``ON CONFLICT DO NOTHING``.
+* The ``friend_count`` and ``pending_incoming_count`` counters of the users
+  involved are adjusted with ``F()`` updates in the same transaction (see
+  ``friends.counters``).
+
+SQLite has no row locks and admits one writer at a time, so there the
+transactions of this process are run one after the other instead.
+
+The batch variants resolve all existence checks with a handful of
+set-based queries and write with ``bulk_create``/``bulk_update``, returning
+one result per requested item in request order.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from .counters import adjust_counter
+from .graph import friend_graph
+from .models import FriendRequest, Friendship
+from .signals import post_bulk_save
+
+User = get_user_model()
+
+# Maximum number of ids accepted by a single batch call
+BATCH_LIMIT = 100
+
+SELF_REQUEST = "You cannot send a friend request to yourself."
+USER_NOT_FOUND = "User not found."
+ALREADY_FRIENDS = "You are already friends with this user."
+ALREADY_SENT = "A friend request has already been sent to this user."
+REQUEST_NOT_FOUND = "Friend request not found."
+
+_serial_write_lock = threading.Lock()
+
+
+class FriendRequestError(APIException):
+    """A friend request operation that is not allowed in the current state."""
+    
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_code = 'invalid_friend_request'
+
+
+def already_answered(friend_request):
+    return f"This friend request has already been {friend_request.status}."
+
+
+@contextmanager
+def state_transaction():
+    """Run a friend request state transition in one transaction."""
+    if connection.features.has_select_for_update:
+        with transaction.atomic():
+            yield
+    else:
+        with _serial_write_lock, transaction.atomic():
+            yield
+
+
+def _unique(ids):
+    """Drop repeated ids, keeping the first occurrence."""
+    return list(dict.fromkeys(ids))
+
+
+def _error(key, value, detail):
+    return {key: value, 'result': 'error', 'detail': detail}
+
+
+def _save_friendships(pairs):
+    """Bulk create friendships for ``(user_a, user_b)`` id pairs in canonical order.
+    
+    Pairs that are already friends are skipped so they are not counted twice.
+    """
+    pairs = {Friendship.canonical_pair(a, b) for a, b in pairs}
+    if not pairs:
+        return
+    existing = Q()
+    for user1_id, user2_id in pairs:
+        existing |= Q(user1_id=user1_id, user2_id=user2_id)
+    pairs -= set(Friendship.objects.filter(existing).values_list('user1_id', 'user2_id'))
+    friendships = [Friendship(user1_id=user1_id, user2_id=user2_id) for user1_id, user2_id in pairs]
+    if friendships:
+        Friendship.objects.bulk_create(friendships, ignore_conflicts=True)
+        adjust_counter('friend_count', [user_id for pair in pairs for user_id in pair])
+        post_bulk_save.send(sender=Friendship, instances=friendships, created=True)
+
+
+def _transition(friend_request, new_status):
+    """Move a pending request to ``new_status`` with a compare-and-set update."""
+    now = timezone.now()
+    updated = FriendRequest.objects.filter(
+        pk=friend_request.pk, status=FriendRequest.Status.PENDING
+    ).update(status=new_status, updated_at=now)
+    if not updated:
+        friend_request.refresh_from_db(fields=['status'])
+        raise FriendRequestError(already_answered(friend_request))
+    friend_request.status = new_status
+    friend_request.updated_at = now
+    adjust_counter('pending_incoming_count', [friend_request.receiver_id], -1)
+    post_bulk_save.send(sender=FriendRequest, instances=[friend_request], created=False)
+
+
+def _save_request_statuses(friend_requests):
+    """Bulk update the status of pending friend requests, touching ``updated_at``."""
+    if not friend_requests:
+        return
+    # bulk_update() does not apply auto_now
+    now = timezone.now()
+    for friend_request in friend_requests:
+        friend_request.updated_at = now
+    FriendRequest.objects.bulk_update(friend_requests, ['status', 'updated_at'])
+    adjust_counter('pending_incoming_count', [r.receiver_id for r in friend_requests], -1)
+    post_bulk_save.send(sender=FriendRequest, instances=friend_requests, created=False)
+
+
+def send_friend_request(sender, receiver_id):
+    """Send a friend request and return it with whether it ended up accepted.
+    
+    A pending request in the opposite direction is accepted instead.
+    """
+    if receiver_id == sender.id:
+        raise FriendRequestError(SELF_REQUEST)
+    # Turn away existing friends before opening the transaction, so syncing
+    # the graph never runs under its locks; the transaction still catches
+    # friendships the graph has not seen yet
+    if friend_graph.ensure_current().are_friends(sender.id, receiver_id):
+        raise FriendRequestError(ALREADY_FRIENDS)
+    return _send_friend_request(sender, receiver_id)
+
+
+@state_transaction()
+def _send_friend_request(sender, receiver_id):
+    # Locking both users in id order serializes every operation on the pair
+    users = User.objects.select_for_update().filter(id__in=(sender.id, receiver_id)).order_by('id').in_bulk()
+    if receiver_id not in users:
+        raise NotFound(USER_NOT_FOUND)
+    if Friendship.objects.are_friends(sender.id, receiver_id):
+        raise FriendRequestError(ALREADY_FRIENDS)
+    
+    existing = {
+        friend_request.sender_id: friend_request
+        for friend_request in FriendRequest.objects.filter(
+            Q(sender_id=sender.id, receiver_id=receiver_id) |
+            Q(sender_id=receiver_id, receiver_id=sender.id)
+        )
+    }
+    if sender.id in existing:
+        raise FriendRequestError(ALREADY_SENT)
+    
+    opposite = existing.get(receiver_id)
+    if opposite is not None and opposite.status == FriendRequest.Status.PENDING:
+        opposite.sender, opposite.receiver = users[receiver_id], users[sender.id]
+        _transition(opposite, FriendRequest.Status.ACCEPTED)
+        _save_friendships([(sender.id, receiver_id)])
+        return opposite, True
+    
+    try:
+        with transaction.atomic():
+            friend_request = FriendRequest.objects.create(sender=users[sender.id], receiver=users[receiver_id])
+    except IntegrityError:
+        # Another process inserted the same request first
+        raise FriendRequestError(ALREADY_SENT)
+    adjust_counter('pending_incoming_count', [receiver_id])
+    return friend_request, False
+
+
+@state_transaction()
+def respond_to_friend_request(receiver, request_id, action):
+    """Accept or reject a pending friend request addressed to ``receiver``."""
+    new_status = {
+        'accept': FriendRequest.Status.ACCEPTED,
+        'reject': FriendRequest.Status.REJECTED,
+    }[action]
+    friend_request = FriendRequest.objects.select_for_update().filter(
+        id=request_id, receiver_id=receiver.id
+    ).first()
+    if friend_request is None:
+        raise NotFound(REQUEST_NOT_FOUND)
+    if friend_request.status != FriendRequest.Status.PENDING:
+        raise FriendRequestError(already_answered(friend_request))
+    
+    _transition(friend_request, new_status)
+    if new_status == FriendRequest.Status.ACCEPTED:
+        _save_friendships([(friend_request.sender_id, friend_request.receiver_id)])
+    return friend_request
+
+
+@state_transaction()
+def send_friend_requests(sender, user_ids):
+    """Send friend requests from ``sender`` to every user in ``user_ids``.
+
+    A pending request in the opposite direction is accepted instead, as in
+    the single request endpoint.
+    """
+    user_ids = _unique(user_ids)
+    # Lock the sender and every target in id order, like send_friend_request,
+    # so operations on any of the same pairs wait for this batch
+    existing_users = set(
+        User.objects.select_for_update().filter(id__in=[sender.id, *user_ids]).order_by('id')
+        .values_list('id', flat=True)
+    )
+    friends = Friendship.objects.friends_among(sender, user_ids)
+    already_sent = set(
+        FriendRequest.objects.filter(sender_id=sender.id, receiver_id__in=user_ids)
+        .values_list('receiver_id', flat=True)
+    )
+    incoming = {
+        friend_request.sender_id: friend_request
+        for friend_request in FriendRequest.objects.select_for_update().filter(
+            sender_id__in=user_ids,
+            receiver_id=sender.id,
+            status=FriendRequest.Status.PENDING,
+        )
+    }
+
+    results = {}
+    new_requests = []
+    accepted = []
+    for user_id in user_ids:
+        if user_id == sender.id:
+            results[user_id] = _error('user_id', user_id, SELF_REQUEST)
+        elif user_id not in existing_users:
+            results[user_id] = _error('user_id', user_id, USER_NOT_FOUND)
+        elif user_id in friends:
+            results[user_id] = _error('user_id', user_id, ALREADY_FRIENDS)
+        elif user_id in already_sent:
+            results[user_id] = _error('user_id', user_id, ALREADY_SENT)
+        elif user_id in incoming:
+            friend_request = incoming[user_id]
+            friend_request.status = FriendRequest.Status.ACCEPTED
+            accepted.append(friend_request)
+            results[user_id] = {'user_id': user_id, 'result': 'accepted', 'request_id': friend_request.id}
+        else:
+            new_requests.append(FriendRequest(sender_id=sender.id, receiver_id=user_id))
+
+    _save_request_statuses(accepted)
+    _save_friendships((sender.id, friend_request.sender_id) for friend_request in accepted)
+    if new_requests:
+        FriendRequest.objects.bulk_create(new_requests, ignore_conflicts=True)
+        # Ids are not returned when conflicts are ignored; a stored row that is
+        # not the one built here was inserted by another process first
+        stored = {
+            receiver_id: (request_id, created_at)
+            for receiver_id, request_id, created_at in FriendRequest.objects.filter(
+                sender_id=sender.id, receiver_id__in=[r.receiver_id for r in new_requests]
+            ).values_list('receiver_id', 'id', 'created_at')
+        }
+        created = []
+        for friend_request in new_requests:
+            request_id, created_at = stored.get(friend_request.receiver_id, (None, None))
+            if created_at != friend_request.created_at:
+                results[friend_request.receiver_id] = _error('user_id', friend_request.receiver_id, ALREADY_SENT)
+                continue
+            friend_request.id = request_id
+            created.append(friend_request)
+            results[friend_request.receiver_id] = {
+                'user_id': friend_request.receiver_id,
+                'result': 'sent',
+                'request_id': friend_request.id,
+            }
+        adjust_counter('pending_incoming_count', [r.receiver_id for r in created])
+        post_bulk_save.send(sender=FriendRequest, instances=created, created=True)
+
+    return [results[user_id] for user_id in user_ids]
+
+
+@state_transaction()
+def respond_to_friend_requests(receiver, request_ids, action):
+    """Accept or reject the pending friend requests addressed to ``receiver``."""
+    request_ids = _unique(request_ids)
+    new_status = {
+        'accept': FriendRequest.Status.ACCEPTED,
+        'reject': FriendRequest.Status.REJECTED,
+    }[action]
+    friend_requests = FriendRequest.objects.select_for_update().filter(
+        receiver_id=receiver.id
+    ).in_bulk(request_ids)
+
+    results = []
+    updated = []
+    for request_id in request_ids:
+        friend_request = friend_requests.get(request_id)
+        if friend_request is None:
+            results.append(_error('request_id', request_id, REQUEST_NOT_FOUND))
+        elif friend_request.status != FriendRequest.Status.PENDING:
+            results.append(_error('request_id', request_id, already_answered(friend_request)))
+        else:
+            friend_request.status = new_status
+            updated.append(friend_request)
+            results.append({'request_id': request_id, 'result': new_status})
+
+    _save_request_statuses(updated)
+    if new_status == FriendRequest.Status.ACCEPTED:
+        _save_friendships((r.sender_id, r.receiver_id) for r in updated)
+    return results
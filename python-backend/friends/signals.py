@@ -0,0 +1,149 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from social_backend.cache import bump_user_versions
+from social_backend.replicas import pin_to_primary
+
+from . import events, outbox
+from .graph import ADD, REMOVE, friend_graph
+from .models import FriendRequest, Friendship
+from .suggestions import invalidate_suggestions
+
+User = get_user_model()
+
+# Sent after bulk_create()/bulk_update() of friend data, which bypass
+# post_save. The sender is the model class, ``instances`` the written rows.
+post_bulk_save = Signal()
+
+FRIENDSHIP_CREATED = 'friendship.created'
+FRIENDSHIP_DELETED = 'friendship.deleted'
+
+
+def friend_data_changed(*user_ids):
+    """Drop cached suggestions and responses of users whose friend data changed.
+
+    The users also read from the primary for a while, so that a lagging
+    replica cannot put the old data back in the cache.
+    """
+    pin_to_primary(*user_ids)
+    invalidate_suggestions(*user_ids)
+    bump_user_versions(*user_ids)
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def friendship_changed(sender, instance, **kwargs):
+    """Invalidate cached data of both users of a friendship."""
+    friend_data_changed(instance.user1_id, instance.user2_id)
+
+
+def update_friend_graph(operation, friendships, using=None):
+    """Apply friendship changes to the in-memory graph once they are committed."""
+    changes = [(operation, f.user1_id, f.user2_id) for f in friendships]
+    transaction.on_commit(lambda: friend_graph.record(changes), using=using)
+
+
+def enqueue_friendship_events(topic, friendships):
+    """Record outbox events for friendship changes in the current transaction."""
+    # A pair can be friends more than once over time; creation time tells the friendships apart
+    outbox.enqueue(
+        (
+            topic,
+            f'{topic}:{f.user1_id}:{f.user2_id}:{f.created_at.isoformat()}',
+            {'user_ids': [f.user1_id, f.user2_id]},
+        )
+        for f in friendships
+    )
+
+
+@receiver(post_save, sender=Friendship)
+def friendship_saved(sender, instance, created, using, **kwargs):
+    """Add a new friendship to the friend graph."""
+    if created:
+        update_friend_graph(ADD, [instance], using)
+        enqueue_friendship_events(FRIENDSHIP_CREATED, [instance])
+
+
+@receiver(post_delete, sender=Friendship)
+def friendship_deleted(sender, instance, using, **kwargs):
+    """Remove a deleted friendship from the friend graph."""
+    update_friend_graph(REMOVE, [instance], using)
+    enqueue_friendship_events(FRIENDSHIP_DELETED, [instance])
+
+
+@receiver(post_save, sender=FriendRequest)
+@receiver(post_delete, sender=FriendRequest)
+def friend_request_changed(sender, instance, **kwargs):
+    """Invalidate cached data of both sides of a friend request."""
+    friend_data_changed(instance.sender_id, instance.receiver_id)
+
+
+@receiver(post_save, sender=FriendRequest)
+def friend_request_saved(sender, instance, created, using, **kwargs):
+    """Push new friend requests to the event streams of both sides."""
+    if created:
+        events.publish([instance], using)
+
+
+@receiver(post_bulk_save, sender=Friendship)
+def friendships_bulk_saved(sender, instances, **kwargs):
+    """Invalidate cached data of every user in bulk-created friendships."""
+    friend_data_changed(*{user_id for f in instances for user_id in (f.user1_id, f.user2_id)})
+    update_friend_graph(ADD, instances)
+    enqueue_friendship_events(FRIENDSHIP_CREATED, instances)
+
+
+@receiver(post_bulk_save, sender=FriendRequest)
+def friend_requests_bulk_saved(sender, instances, **kwargs):
+    """Invalidate cached data of both sides of bulk-written friend requests.
+
+    Every bulk write creates requests or answers them, so each one is also
+    pushed to the event streams.
+    """
+    friend_data_changed(*{user_id for r in instances for user_id in (r.sender_id, r.receiver_id)})
+    events.publish(instances)
+
+
+@receiver(post_save, sender=User)
+def user_profile_changed(sender, instance, created, update_fields, **kwargs):
+    """Invalidate cached responses that embed the user's public profile.
+
+    Friend lists and friend request lists of other users show the user's
+    name, email and picture, so saves that leave those alone, such as
+    logins, invalidate nothing.
+    """
+    if created or not instance.changed_public_fields(update_fields):
+        return
+    related_ids = Friendship.objects.friend_ids(instance.id)
+    related_ids.update(
+        user_id
+        for pair in FriendRequest.objects.filter(
+            Q(sender_id=instance.id) | Q(receiver_id=instance.id)
+        ).values_list('sender_id', 'receiver_id')
+        for user_id in pair
+    )
+    related_ids.discard(instance.id)
+    if related_ids:
+        bump_user_versions(*related_ids)
+
+
+@outbox.handler(FRIENDSHIP_CREATED)
+@outbox.handler(FRIENDSHIP_DELETED)
+def friends_of_friends_changed(event):
+    """Invalidate cached data of the friends of both users, whose friends-of-friends changed.
+
+    Runs in the outbox worker: the two users themselves are invalidated
+    inline, but their friends can number in the thousands.
+    """
+    user_ids = event.payload['user_ids']
+    affected = set()
+    for user_id in user_ids:
+        affected.update(Friendship.objects.friend_ids(user_id))
+    affected.difference_update(user_ids)
+    if affected:
+        # Their own friends did not change, so they stay on the replicas
+        invalidate_suggestions(*affected)
+        bump_user_versions(*affected)
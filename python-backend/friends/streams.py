@@ -0,0 +1,312 @@
+"""
+Server-sent event streams of friend request events.
+
+``GET /api/friends/events/`` is served by ``event_stream``, a plain ASGI
+app mounted in front of Django by ``social_backend.asgi``. It keeps a
+``text/event-stream`` response open and sends the authenticated user an
+event whenever a friend request they sent or received is created,
+accepted or rejected::
+
+    event: friend_request.accepted
+    data: {"type": "friend_request.accepted", "friend_request": {...}}
+
+``friend_request`` has the shape of the items of ``/api/friends/requests/``.
+A ``ready`` event starts every stream; clients load the request list once
+after it and apply events from then on instead of polling the list.
+
+* Each worker runs one ``EventRelay`` per event loop. While it has
+  subscribers, it reads new entries from the shared event log (see
+  ``friends.events``) every ``FRIEND_EVENTS_POLL_SECONDS`` and loads the
+  requests of the entries someone here listens to with one query, however
+  many streams receive them.
+* Every stream has a queue of at most ``FRIEND_EVENTS_QUEUE_SIZE`` events.
+  The server only writes to a connection as fast as the client reads, so a
+  client that falls that far behind, or streams that missed log entries
+  that expired, get a ``reset`` event and are closed; they reconnect and
+  load the list again.
+* A comment line is sent every ``FRIEND_EVENTS_HEARTBEAT_SECONDS`` to keep
+  idle connections open through proxies.
+
+The stream is authenticated with the usual ``Authorization: Bearer``
+header or, since browsers' ``EventSource`` cannot set headers, a
+``?token=`` query parameter holding the access token. When the token
+expires or the user is deactivated, the stream ends with an ``expired``
+event; clients reconnect with a fresh token.
+
+The app runs outside Django's middleware, so it applies the
+``CorsMiddleware`` rules itself to let the configured frontends connect.
+"""
+
+import asyncio
+import io
+import logging
+import time
+import weakref
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from corsheaders.middleware import CorsMiddleware
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse
+from rest_framework import exceptions
+
+from accounts.authentication import ais_user_active
+
+from social_backend.async_views import authenticator, error_response
+from social_backend.renderers import render_json
+
+from .events import EVENT_LOG_SEQUENCE_KEY, event_log_key
+from .models import FriendRequest
+from .views import FriendRequestListView
+
+logger = logging.getLogger(__name__)
+
+EVENT_STREAM_PATH = '/api/friends/events/'
+
+# Milliseconds browsers wait before reconnecting a dropped stream
+RECONNECT_MS = 3000
+
+# Queued in place of the events a subscriber can no longer be sent
+RESET = object()
+
+cors = CorsMiddleware(lambda request: None)
+
+
+class Subscriber:
+    """The queue of events waiting to be sent on one stream."""
+
+    def __init__(self, user_id, limit):
+        self.user_id = user_id
+        self.limit = limit
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    def put(self, item):
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.limit:
+            item = RESET
+        if item is RESET:
+            self.closed = True
+        self.queue.put_nowait(item)
+
+
+class EventRelay:
+    """Fans the shared event log out to the streams on one event loop."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.sequence = 0
+        self.missing = None
+        self.task = None
+
+    def subscribe(self, user_id):
+        subscriber = Subscriber(user_id, settings.FRIEND_EVENTS_QUEUE_SIZE)
+        self.subscribers[user_id].add(subscriber)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self.subscribers.get(subscriber.user_id, set())
+        subscribers.discard(subscriber)
+        if not subscribers:
+            self.subscribers.pop(subscriber.user_id, None)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        """Follow the log for as long as anyone is subscribed."""
+        try:
+            self.sequence = await cache.aget(EVENT_LOG_SEQUENCE_KEY, 0)
+            self.missing = None
+            while self.subscribers:
+                await asyncio.sleep(settings.FRIEND_EVENTS_POLL_SECONDS)
+                try:
+                    await self.poll()
+                except Exception:
+                    logger.exception('Reading the friend event log failed')
+        finally:
+            if self.task is asyncio.current_task():
+                self.task = None
+
+    async def poll(self):
+        latest = await cache.aget(EVENT_LOG_SEQUENCE_KEY, 0)
+        if latest < self.sequence:
+            # The log was lost with the cache, and events along with it
+            self.reset()
+            self.sequence = latest
+            return
+        sequences = range(self.sequence + 1, latest + 1)
+        if not sequences:
+            return
+        entries = await cache.aget_many([event_log_key(sequence) for sequence in sequences])
+        events = []
+        for sequence in sequences:
+            entry = entries.get(event_log_key(sequence))
+            if entry is None:
+                # The writer may not have stored it yet; still missing at the
+                # next poll, it expired
+                if self.missing == sequence:
+                    self.reset()
+                    self.sequence = latest
+                    self.missing = None
+                    return
+                self.missing = sequence
+                break
+            events.append((sequence, *entry))
+            self.sequence = sequence
+        else:
+            self.missing = None
+        await self.deliver(events)
+
+    async def deliver(self, events):
+        """Send events to the streams of both sides, loading their requests in one query."""
+        events = [event for event in events if event[3] in self.subscribers or event[4] in self.subscribers]
+        if not events:
+            return
+        projection = FriendRequestListView.projection
+        rows = projection.values(FriendRequest.objects.filter(id__in={event[2] for event in events}))
+        friend_requests = {row['id']: projection.to_dict(row) async for row in rows}
+        for sequence, event_type, request_id, sender_id, receiver_id in events:
+            if request_id not in friend_requests:
+                # Deleted since
+                continue
+            message = {'type': event_type, 'friend_request': friend_requests[request_id]}
+            for user_id in {sender_id, receiver_id}:
+                for subscriber in self.subscribers.get(user_id, ()):
+                    subscriber.put((sequence, message))
+
+    def reset(self):
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                subscriber.put(RESET)
+
+
+relays = weakref.WeakKeyDictionary()
+
+
+def get_relay():
+    """Return the relay of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in relays:
+        relays[loop] = EventRelay()
+    return relays[loop]
+
+
+def get_raw_token(scope):
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            return authenticator.get_raw_token(value)
+    tokens = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token')
+    return tokens[-1].encode() if tokens else None
+
+
+async def authenticate(scope):
+    """Return the user and the validated token of the connection, or raise ``AuthenticationFailed``."""
+    raw_token = get_raw_token(scope)
+    if raw_token is None:
+        raise exceptions.NotAuthenticated()
+    validated_token = authenticator.get_validated_token(raw_token)
+    return await authenticator.aget_user(validated_token), validated_token
+
+
+def encode_headers(response):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.items()]
+
+
+def cors_headers(request):
+    """Return the CORS headers ``CorsMiddleware`` would add to a response to ``request``."""
+    response = cors.add_response_headers(request, HttpResponse())
+    return [(name, value) for name, value in encode_headers(response)
+            if name.startswith(b'access-control-') or name == b'vary']
+
+
+async def send_response(send, response):
+    """Send a complete Django ``HttpResponse``."""
+    headers = encode_headers(response)
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.content})
+
+
+def format_event(sequence, message):
+    data = render_json(message).decode()
+    return f"id: {sequence}\nevent: {message['type']}\ndata: {data}\n\n".encode()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def event_stream(scope, receive, send):
+    """ASGI app streaming the friend request events of the authenticated user."""
+    request = ASGIRequest(scope, io.BytesIO())
+    preflight = cors.check_preflight(request)
+    if preflight is not None:
+        return await send_response(send, cors.add_response_headers(request, preflight))
+    if scope['method'] != 'GET':
+        response = error_response(exceptions.MethodNotAllowed(scope['method']))
+        response['Allow'] = 'GET'
+        return await send_response(send, cors.add_response_headers(request, response))
+    try:
+        user, token = await authenticate(scope)
+    except (exceptions.NotAuthenticated, exceptions.AuthenticationFailed) as exc:
+        return await send_response(send, cors.add_response_headers(request, error_response(exc)))
+
+    relay = get_relay()
+    subscriber = relay.subscribe(user.id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    getter = None
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Stop nginx from buffering the stream
+                (b'x-accel-buffering', b'no'),
+                *cors_headers(request),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': f'retry: {RECONNECT_MS}\nevent: ready\ndata: {{}}\n\n'.encode(),
+            'more_body': True,
+        })
+        active = True
+        while True:
+            expires_in = token['exp'] - time.time()
+            if expires_in <= 0 or not active:
+                await send({'type': 'http.response.body', 'body': b'event: expired\ndata: {}\n\n'})
+                return
+            if getter is None:
+                getter = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected},
+                timeout=min(settings.FRIEND_EVENTS_HEARTBEAT_SECONDS, expires_in),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                return
+            if getter not in done:
+                # Deactivation is checked as often as the connection is kept alive
+                active = await ais_user_active(user.id)
+                chunk = b': keepalive\n\n'
+            elif getter.result() is RESET:
+                await send({'type': 'http.response.body', 'body': b'event: reset\ndata: {}\n\n'})
+                return
+            else:
+                chunk = format_event(*getter.result())
+                getter = None
+            # Waits while the client is not reading
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        relay.unsubscribe(subscriber)
+        disconnected.cancel()
+        if getter is not None:
+            getter.cancel()
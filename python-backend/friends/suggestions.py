@@ -0,0 +1,96 @@
+"""
+Friend suggestions ranked by the number of mutual friends.
+
+Candidates are the friends of the user's friends, counted in the in-memory
+friend graph (see ``friends.graph``). When the graph around the user is too
+sparse, the list is topped up with the most recently joined users.
+The ranked ids are cached per user and dropped whenever a friendship or
+friend request involving that user changes, or one of their friends gains
+or loses a friend (see ``friends.signals``).
+"""
+
+import heapq
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+
+from .graph import friend_graph
+from .models import FriendRequest
+
+User = get_user_model()
+
+# Number of suggestions returned to the client
+SUGGESTION_LIMIT = 5
+
+# Upper bound on the friends whose own friends are considered as candidates,
+# so users with very large friend lists still cost bounded work
+MAX_FRIENDS_EXPANDED = 500
+
+# Cached suggestions also change when a friend makes or loses a friend; the
+# outbox worker invalidates those users shortly after, and the TTL bounds
+# how stale their suggestions get when it is not running
+SUGGESTION_CACHE_TIMEOUT = 60 * 15
+
+
+def suggestion_cache_key(user_id):
+    """Return the cache key holding the ranked suggestion ids of a user."""
+    return f'friends:suggestions:{user_id}'
+
+
+def invalidate_suggestions(*user_ids):
+    """Drop the cached suggestions of the given users."""
+    cache.delete_many([suggestion_cache_key(user_id) for user_id in user_ids])
+
+
+def excluded_user_ids(user_id):
+    """Return the ids that must never be suggested to the user."""
+    requested = FriendRequest.objects.filter(
+        Q(sender_id=user_id) | Q(receiver_id=user_id)
+    ).order_by().values_list('sender_id', 'receiver_id')
+    excluded = {user_id}
+    for sender_id, receiver_id in requested:
+        excluded.add(sender_id)
+        excluded.add(receiver_id)
+    return excluded
+
+
+def rank_suggestions(user_id, limit=SUGGESTION_LIMIT):
+    """Compute the ids of up to ``limit`` suggested users, best match first."""
+    graph = friend_graph.ensure_current()
+    friend_ids = graph.friend_ids(user_id)
+    excluded = excluded_user_ids(user_id).union(friend_ids)
+
+    # Every friend of one of our friends is a candidate; the number of our
+    # friends naming them is the number of mutual friends
+    mutual = graph.count_friends_of(friend_ids[:MAX_FRIENDS_EXPANDED])
+    ranked = heapq.nsmallest(
+        limit,
+        (candidate for candidate in mutual if candidate not in excluded),
+        key=lambda candidate: (-mutual[candidate], candidate),
+    )
+
+    if len(ranked) < limit:
+        # Not enough friends-of-friends: fill up with the newest users, which
+        # walks the primary key index instead of scanning the table
+        newest = (
+            User.objects.filter(is_active=True)
+            .exclude(id__in=excluded.union(ranked))
+            .order_by('-id')
+            .values_list('id', flat=True)
+        )
+        ranked.extend(newest[:limit - len(ranked)])
+
+    return ranked
+
+
+def get_suggestions(user_id, limit=SUGGESTION_LIMIT):
+    """Return the suggested users for ``user_id``, using the cache when possible."""
+    key = suggestion_cache_key(user_id)
+    ranked = cache.get(key)
+    if ranked is None:
+        ranked = rank_suggestions(user_id, limit)
+        cache.set(key, ranked, SUGGESTION_CACHE_TIMEOUT)
+
+    users = User.objects.filter(is_active=True).in_bulk(ranked[:limit])
+    return [users[user_id] for user_id in ranked[:limit] if user_id in users]
@@ -1,8 +1,12 @@
 from django.urls import path
 
 from .views import (
+    BatchRespondToFriendRequestView,
+    BatchSendFriendRequestView,
     FriendListView,
+    FriendPathView,
     FriendRequestListView,
+    MutualFriendsView,
     SendFriendRequestView,
     RespondToFriendRequestView,
     FriendSuggestionView,
@@ -11,6 +15,18 @@ from .views import (
 urlpatterns = [
     path('', FriendListView.as_view(), name='friend-list'),
     path('requests/', FriendRequestListView.as_view(), name='friend-request-list'),
+    path('requests/batch/', BatchSendFriendRequestView.as_view(),
+         name='batch-send-friend-requests'),
+    path('requests/batch/accept/',
+         BatchRespondToFriendRequestView.as_view(),
+         {'action': 'accept'},
+         name='batch-accept-friend-requests'
+         ),
+    path('requests/batch/reject/',
+         BatchRespondToFriendRequestView.as_view(),
+         {'action': 'reject'},
+         name='batch-reject-friend-requests'
+         ),
     path('requests/<int:user_id>/', SendFriendRequestView.as_view(),
          name='send-friend-request'),
     path('requests/<int:request_id>/accept/',
@@ -24,4 +40,6 @@ urlpatterns = [
          name='reject-friend-request'
          ),
     path('suggestions/', FriendSuggestionView.as_view(), name='friend-suggestions'),
+    path('mutual/<int:user_id>/', MutualFriendsView.as_view(), name='mutual-friends'),
+    path('path/<int:user_id>/', FriendPathView.as_view(), name='friend-path'),
 ]
@@ -1,33 +1,52 @@
-import random
+import time
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.exceptions import APIException, ValidationError, NotFound
 
+from accounts.serializers import UserListSerializer
+from .graph import SearchBudgetExceeded, friend_graph
 from .models import FriendRequest, Friendship
+from social_backend.cache import CachedResponseMixin, ConditionalGetMixin
+from social_backend.pagination import SelectablePagination
+from social_backend.projections import Projection, ProjectedListMixin
 from .serializers import (
+    BatchRespondToFriendRequestSerializer,
+    BatchSendFriendRequestSerializer,
     FriendRequestSerializer,
+    FriendshipProjection,
+    FriendPathQuerySerializer,
     FriendshipSerializer,
     FriendSuggestionSerializer,
 )
+from .services import (
+    respond_to_friend_request,
+    respond_to_friend_requests,
+    send_friend_request,
+    send_friend_requests,
+)
+from .suggestions import get_suggestions
 
 User = get_user_model()
 
-
-class FriendListView(generics.ListAPIView):
+class FriendListView(ConditionalGetMixin, CachedResponseMixin, ProjectedListMixin, generics.ListAPIView):
     """API view for listing all friends of the authenticated user."""
 
     serializer_class = FriendshipSerializer
+    projection = FriendshipProjection()
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SelectablePagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         user = self.request.user
-        # Get all friendships where the user is either user1 or user2
-        return Friendship.objects.filter(
-            Q(user1=user) | Q(user2=user)
-        )
+        # Get all friendships where the user is either user1 or user2; the
+        # projection joins both sides into the same query
+        return Friendship.objects.for_user(user)
 
     def get_serializer_context(self):
         """Add request to serializer context."""
@@ -36,11 +55,14 @@ class FriendListView(generics.ListAPIView):
         return context
 
 
-class FriendRequestListView(generics.ListAPIView):
+class FriendRequestListView(ConditionalGetMixin, ProjectedListMixin, generics.ListAPIView):
     """API view for listing all friend requests of the authenticated user."""
 
     serializer_class = FriendRequestSerializer
+    projection = Projection(FriendRequestSerializer)
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SelectablePagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         user = self.request.user
@@ -54,75 +76,17 @@ class SendFriendRequestView(APIView):
     """API view for sending a friend request to another user."""
 
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'friend_requests'
 
     def post(self, request, user_id):
-        sender = request.user
-
-        try:
-            receiver = User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return Response(
-                {"detail": "User not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Check if trying to send request to self
-        if sender == receiver:
-            return Response(
-                {"detail": "You cannot send a friend request to yourself."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Check if already friends
-        friendship_exists = Friendship.objects.filter(
-            (Q(user1=sender) & Q(user2=receiver)) |
-            (Q(user1=receiver) & Q(user2=sender))
-        ).exists()
-
-        if friendship_exists:
-            return Response(
-                {"detail": "You are already friends with this user."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Check if request already exists
-        request_exists = FriendRequest.objects.filter(
-            sender=sender,
-            receiver=receiver
-        ).exists()
-
-        if request_exists:
-            return Response(
-                {"detail": "A friend request has already been sent to this user."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Check if there's a pending request in the opposite direction
-        opposite_request = FriendRequest.objects.filter(
-            sender=receiver,
-            receiver=sender,
-            status=FriendRequest.Status.PENDING
-        ).first()
-
-        if opposite_request:
-            # Auto-accept the opposite request
-            opposite_request.status = FriendRequest.Status.ACCEPTED
-            opposite_request.save()
-
-            # Create friendship
-            Friendship.objects.create(user1=sender, user2=receiver)
+        friend_request, accepted = send_friend_request(request.user, user_id)
 
+        if accepted:
             return Response({
                 "detail": "Friend request accepted automatically as they had already requested you.",
-                "friend_request": FriendRequestSerializer(opposite_request).data
+                "friend_request": FriendRequestSerializer(friend_request).data
             }, status=status.HTTP_201_CREATED)
 
-        # Create new friend request
-        friend_request = FriendRequest.objects.create(
-            sender=sender,
-            receiver=receiver
-        )
-
         return Response(
             FriendRequestSerializer(friend_request).data,
             status=status.HTTP_201_CREATED
@@ -140,92 +104,135 @@ class RespondToFriendRequestView(APIView):
 
         The 'action' parameter is passed from the URL configuration.
         """
-        user = request.user
-
-        try:
-            friend_request = FriendRequest.objects.get(
-                id=request_id, receiver=user)
-        except FriendRequest.DoesNotExist:
-            return Response(
-                {"detail": "Friend request not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Check if the request is still pending
-        if friend_request.status != FriendRequest.Status.PENDING:
+        if action not in ('accept', 'reject'):
             return Response(
-                {"detail": f"This friend request has already been {friend_request.status}."},
+                {"detail": "Invalid action. Use 'accept' or 'reject'."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if action == 'accept':
-            friend_request.status = FriendRequest.Status.ACCEPTED
-            friend_request.save()
+        respond_to_friend_request(request.user, request_id, action)
 
-            # Create friendship
-            Friendship.objects.create(
-                user1=friend_request.sender,
-                user2=friend_request.receiver
-            )
+        return Response(
+            {"detail": f"Friend request {action}ed successfully."},
+            status=status.HTTP_200_OK
+        )
 
-            return Response(
-                {"detail": "Friend request accepted successfully."},
-                status=status.HTTP_200_OK
-            )
 
-        elif action == 'reject':
-            friend_request.status = FriendRequest.Status.REJECTED
-            friend_request.save()
+class BatchSendFriendRequestView(APIView):
+    """API view for sending friend requests to many users in one transaction."""
 
-            return Response(
-                {"detail": "Friend request rejected successfully."},
-                status=status.HTTP_200_OK
-            )
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'friend_requests'
+
+    def post(self, request):
+        serializer = BatchSendFriendRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = send_friend_requests(request.user, serializer.validated_data['user_ids'])
 
-        else:
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class BatchRespondToFriendRequestView(APIView):
+    """API view for accepting or rejecting many friend requests in one transaction."""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def put(self, request, action=None):
+        """The 'action' parameter is passed from the URL configuration."""
+        if action not in ('accept', 'reject'):
             return Response(
                 {"detail": "Invalid action. Use 'accept' or 'reject'."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        serializer = BatchRespondToFriendRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = respond_to_friend_requests(
+            request.user, serializer.validated_data['request_ids'], action)
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
 
-class FriendSuggestionView(generics.ListAPIView):
-    """API view for suggesting potential friends."""
+class FriendSuggestionView(CachedResponseMixin, generics.ListAPIView):
+    """API view for suggesting potential friends, ranked by mutual friends."""
 
     serializer_class = FriendSuggestionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
+        # Ranked friends-of-friends, cached per user
+        return get_suggestions(self.request.user.id)
 
-        # Get IDs of users who are already friends with the current user
-        friend_ids = set()
-        friendships = Friendship.objects.filter(Q(user1=user) | Q(user2=user))
-        for friendship in friendships:
-            friend = friendship.user1 if friendship.user2 == user else friendship.user2
-            friend_ids.add(friend.id)
 
-        # Get IDs of users who have pending friend requests with the current user
-        request_user_ids = set()
-        requests = FriendRequest.objects.filter(
-            Q(sender=user) | Q(receiver=user)
-        )
-        for req in requests:
-            other_user = req.receiver if req.sender == user else req.sender
-            request_user_ids.add(other_user.id)
+class PathSearchTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Finding a connection took too long, try fewer hops.'
+    default_code = 'path_search_timeout'
+
+
+user_projection = Projection(UserListSerializer)
 
-        # Exclude friends, requests, and self from potential suggestions
-        excluded_ids = friend_ids.union(request_user_ids)
-        excluded_ids.add(user.id)
 
-        # Get potential suggestions
-        suggestions = User.objects.exclude(id__in=excluded_ids)
+def get_target_user_id(user_id):
+    """Return ``user_id`` if it is an active user, else raise ``NotFound``."""
+    if not User.objects.filter(id=user_id, is_active=True).exists():
+        raise NotFound("User not found.")
+    return user_id
 
-        # Randomly select up to 5 users
-        suggestion_count = min(5, suggestions.count())
-        if suggestion_count > 0:
-            suggestion_ids = random.sample(
-                list(suggestions.values_list('id', flat=True)), suggestion_count)
-            return User.objects.filter(id__in=suggestion_ids)
 
-        return User.objects.none()
+def users_in_order(user_ids):
+    """Serialize the active users among ``user_ids`` in that order, in one query."""
+    rows = user_projection.values(User.objects.filter(id__in=user_ids, is_active=True))
+    by_id = {row['id']: user_projection.to_dict(row) for row in rows}
+    return [by_id[user_id] for user_id in user_ids if user_id in by_id]
+
+
+class MutualFriendsView(generics.ListAPIView):
+    """API view for listing the friends the authenticated user shares with another user."""
+
+    serializer_class = UserListSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'connections'
+
+    def list(self, request, user_id):
+        get_target_user_id(user_id)
+        # Intersected in the friend graph; only the page's users are fetched,
+        # after dropping deactivated ones so the count matches the pages
+        mutual_ids = friend_graph.ensure_current().mutual_friend_ids(request.user.id, user_id)
+        active_ids = set(User.objects.filter(id__in=mutual_ids, is_active=True).values_list('id', flat=True))
+        mutual_ids = [friend_id for friend_id in mutual_ids if friend_id in active_ids]
+        page = self.paginate_queryset(mutual_ids)
+        if page is None:
+            return Response(users_in_order(mutual_ids))
+        return self.get_paginated_response(users_in_order(page))
+
+
+class FriendPathView(APIView):
+    """API view for the shortest chain of friends from the authenticated user to another user."""
+
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'connections'
+
+    def get(self, request, user_id):
+        query = FriendPathQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        max_hops = query.validated_data['max_hops']
+        get_target_user_id(user_id)
+
+        graph = friend_graph.ensure_current()
+        deadline = time.monotonic() + settings.FRIEND_PATH_BUDGET_MS / 1000
+        try:
+            path = graph.shortest_path(request.user.id, user_id, max_hops, deadline)
+        except SearchBudgetExceeded:
+            raise PathSearchTimeout()
+        users = [] if path is None else users_in_order(path)
+        # A chain through a deactivated or deleted user is no connection
+        if path is None or len(users) < len(path):
+            raise NotFound(f"No connection within {max_hops} hops.")
+
+        return Response({
+            "degrees": len(path) - 1,
+            "path": users,
+        }, status=status.HTTP_200_OK)
@@ -3,9 +3,27 @@ ASGI config for social_backend project.
 """
 
 import os
+import threading
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_backend.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+django_application = get_asgi_application()
+
+# Start with the friend graph in memory instead of loading it on a request
+from friends.graph import preload  # noqa: E402
+from friends.streams import EVENT_STREAM_PATH, event_stream  # noqa: E402
+
+# Servers such as uvicorn import the app on their event loop, where the ORM
+# refuses to run, so load from a thread
+loader = threading.Thread(target=preload)
+loader.start()
+loader.join()
+
+
+async def application(scope, receive, send):
+    """Serve friend request event streams next to the Django app."""
+    if scope['type'] == 'http' and scope['path'] == EVENT_STREAM_PATH:
+        return await event_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,121 @@
+"""
+Plumbing for async function views served under ASGI.
+
+DRF 3.14 views are synchronous, so the async endpoints are plain Django
+coroutine views. ``async_api_view`` gives them what ``APIView`` gives the
+sync ones: the allowed methods, JWT authentication, a DRF ``Request`` (for
+``query_params`` and ``data``), the default throttles, conditional GETs
+like ``ConditionalGetMixin``, and DRF exceptions turned into JSON error
+responses with the same status codes and bodies. Responses are rendered by
+the same JSON renderer as the DRF views, so both produce identical bytes.
+"""
+
+import functools
+import json
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from accounts.authentication import ClaimsJWTAuthentication
+
+from .cache import aget_response_validators, set_validators
+from .renderers import render_json
+from .throttling import bucket_store
+
+authenticator = ClaimsJWTAuthentication()
+
+
+class AsyncRequest(Request):
+    """DRF ``Request`` whose body is parsed as JSON without DRF's parsers."""
+
+    @property
+    def data(self):
+        if not hasattr(self, '_async_data'):
+            try:
+                self._async_data = json.loads(self._request.body or b'{}')
+            except ValueError:
+                raise exceptions.ParseError()
+        return self._async_data
+
+
+def json_response(data, status):
+    return HttpResponse(render_json(data), status=status, content_type='application/json')
+
+
+def error_response(exc):
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = json_response(detail, exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = authenticator.authenticate_header(None)
+    if getattr(exc, 'wait', None):
+        response['Retry-After'] = '%d' % exc.wait
+    return response
+
+
+def check_throttles(request, throttle_scope=None):
+    """Apply the default throttle classes like ``APIView.check_throttles``."""
+    # Throttles only read the scope from the view; bucket checks never wait on the database
+    view = SimpleNamespace(throttle_scope=throttle_scope)
+    durations = []
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, view):
+            durations.append(throttle.wait())
+    if durations:
+        durations = [duration for duration in durations if duration is not None]
+        raise exceptions.Throttled(max(durations, default=None))
+
+
+async def acheck_throttles(request, throttle_scope=None):
+    """``check_throttles`` for the event loop; checks against a network store run on a thread."""
+    if bucket_store().blocking:
+        await sync_to_async(check_throttles, thread_sensitive=False)(request, throttle_scope)
+    else:
+        check_throttles(request, throttle_scope)
+
+
+def async_api_view(*methods, throttle_scope=None, conditional=None):
+    """Turn an ``async def view(request, ...)`` returning data into an authenticated JSON view.
+
+    The view may return the response data, or a ``(data, status)`` tuple.
+    ``throttle_scope`` plays the part of the DRF view attribute, and
+    ``conditional`` names the sync view whose ``ConditionalGetMixin``
+    validators the view shares.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            drf_request = AsyncRequest(request)
+            try:
+                authenticated = await authenticator.aauthenticate(request)
+                if authenticated is None:
+                    raise exceptions.NotAuthenticated()
+                drf_request.user, drf_request.auth = authenticated
+                await acheck_throttles(drf_request, throttle_scope)
+                validators = None
+                if conditional:
+                    validators = await aget_response_validators(conditional, drf_request, 'application/json')
+                if validators:
+                    response = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+                    if response is not None:
+                        return set_validators(response, *validators)
+                result = await view(drf_request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return error_response(exc)
+            data, code = result if isinstance(result, tuple) else (result, status.HTTP_200_OK)
+            response = json_response(data, code)
+            if validators and code == status.HTTP_200_OK:
+                set_validators(response, *validators)
+            return response
+
+        # Token based like the DRF views; csrf_exempt only wraps async views from Django 5.0
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
@@ -0,0 +1,256 @@
+"""
+Per-user response caching for read-heavy endpoints.
+
+Every user has a version number stored in the cache. Cached responses are
+keyed by the user's current version, so bumping the version (done by signal
+handlers whenever the user, their friendships or their friend requests
+change) makes all of that user's cached responses unreachable at once,
+without having to track and delete individual keys.
+
+The versions also validate conditional requests: ``ConditionalGetMixin``
+derives a view's ``ETag`` from the user's version and its
+``Last-Modified`` from the time of the last bump, and answers a request
+whose copy is still current with ``304 Not Modified`` before running the
+view, without a query or rendering a body.
+
+Replicas may not have a change yet when its bump is seen: a request that
+reads from a replica within ``REPLICA_PIN_SECONDS`` of the user's last bump
+neither stores its response nor gets validators, so stale data is never
+kept or vouched for under the version meant for the new data.
+"""
+
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .replicas import current_read_database
+
+# Seconds a cached response is kept; version bumps normally retire it sooner
+RESPONSE_CACHE_TIMEOUT = 60 * 5
+
+
+def user_version_key(user_id):
+    return f'user-version:{user_id}'
+
+
+def user_modified_key(user_id):
+    return f'user-modified:{user_id}'
+
+
+def _initial_version():
+    # Versions restart from the clock if the key is evicted, so they cannot
+    # go back to a value that older cached responses were stored under
+    return int(time.time() * 1000)
+
+
+def get_user_version(user_id):
+    """Return the current cache version of a user."""
+    key = user_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_user_version(user_id):
+    """Async variant of ``get_user_version``."""
+    key = user_version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def get_user_state(user_id):
+    """Return the version of a user and the time of their last bump (or ``None``) in one round trip."""
+    values = cache.get_many([user_version_key(user_id), user_modified_key(user_id)])
+    version = values.get(user_version_key(user_id))
+    if version is None:
+        version = get_user_version(user_id)
+    return version, values.get(user_modified_key(user_id))
+
+
+async def aget_user_state(user_id):
+    """Async variant of ``get_user_state``."""
+    values = await cache.aget_many([user_version_key(user_id), user_modified_key(user_id)])
+    version = values.get(user_version_key(user_id))
+    if version is None:
+        version = await aget_user_version(user_id)
+    return version, values.get(user_modified_key(user_id))
+
+
+def replica_may_lag(modified):
+    """Whether the current request reads from a replica that may not have the change bumped at ``modified``."""
+    if current_read_database.get() is None or modified is None:
+        return False
+    return time.time() - modified < settings.REPLICA_PIN_SECONDS
+
+
+def response_cache_key(view_name, request, version):
+    url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return f'response:{view_name}:{request.user.pk}:{version}:{url}'
+
+
+def _bump(user_ids):
+    for user_id in user_ids:
+        key = user_version_key(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+    cache.set_many({user_modified_key(user_id): time.time() for user_id in user_ids}, None)
+
+
+def bump_user_versions(*user_ids):
+    """Invalidate every cached response of the given users."""
+    user_ids = set(user_ids)
+    _bump(user_ids)
+    if connection.in_atomic_block:
+        # Requests between the bump and the commit still read the old data;
+        # bump again so nothing stays cached or validated under the version
+        # meant for the new data
+        transaction.on_commit(lambda: _bump(user_ids))
+
+
+class ResponseCacheStats:
+    """Process-local hit and miss counters per cached view."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, view_name, hit):
+        with self.lock:
+            (self.hits if hit else self.misses)[view_name] += 1
+
+    def snapshot(self):
+        with self.lock:
+            views = sorted(set(self.hits) | set(self.misses))
+            return {
+                view: {'hits': self.hits[view], 'misses': self.misses[view]}
+                for view in views
+            }
+
+    def reset(self):
+        with self.lock:
+            self.hits.clear()
+            self.misses.clear()
+
+
+response_cache_stats = ResponseCacheStats()
+
+
+class CachedResponseMixin:
+    """Cache successful GET responses of a view per user and per URL."""
+
+    response_cache_timeout = RESPONSE_CACHE_TIMEOUT
+
+    def get_response_cache_key(self, request, version):
+        return response_cache_key(self.__class__.__name__, request, version)
+
+    def get(self, request, *args, **kwargs):
+        view_name = self.__class__.__name__
+        version, modified = get_user_state(request.user.pk)
+        key = self.get_response_cache_key(request, version)
+        data = cache.get(key)
+        if data is not None:
+            response_cache_stats.record(view_name, hit=True)
+            return Response(data)
+
+        response_cache_stats.record(view_name, hit=False)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200 and not replica_may_lag(modified):
+            cache.set(key, response.data, self.response_cache_timeout)
+        return response
+
+
+async def acached_response_data(view_name, request, build, timeout=RESPONSE_CACHE_TIMEOUT):
+    """Async counterpart of ``CachedResponseMixin``: return cached data or cache ``await build()``.
+
+    ``view_name`` should be the name of the equivalent sync view so both
+    share cache entries and statistics.
+    """
+    version, modified = await aget_user_state(request.user.pk)
+    key = response_cache_key(view_name, request, version)
+    data = await cache.aget(key)
+    if data is not None:
+        response_cache_stats.record(view_name, hit=True)
+        return data
+
+    response_cache_stats.record(view_name, hit=False)
+    data = await build()
+    if not replica_may_lag(modified):
+        await cache.aset(key, data, timeout)
+    return data
+
+
+def response_validators(view_name, request, version, modified, media_type):
+    """Return the quoted ``ETag`` and the ``Last-Modified`` timestamp (or ``None``) of a response."""
+    uri = request.build_absolute_uri()
+    tag = hashlib.md5(f'{view_name}:{request.user.pk}:{version}:{media_type}:{uri}'.encode('utf-8')).hexdigest()
+    last_modified = None
+    if modified is not None:
+        # HTTP dates have whole seconds: give the end of the second the data
+        # changed in, and only once it is over, so later changes get later dates
+        last_modified = int(modified) + 1
+        if last_modified > time.time():
+            last_modified = None
+    return quote_etag(tag), last_modified
+
+
+def get_response_validators(view_name, request, media_type):
+    """Return the validators of ``view_name``'s response to ``request``, or ``None`` if a replica may lag."""
+    version, modified = get_user_state(request.user.pk)
+    if replica_may_lag(modified):
+        return None
+    return response_validators(view_name, request, version, modified, media_type)
+
+
+async def aget_response_validators(view_name, request, media_type):
+    """Async variant of ``get_response_validators``."""
+    version, modified = await aget_user_state(request.user.pk)
+    if replica_may_lag(modified):
+        return None
+    return response_validators(view_name, request, version, modified, media_type)
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep the response but must revalidate it before use
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class ConditionalGetMixin:
+    """Answer GET requests for an unchanged response with ``304 Not Modified``.
+
+    Only for views whose responses change only with data that bumps the
+    requesting user's version.
+    """
+
+    def get(self, request, *args, **kwargs):
+        validators = get_response_validators(self.__class__.__name__, request, request.accepted_media_type)
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        etag, last_modified = validators
+        # Evaluates If-None-Match, or If-Modified-Since without it, as RFC 9110 says
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, HttpResponseNotModified.status_code):
+            set_validators(response, etag, last_modified)
+        return response
@@ -0,0 +1,258 @@
+"""
+Per-view request metrics in the Prometheus text format.
+
+``RequestMetricsMiddleware`` times every request and counts the SQL queries
+it runs through an execute wrapper installed on every database connection,
+so the cost is a couple of clock reads per request and per query. The
+wrapper finds the request's recorder in a context variable, which also
+follows async views into the threads their ORM calls run in. Response
+rendering (turning the serialized data into JSON) is timed separately.
+Totals are kept per view name in process memory and served by
+``social_backend.views.metrics``.
+
+When ``SLOW_REQUEST_THRESHOLD_MS`` is set, requests slower than that are
+logged to the ``social_backend.slow_requests`` logger together with the SQL
+they ran.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .cache import response_cache_stats
+
+logger = logging.getLogger('social_backend.slow_requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        # Counts are stored per bucket and accumulated when rendered
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class ViewMetrics:
+    """Aggregated metrics of one view and HTTP method."""
+
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.statuses = {}
+
+
+class RequestMetrics:
+    """Thread-safe registry of per-view request metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, method, status, duration, queries, db_seconds, serialization_seconds):
+        with self.lock:
+            metrics = self.views.get((view, method))
+            if metrics is None:
+                metrics = self.views[(view, method)] = ViewMetrics()
+            metrics.duration.observe(duration)
+            metrics.queries.observe(queries)
+            metrics.db_seconds += db_seconds
+            metrics.serialization_seconds += serialization_seconds
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            views = sorted(self.views.items())
+
+            lines += [
+                '# HELP http_requests_total Requests handled, by view, method and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (view, method), metrics in views:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f'http_requests_total{labels(view=view, method=method, status=status)} {count}')
+
+            for name, attribute, help_text in (
+                ('http_request_duration_seconds', 'duration', 'Total request latency.'),
+                ('http_request_db_queries', 'queries', 'SQL queries run per request.'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (view, method), metrics in views:
+                    histogram = getattr(metrics, attribute)
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{labels(view=view, method=method, le=bound)} {count}')
+                    lines.append(f'{name}_bucket{labels(view=view, method=method, le="+Inf")} {histogram.count}')
+                    lines.append(f'{name}_sum{labels(view=view, method=method)} {histogram.sum}')
+                    lines.append(f'{name}_count{labels(view=view, method=method)} {histogram.count}')
+
+            for name, attribute, help_text in (
+                ('http_request_db_seconds_total', 'db_seconds', 'Time spent executing SQL.'),
+                ('http_request_serialization_seconds_total', 'serialization_seconds',
+                 'Time spent rendering response bodies.'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for (view, method), metrics in views:
+                    lines.append(f'{name}{labels(view=view, method=method)} {getattr(metrics, attribute)}')
+
+        cache_stats = response_cache_stats.snapshot()
+        for name, key in (('response_cache_hits_total', 'hits'), ('response_cache_misses_total', 'misses')):
+            lines += [f'# HELP {name} Cached response {key}, by view.', f'# TYPE {name} counter']
+            for view, counts in cache_stats.items():
+                lines.append(f'{name}{labels(view=view)} {counts[key]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def labels(**values):
+    escaped = (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for value in values.values()
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(values, escaped)) + '}'
+
+
+request_metrics = RequestMetrics()
+
+
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper handing queries to the current request's recorder, if any."""
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryRecorder:
+    """Execute wrapper counting and timing the queries of one request."""
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_sql and len(self.statements) < MAX_LOGGED_QUERIES:
+                self.statements.append((elapsed, sql))
+
+
+class RequestMetricsMiddleware:
+    """Record latency, SQL and rendering cost of every request per view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_recorder, dispatch_uid='request-metrics')
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder)
+
+    async def __acall__(self, request):
+        recorder, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder)
+
+    def start(self, request):
+        recorder = QueryRecorder(keep_sql=getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', None) is not None)
+        request._serialization_seconds = 0.0
+        request._metrics_started = time.perf_counter()
+        return recorder, current_recorder.set(recorder)
+
+    def finish(self, request, response, recorder):
+        duration = time.perf_counter() - request._metrics_started
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', None)
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else 'unmatched'
+        request_metrics.record(
+            view, request.method, response.status_code, duration,
+            recorder.count, recorder.seconds, request._serialization_seconds,
+        )
+        if threshold is not None and duration * 1000 >= threshold:
+            self.log_slow_request(request, response, view, duration, recorder)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time the rendering
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._serialization_seconds += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, response, view, duration, recorder):
+        queries = '\n'.join(f'  {elapsed * 1000:.1f}ms {sql}' for elapsed, sql in recorder.statements)
+        logger.warning(
+            'Slow request %s %s (%s) -> %s in %.1fms, %d queries in %.1fms\n%s',
+            request.method, request.get_full_path(), view, response.status_code,
+            duration * 1000, recorder.count, recorder.seconds * 1000, queries,
+        )
@@ -0,0 +1,204 @@
+"""
+Pagination classes shared by the list endpoints.
+
+``KeysetPagination`` walks a queryset by the values of its ordering columns
+instead of an ``OFFSET``, and never runs a ``COUNT(*)``, so fetching a page
+costs the same index range scan no matter how deep it is. Views opt in by
+using ``SelectablePagination``, which keeps the page-number behaviour unless
+the client sends a ``cursor`` query parameter.
+
+Each class also has an ``apaginate_queryset`` coroutine for async views,
+which fetches the page with the async ORM.
+"""
+
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage, Page
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only keyset pagination with opaque cursors.
+
+    The ordering is read from the view's ``keyset_ordering`` attribute and must
+    end with a unique column (usually ``id``) so every row has a distinct
+    position. All columns must sort in the same direction.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([obj async for obj in self.get_page_queryset(queryset, request, view)])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """Return the query for the requested page plus one row."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'keyset_ordering', self.ordering))
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.descending = self.ordering[0].startswith('-')
+        if any(field.startswith('-') != self.descending for field in self.ordering):
+            raise ValueError('Keyset ordering columns must all sort in the same direction.')
+
+        self.model = queryset.model
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        # One extra row tells whether there is a next page without counting
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_position_filter(self, position):
+        """Build the lexicographic "after this row" condition for the ordering columns."""
+        lookup = 'lt' if self.descending else 'gt'
+        condition = Q()
+        for index, field in enumerate(self.fields):
+            step = Q(**{f'{field}__{lookup}': position[index]})
+            for previous, value in zip(self.fields[:index], position[:index]):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def encode_cursor(self, instance):
+        if isinstance(instance, dict):
+            # A row of a .values() page, which holds the ordering columns
+            instance = self.model(**{field: instance[field] for field in self.fields})
+        values = [
+            instance._meta.get_field(field).value_to_string(instance)
+            for field in self.fields
+        ]
+        payload = json.dumps(values, separators=(',', ':')).encode('utf-8')
+        cursor = base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError
+            return [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, UnicodeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """``PageNumberPagination`` that can also count and fetch with the async ORM."""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached property; fill it in without a sync query
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        bottom = (number - 1) * page_size
+        objects = [obj async for obj in queryset[bottom:bottom + page_size]]
+        self.page = Page(objects, number, paginator)
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return objects
+
+
+class SelectablePagination(BasePagination):
+    """Page-number pagination, switching to keyset pagination on ``?cursor=``.
+
+    Clients start a keyset walk with an empty ``cursor`` parameter and follow
+    the ``next`` links from there.
+    """
+
+    keyset_class = KeysetPagination
+    page_number_class = AsyncPageNumberPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.select_paginator(request).paginate_queryset(queryset, request, view=view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return await self.select_paginator(request).apaginate_queryset(queryset, request, view=view)
+
+    def select_paginator(self, request):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.paginator = self.keyset_class()
+        else:
+            self.paginator = self.page_number_class()
+        return self.paginator
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number_class().get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(getattr(self, 'paginator', None), 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return self.paginator.get_results(data)
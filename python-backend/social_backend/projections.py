@@ -0,0 +1,102 @@
+"""
+Row projections for the read-only list endpoints.
+
+A ``ModelSerializer`` resolves every field of every row through DRF's field
+machinery, and needs full model instances to do it. A ``Projection`` reads
+the serializer's fields once and compiles a function building the same
+output dict straight from a ``.values()`` row:
+
+* model fields whose representation is the database value (text, numbers,
+  booleans, choices) are copied as they are;
+* other fields, such as datetimes, go through the serializer field's own
+  ``to_representation``;
+* nested model serializers of forward relations read the related columns
+  joined into the same row.
+
+``ProjectedListMixin`` serves a list view's pages through a projection, so
+the responses keep their fields, order and formatting.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.response import Response
+
+# Serializer fields whose to_representation() returns database values unchanged
+RAW_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField, serializers.ChoiceField)
+
+# Fields computed from objects rather than from a column
+UNSUPPORTED_FIELDS = (
+    serializers.BaseSerializer,
+    serializers.ManyRelatedField,
+    serializers.ModelField,
+    serializers.RelatedField,
+    serializers.SerializerMethodField,
+)
+
+
+class Projection:
+    """A read-only ``ModelSerializer`` compiled to a function of ``.values()`` rows.
+
+    ``prefix`` is the lookup path to the serialized model, e.g. ``'sender__'``
+    when projecting the sender of a friend request.
+    """
+
+    def __init__(self, serializer_class, prefix=''):
+        self.serializer_class = serializer_class
+        self.lookups = []
+        self.namespace = {}
+        expression = self.build(serializer_class, prefix)
+        source = f'def to_dict(row):\n    return {expression}\n'
+        exec(compile(source, f'<projection of {serializer_class.__name__}>', 'exec'), self.namespace)
+        self.to_dict = self.namespace['to_dict']
+
+    def build(self, serializer_class, prefix):
+        """Return the source of the dict expression for one serializer, adding its lookups."""
+        model = serializer_class.Meta.model
+        items = []
+        for name, field in serializer_class().fields.items():
+            if getattr(field, 'write_only', False):
+                continue
+            if '.' in field.source or field.source == '*':
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} cannot be projected.')
+            lookup = prefix + field.source
+            if isinstance(field, serializers.ModelSerializer) and not getattr(field, 'many', False):
+                nested = self.build(type(field), lookup + '__')
+                if model._meta.get_field(field.source).null:
+                    self.lookups.append(lookup)
+                    nested = f'(None if row[{lookup!r}] is None else {nested})'
+                items.append(f'{name!r}: {nested}')
+            elif isinstance(field, UNSUPPORTED_FIELDS):
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} cannot be projected.')
+            else:
+                self.lookups.append(lookup)
+                value = f'row[{lookup!r}]'
+                if not isinstance(field, RAW_FIELDS):
+                    converter = f'convert_{len(self.namespace)}'
+                    self.namespace[converter] = field.to_representation
+                    value = f'(None if {value} is None else {converter}({value}))'
+                items.append(f'{name!r}: {value}')
+        return '{' + ', '.join(items) + '}'
+
+    def values(self, queryset):
+        return queryset.values(*self.lookups)
+
+    def serialize(self, rows, request=None):
+        to_dict = self.to_dict
+        return [to_dict(row) for row in rows]
+
+
+class ProjectedListMixin:
+    """List a view's pages through ``projection`` instead of its serializer.
+
+    The serializer class stays in place for the schema and the browsable API.
+    """
+
+    projection = None
+
+    def list(self, request, *args, **kwargs):
+        rows = self.projection.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(self.projection.serialize(rows, request))
+        return self.get_paginated_response(self.projection.serialize(page, request))
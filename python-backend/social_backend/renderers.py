@@ -0,0 +1,50 @@
+"""
+JSON rendering with orjson.
+
+``ORJSONRenderer`` writes the same bytes as DRF's ``JSONRenderer`` with the
+default settings (compact separators, unescaped unicode, U+2028 and U+2029
+escaped) several times faster. Values orjson does not encode the same way,
+such as dates and times, are handed to DRF's encoder, and the renderer
+falls back to ``JSONRenderer`` when orjson is not installed, when the
+client asks for indented output, or when the DRF JSON settings differ from
+the defaults. Floats in exponent notation are written as ``1e16`` rather
+than ``1e+16``; the API's responses carry no floats.
+"""
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` producing the same output through orjson."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            # Integers beyond 64 bits and other values only json can encode
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer escapes the line separators that are invalid in JavaScript strings
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def render_json(data):
+    """Render ``data`` as the API's JSON renderer would."""
+    return ORJSONRenderer().render(data)
@@ -0,0 +1,146 @@
+"""
+Read replica routing.
+
+``ReplicaRoutingMiddleware`` picks one of the ``DATABASE_REPLICAS`` for
+every ``GET``/``HEAD`` request and ``ReplicaRouter`` sends that request's
+reads to it; all writes, and every query of other requests, use
+``default``.
+
+Replicas lag behind the primary, so users are pinned to the primary for
+``REPLICA_PIN_SECONDS`` after they change something: after any successful
+write request they make, when their user row is saved, and when they are
+a party to a friend request or friendship someone else changed. Users who
+only see a change indirectly, such as the friends of a new friend, stay
+on the replicas, but their replica reads are neither cached nor validated
+for ``REPLICA_PIN_SECONDS`` after the bump (see ``social_backend.cache``). Pins live in the cache so they hold across
+workers; the user is identified from the request's JWT before the view
+authenticates it.
+
+With no replicas configured, everything reads from ``default``.
+"""
+
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from accounts.authentication import ClaimsJWTAuthentication
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+# Database the current request reads from; None reads from default
+current_read_database = ContextVar('current_read_database', default=None)
+
+authenticator = ClaimsJWTAuthentication()
+
+
+def replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(*user_ids):
+    """Read the users' requests from the primary for the next ``REPLICA_PIN_SECONDS``."""
+    if replicas() and user_ids:
+        cache.set_many({pin_key(user_id): True for user_id in user_ids}, settings.REPLICA_PIN_SECONDS)
+
+
+async def apin_to_primary(*user_ids):
+    if replicas() and user_ids:
+        await cache.aset_many({pin_key(user_id): True for user_id in user_ids}, settings.REPLICA_PIN_SECONDS)
+
+
+class ReplicaRouter:
+    """Route reads to the request's replica and everything else to ``default``."""
+
+    def db_for_read(self, model, **hints):
+        return current_read_database.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Never fall back to the database an instance was read from
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in replicas():
+            return False
+        return None
+
+
+def token_user_id(request):
+    """Return the user id of the request's JWT, or ``None`` if it has no valid one."""
+    header = authenticator.get_header(request)
+    if header is None:
+        return None
+    try:
+        raw_token = authenticator.get_raw_token(header)
+        if raw_token is None:
+            return None
+        return authenticator.get_validated_token(raw_token).get(api_settings.USER_ID_CLAIM)
+    except AuthenticationFailed:
+        # The view rejects the request itself
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Serve reads of unpinned ``GET`` requests from a replica."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        user_id = token_user_id(request) if replicas() else None
+        database = None
+        if request.method in SAFE_METHODS and not (user_id and cache.get(pin_key(user_id))):
+            database = self.choose_replica()
+        token = current_read_database.set(database)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_read_database.reset(token)
+        if self.wrote(request, response, user_id):
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        user_id = token_user_id(request) if replicas() else None
+        database = None
+        if request.method in SAFE_METHODS and not (user_id and await cache.aget(pin_key(user_id))):
+            database = self.choose_replica()
+        token = current_read_database.set(database)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_read_database.reset(token)
+        if self.wrote(request, response, user_id):
+            await apin_to_primary(user_id)
+        return response
+
+    def choose_replica(self):
+        databases = replicas()
+        return random.choice(databases) if databases else None
+
+    def wrote(self, request, response, user_id):
+        return bool(user_id) and request.method not in SAFE_METHODS and response.status_code < 400
@@ -2,6 +2,7 @@
 Django settings for social_backend project.
 """
 
+import importlib.util
 import os
 from pathlib import Path
 from datetime import timedelta
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'social_backend.metrics.RequestMetricsMiddleware',
+    'social_backend.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -71,6 +74,25 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'social_backend.wsgi.application'
+ASGI_APPLICATION = 'social_backend.asgi.application'
+
+# Route the friend endpoints to the async views of friends.async_views;
+# only useful when served by an ASGI server
+ASYNC_FRIEND_VIEWS = os.getenv('ASYNC_FRIEND_VIEWS', 'False') == 'True'
+
+# The in-memory friend graph of friends.graph: load it as workers start, and
+# replay the changes of other workers at most this many seconds after them
+FRIEND_GRAPH_PRELOAD = os.getenv('FRIEND_GRAPH_PRELOAD', 'True') == 'True'
+FRIEND_GRAPH_SYNC_SECONDS = float(os.getenv('FRIEND_GRAPH_SYNC_SECONDS', '1'))
+# Time a friend path search may take before it is abandoned
+FRIEND_PATH_BUDGET_MS = float(os.getenv('FRIEND_PATH_BUDGET_MS', '50'))
+
+# Friend request event streams of friends.streams (ASGI only): how often each
+# worker reads the shared event log, how many events a stream may fall
+# behind before it is reset, and how often idle streams get a keepalive
+FRIEND_EVENTS_POLL_SECONDS = float(os.getenv('FRIEND_EVENTS_POLL_SECONDS', '0.25'))
+FRIEND_EVENTS_QUEUE_SIZE = int(os.getenv('FRIEND_EVENTS_QUEUE_SIZE', '100'))
+FRIEND_EVENTS_HEARTBEAT_SECONDS = float(os.getenv('FRIEND_EVENTS_HEARTBEAT_SECONDS', '15'))
 
 # Database
 DATABASES = {
@@ -80,6 +102,35 @@ DATABASES = {
     )
 }
 
+# Read replicas, as comma separated database URLs: GET requests read from
+# one of them unless the user's data changed in the last REPLICA_PIN_SECONDS
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=600)
+    # Tests only create the primary's database
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['social_backend.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = float(os.getenv('REPLICA_PIN_SECONDS', '5'))
+
+# Cache: a Redis server in production, process-local memory otherwise
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'social-backend',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -96,6 +147,26 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing: tuned Argon2 when argon2-cffi is installed, tuned scrypt
+# otherwise. The PBKDF2 hashers only verify existing hashes, which are
+# upgraded to the first hasher on the user's next login.
+PASSWORD_HASHERS = [
+    'accounts.hashers.TunedArgon2PasswordHasher',
+    'accounts.hashers.TunedScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+if importlib.util.find_spec('argon2') is None:
+    PASSWORD_HASHERS.remove('accounts.hashers.TunedArgon2PasswordHasher')
+PASSWORD_SCRYPT_WORK_FACTOR = 2 ** int(os.getenv('PASSWORD_SCRYPT_LOG2_WORK_FACTOR', '14'))
+
+# Login password checks run on a pool of this many threads per process
+# (default: one per CPU); at most PASSWORD_HASH_MAX_PENDING may be queued
+# and a login waits up to PASSWORD_HASH_QUEUE_TIMEOUT seconds for room
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '0')) or None
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '64'))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', '5'))
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
@@ -115,15 +186,47 @@ AUTH_USER_MODEL = 'accounts.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Same output as DRF's JSONRenderer, rendered with orjson
+    'DEFAULT_RENDERER_CLASSES': (
+        'social_backend.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # Token buckets: '<burst>/<period>', refilled at that rate
+    'DEFAULT_THROTTLE_CLASSES': (
+        'social_backend.throttling.AnonTokenBucketThrottle',
+        'social_backend.throttling.UserTokenBucketThrottle',
+        'social_backend.throttling.ScopedTokenBucketThrottle',
+    ) if os.getenv('THROTTLE_ENABLED', 'True') == 'True' else (),
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': os.getenv('THROTTLE_ANON_RATE', '120/min'),
+        'user': os.getenv('THROTTLE_USER_RATE', '1200/min'),
+        # Login, registration and Google sign-in, per IP address
+        'auth': os.getenv('THROTTLE_AUTH_RATE', '10/min'),
+        # Sending friend requests, per user
+        'friend_requests': os.getenv('THROTTLE_FRIEND_REQUEST_RATE', '30/min'),
+        # Mutual friend and friend path searches, per user
+        'connections': os.getenv('THROTTLE_CONNECTION_RATE', '60/min'),
+    },
+    # Proxies in front of the app; clients are identified by REMOTE_ADDR
+    # unless it is raised, as X-Forwarded-For is set by the client
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
 }
 
+# Throttle buckets are shared through Redis when there is one, and kept per
+# process otherwise
+THROTTLE_REDIS_URL = os.getenv('THROTTLE_REDIS_URL', REDIS_URL)
+THROTTLE_STORE = (
+    'social_backend.throttling.RedisBucketStore' if THROTTLE_REDIS_URL
+    else 'social_backend.throttling.LocalBucketStore'
+)
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -140,9 +243,22 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Per-process cache of users loaded during JWT authentication
+AUTH_USER_CACHE_SIZE = int(os.getenv('AUTH_USER_CACHE_SIZE', '4096'))
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', '60'))
+
+# Request metrics: bearer token for /api/internal/metrics/ (the endpoint is
+# disabled without one) and the latency above which requests are logged
+# with their SQL (disabled if unset)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+SLOW_REQUEST_THRESHOLD_MS = (
+    int(os.getenv('SLOW_REQUEST_THRESHOLD_MS')) if os.getenv('SLOW_REQUEST_THRESHOLD_MS') else None
+)
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:3000').split(',')
 CORS_ALLOW_CREDENTIALS = True
 
 # Google Authentication
-GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID', '')
\ No newline at end of file
+GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID', '')
+GOOGLE_CERTS_URL = os.getenv('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
\ No newline at end of file
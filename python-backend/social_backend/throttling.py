@@ -0,0 +1,208 @@
+"""
+Token bucket throttling.
+
+Every throttle scope has a rate such as ``'10/min'`` in
+``DEFAULT_THROTTLE_RATES``. Each client of a scope gets a bucket holding up
+to that many tokens, refilled continuously at that rate: a request takes a
+token, so clients may burst up to the full amount and then continue at the
+steady rate, and an empty bucket throttles the request with a
+``Retry-After`` of the time until the next token.
+
+Buckets are kept by the store named in ``THROTTLE_STORE``:
+
+* ``LocalBucketStore`` keeps them in process memory, split over lock-guarded
+  shards so concurrent threads rarely contend; limits apply per process.
+* ``RedisBucketStore`` keeps them in Redis and updates them with a Lua
+  script, so all workers share each bucket and updates are atomic.
+
+Neither touches the database, so a check costs microseconds locally and one
+round trip with Redis. Stores that wait on the network set ``blocking``, and
+async views run their checks off the event loop.
+
+Anonymous clients are told apart by IP address. Set ``NUM_PROXIES`` to the
+number of proxies in front of the app so the address comes from the right
+entry of ``X-Forwarded-For``; with the default of 0 it is ``REMOTE_ADDR``,
+since a client can put anything in that header.
+"""
+
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Turn ``'<tokens>/<period>'`` into ``(capacity, tokens per second)``, or ``None``."""
+    if rate is None:
+        return None
+    tokens, period = rate.split('/')
+    capacity = int(tokens)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBucketStore:
+    """Buckets in process memory."""
+
+    blocking = False
+
+    def __init__(self, shards=16, max_keys=100000):
+        self.shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self.max_keys_per_shard = max(1, max_keys // shards)
+
+    def consume(self, key, capacity, refill_rate):
+        """Take a token from ``key``'s bucket; return 0, or the seconds until one is available."""
+        now = time.monotonic()
+        lock, buckets = self.shards[hash(key) % len(self.shards)]
+        with lock:
+            if key in buckets:
+                tokens, updated, _ = buckets[key]
+                tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            else:
+                if len(buckets) >= self.max_keys_per_shard:
+                    self.prune(buckets, now)
+                tokens = capacity
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / refill_rate
+            buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+        return wait
+
+    def prune(self, buckets, now):
+        # Buckets that have refilled are the same as missing ones; failing
+        # that, forget the older half rather than grow without bound
+        full = [key for key, (_, _, full_at) in buckets.items() if full_at <= now]
+        for key in full or list(buckets)[:len(buckets) // 2]:
+            del buckets[key]
+
+    def clear(self):
+        for lock, buckets in self.shards:
+            with lock:
+                buckets.clear()
+
+
+# KEYS[1]: bucket hash; ARGV: capacity, tokens per second. Returns the wait as a string,
+# since Lua numbers are truncated to integers in replies.
+CONSUME_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / refill_rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill_rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    """Buckets shared by all workers through Redis (``THROTTLE_REDIS_URL``)."""
+
+    blocking = True
+
+    def __init__(self, url=None):
+        if redis is None:
+            raise ImproperlyConfigured('RedisBucketStore requires the redis package.')
+        self.client = redis.Redis.from_url(url or settings.THROTTLE_REDIS_URL)
+        self.script = self.client.register_script(CONSUME_SCRIPT)
+
+    def consume(self, key, capacity, refill_rate):
+        """Take a token from ``key``'s bucket; return 0, or the seconds until one is available."""
+        return float(self.script(keys=[f'throttle:{key}'], args=[capacity, refill_rate]))
+
+    def clear(self):
+        keys = list(self.client.scan_iter('throttle:*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_store(path):
+    return import_string(path)()
+
+
+def bucket_store():
+    """Return the process's instance of ``THROTTLE_STORE``."""
+    return _load_store(settings.THROTTLE_STORE)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle requests with one token bucket per ``get_ident_key()`` and scope."""
+
+    scope = None
+
+    def get_scope(self, view):
+        return self.scope
+
+    def get_ident_key(self, request):
+        """Return the client's bucket name in the scope, or ``None`` to skip throttling."""
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        scope = self.get_scope(view)
+        # Read on every request so that overridden settings apply
+        rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope)) if scope else None
+        ident = self.get_ident_key(request) if rate else None
+        if ident is None:
+            return True
+        capacity, refill_rate = rate
+        wait = bucket_store().consume(f'{scope}:{ident}', capacity, refill_rate)
+        if wait:
+            self.retry_after = wait
+            return False
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class AnonTokenBucketThrottle(TokenBucketThrottle):
+    """The ``anon`` rate for each IP address making unauthenticated requests."""
+
+    scope = 'anon'
+
+    def get_ident_key(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return None
+        return super().get_ident_key(request)
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """The ``user`` rate for each authenticated user (and each IP address otherwise)."""
+
+    scope = 'user'
+
+
+class ScopedTokenBucketThrottle(TokenBucketThrottle):
+    """The rate of the view's ``throttle_scope``, per user or per IP address."""
+
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scope', None)
@@ -1,12 +1,18 @@
 """
 URL configuration for social_backend project.
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from .views import ResponseCacheStatsView, metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('accounts.urls')),
     path('api/users/', include('accounts.user_urls')),
-    path('api/friends/', include('friends.urls')),
+    # ASGI deployments can serve the friend endpoints with async views
+    path('api/friends/', include('friends.async_urls' if settings.ASYNC_FRIEND_VIEWS else 'friends.urls')),
+    path('api/internal/cache-stats/', ResponseCacheStatsView.as_view(), name='cache-stats'),
+    path('api/internal/metrics/', metrics, name='metrics'),
 ]
\ No newline at end of file
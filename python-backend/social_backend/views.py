@@ -0,0 +1,34 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .cache import response_cache_stats
+from .metrics import request_metrics
+
+
+class ResponseCacheStatsView(APIView):
+    """API view exposing this process's response cache hit and miss counters."""
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache_stats.snapshot())
+
+
+def metrics(request):
+    """Serve this process's request metrics to Prometheus.
+
+    Disabled unless ``METRICS_TOKEN`` is set; scrapers authenticate with
+    ``Authorization: Bearer <METRICS_TOKEN>``.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        raise Http404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+        return HttpResponseForbidden()
+    return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
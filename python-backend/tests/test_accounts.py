@@ -1,8 +1,36 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
+import rsa
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
 from django.urls import reverse
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.utils.http import http_date
+
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from google.auth import crypt, jwt
+
+from accounts.authentication import recent_users, user_from_claims
+from accounts.google import google_certs
+from accounts.hashers import PasswordHashPool, PasswordHashPoolBusy
+from accounts.search import NgramSearchBackend, log_user_change, user_index
+from accounts.serializers import UserListSerializer
+from accounts.tokens import UserRefreshToken
+from friends.graph import friend_graph
+from friends.models import Friendship, OutboxEvent
+from social_backend.cache import bump_user_versions, get_user_version, user_modified_key
+from social_backend.throttling import LocalBucketStore, bucket_store
 
 User = get_user_model()
 
@@ -10,6 +38,24 @@ User = get_user_model()
 def api_client():
     return APIClient()
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # User ids are reused between tests, so cached per-user data must not leak
+    cache.clear()
+    bucket_store().clear()
+    friend_graph.clear()
+    yield
+    cache.clear()
+    bucket_store().clear()
+    friend_graph.clear()
+
+@pytest.fixture
+def search_index():
+    # The in-process index outlives test transactions, so start from scratch
+    user_index.clear()
+    yield user_index
+    user_index.clear()
+
 @pytest.fixture
 def create_user():
     def _create_user(email='user@example.com', password='password123', name='Test User'):
@@ -61,10 +107,11 @@ class TestUserRegistration:
 @pytest.mark.django_db
 class TestUserLogin:
     
-    def test_user_login_successful(self, api_client, create_user):
+    @pytest.mark.parametrize('url_name', ['login', 'login-async'])
+    def test_user_login_successful(self, api_client, create_user, url_name):
         """Test that a user can login successfully."""
         user = create_user()
-        url = reverse('login')
+        url = reverse(url_name)
         data = {
             'email': 'user@example.com',
             'password': 'password123',
@@ -73,9 +120,10 @@ class TestUserLogin:
         response = api_client.post(url, data, format='json')
         
         assert response.status_code == status.HTTP_200_OK
-        assert 'access' in response.data
-        assert 'refresh' in response.data
-        assert 'user' in response.data
+        body = response.json()
+        assert 'access' in body
+        assert 'refresh' in body
+        assert 'user' in body
     
     def test_user_login_invalid_credentials(self, api_client, create_user):
         """Test that login fails with invalid credentials."""
@@ -91,6 +139,257 @@ class TestUserLogin:
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
 
+@pytest.fixture
+def throttle_rates(settings):
+    def _throttle_rates(**rates):
+        settings.REST_FRAMEWORK = {
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], **rates},
+        }
+    return _throttle_rates
+
+
+@pytest.mark.django_db
+class TestThrottling:
+    
+    def test_login_is_throttled_per_ip_address(self, api_client, create_user, throttle_rates):
+        """Test that login attempts beyond the burst are rejected with Retry-After."""
+        create_user()
+        throttle_rates(auth='2/min')
+        data = {'email': 'user@example.com', 'password': 'wrongpassword'}
+        
+        responses = [api_client.post(reverse('login'), data, format='json') for _ in range(3)]
+        
+        assert [r.status_code for r in responses] == [401, 401, status.HTTP_429_TOO_MANY_REQUESTS]
+        # One token comes back every 30 seconds
+        assert responses[2]['Retry-After'] == '30'
+        response = api_client.post(reverse('login'), data, format='json', REMOTE_ADDR='10.0.0.2')
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    
+    def test_forwarded_for_header_does_not_pick_the_bucket(self, api_client, create_user, throttle_rates):
+        """Test that clients cannot get fresh buckets by forging X-Forwarded-For."""
+        create_user()
+        throttle_rates(auth='1/min')
+        data = {'email': 'user@example.com', 'password': 'wrongpassword'}
+        
+        codes = [
+            api_client.post(reverse('login'), data, format='json', HTTP_X_FORWARDED_FOR=f'10.1.0.{i}').status_code
+            for i in range(2)
+        ]
+        
+        assert codes == [status.HTTP_401_UNAUTHORIZED, status.HTTP_429_TOO_MANY_REQUESTS]
+    
+    def test_registration_shares_the_auth_bucket(self, api_client, create_user, throttle_rates):
+        """Test that registering and logging in draw from the same per-IP bucket."""
+        create_user()
+        throttle_rates(auth='1/min')
+        api_client.post(reverse('login'), {'email': 'user@example.com', 'password': 'x'}, format='json')
+        
+        response = api_client.post(reverse('register'), {
+            'email': 'new@example.com', 'password': 'password123', 'password_confirm': 'password123', 'name': 'New',
+        }, format='json')
+        
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert not User.objects.filter(email='new@example.com').exists()
+    
+    def test_bucket_refills_at_the_rate(self, monkeypatch):
+        """Test that tokens come back continuously up to the burst size."""
+        clock = [1000.0]
+        monkeypatch.setattr('social_backend.throttling.time.monotonic', lambda: clock[0])
+        store = LocalBucketStore()
+        
+        assert [store.consume('k', 2, 1.0) for _ in range(3)] == [0, 0, 1.0]
+        clock[0] += 0.5
+        assert store.consume('k', 2, 1.0) == 0.5
+        clock[0] += 60
+        assert [store.consume('k', 2, 1.0) for _ in range(3)] == [0, 0, 1.0]
+    
+    def test_local_store_is_bounded(self):
+        """Test that buckets are pruned instead of growing without bound."""
+        store = LocalBucketStore(shards=2, max_keys=8)
+        
+        for i in range(100):
+            store.consume(f'ip:{i}', 10, 1.0)
+        
+        assert sum(len(buckets) for _, buckets in store.shards) <= 8
+
+
+@pytest.mark.django_db
+class TestPasswordHashing:
+    
+    def test_new_passwords_use_tuned_hasher(self, create_user):
+        """Test that new passwords are hashed with the tuned hasher."""
+        user = create_user()
+        
+        assert user.password.split('$')[0] in ('scrypt', 'argon2')
+    
+    @pytest.mark.parametrize('url_name', ['login', 'login-async'])
+    def test_legacy_hash_is_upgraded_on_login(self, api_client, create_user, url_name):
+        """Test that a PBKDF2 hash is replaced after a successful login."""
+        user = create_user()
+        user.password = make_password('password123', hasher=PBKDF2PasswordHasher())
+        user.save()
+        
+        response = api_client.post(reverse(url_name), {'email': user.email, 'password': 'password123'}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        user.refresh_from_db()
+        assert not user.password.startswith('pbkdf2_sha256$')
+        assert user.check_password('password123')
+    
+    def test_legacy_hash_is_kept_on_failed_login(self, api_client, create_user):
+        """Test that a wrong password leaves the stored hash alone."""
+        user = create_user()
+        legacy = make_password('password123', hasher=PBKDF2PasswordHasher())
+        user.password = legacy
+        user.save()
+        
+        response = api_client.post(reverse('login'), {'email': user.email, 'password': 'wrong'}, format='json')
+        
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        user.refresh_from_db()
+        assert user.password == legacy
+    
+    def test_pool_rejects_work_beyond_queue_limit(self):
+        """Test that the hashing pool turns work away once its queue is full."""
+        pool = PasswordHashPool(max_workers=1, max_pending=1, timeout=0)
+        release = threading.Event()
+        
+        blocked = pool.submit(release.wait)
+        with pytest.raises(PasswordHashPoolBusy):
+            pool.submit(lambda: None)
+        release.set()
+        blocked.result()
+        
+        assert pool.submit(lambda: 42, timeout=1).result() == 42
+    
+    def test_async_pool_waits_for_room_off_the_event_loop(self):
+        """Test that awaiting a full pool leaves the event loop running."""
+        pool = PasswordHashPool(max_workers=1, max_pending=1, timeout=5)
+        release = threading.Event()
+        blocked = pool.submit(release.wait)
+        
+        async def main():
+            waiting = asyncio.ensure_future(pool.arun(lambda: 42))
+            # The loop still runs other work while the hash waits for room
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            release.set()
+            return await waiting
+        
+        assert asyncio.run(main()) == 42
+        assert blocked.result()
+    
+    def test_busy_pool_returns_service_unavailable(self, api_client, create_user, monkeypatch):
+        """Test that logins are shed with a 503 when the hashing pool is full."""
+        user = create_user()
+        
+        def busy(*args, **kwargs):
+            raise PasswordHashPoolBusy()
+        monkeypatch.setattr('accounts.hashers.password_hash_pool.run', busy)
+        
+        response = api_client.post(reverse('login'), {'email': user.email, 'password': 'password123'}, format='json')
+        
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response['Retry-After'] == '1'
+
+
+
+@pytest.mark.django_db
+class TestBulkImport:
+    
+    def test_import_users_from_csv(self, tmp_path, create_user):
+        """Test that users are loaded with hashed passwords, skipping bad and known rows."""
+        existing = create_user(email='existing@example.com', name='Existing User')
+        users_file = tmp_path / 'users.csv'
+        users_file.write_text(
+            'email,name,password,bio\n'
+            'alice@Example.COM,Alice,alice-password,Hello\n'
+            'bob@example.com,Bob,,\n'
+            'alice@example.com,Alice Again,other-password,\n'
+            ',No Email,password,\n'
+            'existing@example.com,Someone Else,password,\n'
+        )
+        
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_users', '--users', str(users_file), '--workers', '0', stdout=out, stderr=err)
+        
+        assert 'users: 5 read, 2 created, 2 skipped' in out.getvalue()
+        assert 'rows/s' in err.getvalue()
+        alice = User.objects.get(email='alice@example.com')
+        assert alice.check_password('alice-password')
+        assert alice.bio == 'Hello'
+        assert not User.objects.get(email='bob@example.com').has_usable_password()
+        existing.refresh_from_db()
+        assert existing.name == 'Existing User'
+        
+        # Rerunning an import creates nothing new
+        out = io.StringIO()
+        call_command('import_users', '--users', str(users_file), '--workers', '0', stdout=out, stderr=io.StringIO())
+        assert '2 skipped' in out.getvalue() and '0 created' in out.getvalue()
+    
+    def test_passwords_are_hashed_in_worker_processes(self, tmp_path):
+        """Test that the process pool hashes passwords across chunks."""
+        users_file = tmp_path / 'users.ndjson'
+        users_file.write_text(''.join(
+            json.dumps({'email': f'user{i}@example.com', 'name': f'User {i}', 'password': f'password-{i}'}) + '\n'
+            for i in range(5)
+        ))
+        
+        call_command('import_users', '--users', str(users_file), '--workers', '2', '--batch-size', '2',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        
+        for i in range(5):
+            assert User.objects.get(email=f'user{i}@example.com').check_password(f'password-{i}')
+    
+    def test_import_friendships_updates_counters(self, tmp_path, create_user):
+        """Test that friendships are resolved by email and counted once."""
+        users = [create_user(email=f'user{i}@example.com', name=f'User {i}') for i in range(3)]
+        edges_file = tmp_path / 'friendships.csv'
+        edges_file.write_text(
+            'user1_email,user2_email\n'
+            'user0@example.com,user1@example.com\n'
+            'user1@example.com,user0@example.com\n'
+            'user0@example.com,user2@example.com\n'
+            'user0@example.com,unknown@example.com\n'
+            'user2@example.com,user2@example.com\n'
+        )
+        
+        call_command('import_users', '--friendships', str(edges_file), '--workers', '0',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        call_command('import_users', '--friendships', str(edges_file), '--workers', '0',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        
+        assert Friendship.objects.friend_ids(users[0]) == {users[1].id, users[2].id}
+        counts = dict(User.objects.filter(id__in=[u.id for u in users]).values_list('id', 'friend_count'))
+        assert counts == {users[0].id: 2, users[1].id: 1, users[2].id: 1}
+    
+    def test_import_friendships_invalidates_cached_data(self, tmp_path, api_client, create_user):
+        """Test that imported friendships refresh cached responses and enqueue outbox events."""
+        users = [create_user(email=f'user{i}@example.com', name=f'User {i}') for i in range(2)]
+        api_client.force_authenticate(user=users[0])
+        etag = api_client.get(reverse('user-profile'))['ETag']
+        edges_file = tmp_path / 'friendships.csv'
+        edges_file.write_text('user1_email,user2_email\nuser0@example.com,user1@example.com\n')
+        
+        call_command('import_users', '--friendships', str(edges_file), '--workers', '0',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        
+        response = api_client.get(reverse('user-profile'), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['friend_count'] == 1
+        assert list(OutboxEvent.objects.values_list('payload', flat=True)) == [
+            {'user_ids': [users[0].id, users[1].id]},
+        ]
+    
+    def test_unknown_format_is_an_error(self, tmp_path):
+        """Test that a file of unknown format is rejected."""
+        users_file = tmp_path / 'users.txt'
+        users_file.write_text('')
+        
+        with pytest.raises(CommandError):
+            call_command('import_users', '--users', str(users_file))
+
 @pytest.mark.django_db
 class TestUserProfile:
     
@@ -126,6 +425,73 @@ class TestUserProfile:
         user.refresh_from_db()
         assert user.name == 'Updated Name'
         assert user.bio == 'This is my new bio'
+    
+    def test_profile_is_cached_until_updated(self, api_client, create_user, django_assert_num_queries):
+        """Test that repeated profile reads are served from the cache until a change."""
+        user = create_user()
+        api_client.force_authenticate(user=user)
+        url = reverse('user-profile')
+        api_client.get(url)
+        
+        with django_assert_num_queries(0):
+            response = api_client.get(url)
+        assert response.data['name'] == 'Test User'
+        
+        api_client.patch(url, {'name': 'Updated Name'}, format='json')
+        
+        response = api_client.get(url)
+        assert response.data['name'] == 'Updated Name'
+    
+    def test_unchanged_profile_is_not_sent_again(self, api_client, create_user, django_assert_num_queries):
+        """Test that a request with the current ETag gets an empty 304 until the profile changes."""
+        user = create_user()
+        api_client.force_authenticate(user=user)
+        url = reverse('user-profile')
+        response = api_client.get(url)
+        etag = response['ETag']
+        assert response['Cache-Control'] == 'private, no-cache'
+        
+        with django_assert_num_queries(0):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b''
+        assert response['ETag'] == etag
+        
+        api_client.patch(url, {'name': 'Updated Name'}, format='json')
+        
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['name'] == 'Updated Name'
+        assert response['ETag'] != etag
+    
+    def test_profile_last_modified(self, api_client, create_user):
+        """Test If-Modified-Since against the second after the last change, once that second is over."""
+        user = create_user()
+        api_client.force_authenticate(user=user)
+        url = reverse('user-profile')
+        # Changed this second: later changes could get the same date
+        assert 'Last-Modified' not in api_client.get(url)
+        
+        changed_at = time.time() - 10
+        cache.set(user_modified_key(user.id), changed_at)
+        response = api_client.get(url)
+        assert response['Last-Modified'] == http_date(int(changed_at) + 1)
+        
+        response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(int(changed_at) - 60))
+        assert response.status_code == status.HTTP_200_OK
+    
+    def test_versions_are_bumped_again_on_commit(self, create_user, django_capture_on_commit_callbacks):
+        """Test that responses read before a change commits are not kept under the new version."""
+        user = create_user()
+        version = get_user_version(user.id)
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            bump_user_versions(user.id)
+            assert get_user_version(user.id) == version + 1
+        
+        assert get_user_version(user.id) == version + 2
 
 
 @pytest.mark.django_db
@@ -151,7 +517,7 @@ class TestUserList:
         assert 'user2@example.com' in user_emails
         assert 'user3@example.com' in user_emails
     
-    def test_search_users_by_name(self, api_client, create_user):
+    def test_search_users_by_name(self, api_client, create_user, search_index):
         """Test that users can be searched by name."""
         user1 = create_user(email='user1@example.com', name='John Doe')
         user2 = create_user(email='user2@example.com', name='Jane Smith')
@@ -169,4 +535,321 @@ class TestUserList:
         user_names = [user['name'] for user in response.data['results']]
         assert 'John Doe' not in user_names
         assert 'Jane Smith' in user_names
-        assert 'John Smith' in user_names
\ No newline at end of file
+        assert 'John Smith' in user_names
+    
+    def test_search_index_finds_users_written_elsewhere(self, api_client, create_user, search_index):
+        """Test that the index picks up bulk-inserted users and users changed by other workers."""
+        user = create_user(email='user@example.com', name='Viewer')
+        other = create_user(email='other@example.com', name='Old Name')
+        api_client.force_authenticate(user=user)
+        url = reverse('user-list')
+        assert len(api_client.get(url + '?search=old').data['results']) == 1
+        
+        User.objects.bulk_create([User(email='imported@example.com', name='Imported Person')])
+        User.objects.filter(id=other.id).update(name='Renamed Elsewhere')
+        log_user_change(other.id)
+        
+        assert [r['email'] for r in api_client.get(url + '?search=imported').data['results']] == [
+            'imported@example.com',
+        ]
+        assert api_client.get(url + '?search=old').data['results'] == []
+        assert [r['id'] for r in api_client.get(url + '?search=renamed').data['results']] == [other.id]
+    
+    def test_broad_search_is_not_truncated(self, api_client, create_user, search_index, monkeypatch):
+        """Test that searches matching more users than the index ranks return every match."""
+        monkeypatch.setattr(NgramSearchBackend, 'result_limit', 2)
+        user = create_user(email='viewer@example.com', name='Viewer')
+        for i in range(4):
+            create_user(email=f'member{i}@example.com', name=f'Member {i}')
+        api_client.force_authenticate(user=user)
+        
+        response = api_client.get(reverse('user-list') + '?search=member')
+        
+        assert response.data['count'] == 4
+    
+    def test_list_users_with_keyset_cursor(self, api_client, create_user):
+        """Test that users can be paged through with opaque cursors."""
+        users = [create_user(email=f'user{i}@example.com', name=f'User {i}') for i in range(5)]
+        
+        api_client.force_authenticate(user=users[0])
+        url = reverse('user-list') + '?cursor=&page_size=2'
+        
+        seen = []
+        while url:
+            response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            assert 'count' not in response.data
+            seen.extend(user['id'] for user in response.data['results'])
+            url = response.data['next']
+        
+        assert seen == [user.id for user in users[1:]]
+    
+    def test_list_users_with_invalid_cursor(self, api_client, create_user):
+        """Test that a malformed cursor is rejected."""
+        user = create_user()
+        api_client.force_authenticate(user=user)
+        
+        response = api_client.get(reverse('user-list') + '?cursor=not-a-cursor')
+        
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+    
+    def test_search_orders_by_relevance(self, api_client, create_user, search_index):
+        """Test that names starting with the term rank above other matches."""
+        user = create_user(email='user@example.com', name='Viewer')
+        email_only = create_user(email='smithers@example.com', name='Waylon')
+        in_name = create_user(email='jane@example.com', name='Jane Smith')
+        name_prefix = create_user(email='sam@example.com', name='Smith Sam')
+        
+        api_client.force_authenticate(user=user)
+        response = api_client.get(reverse('user-list') + '?search=smith')
+        
+        assert response.status_code == status.HTTP_200_OK
+        result_ids = [result['id'] for result in response.data['results']]
+        assert result_ids == [name_prefix.id, in_name.id, email_only.id]
+    
+    def test_search_index_follows_user_updates(self, api_client, create_user, search_index):
+        """Test that renamed users are found by their new name only."""
+        user = create_user(email='user@example.com', name='Viewer')
+        other = create_user(email='other@example.com', name='Old Name')
+        api_client.force_authenticate(user=user)
+        url = reverse('user-list')
+        
+        # The first search loads the index; later saves update it in place
+        assert len(api_client.get(url + '?search=old').data['results']) == 1
+        other.name = 'Brand New'
+        other.save()
+        
+        assert api_client.get(url + '?search=old').data['results'] == []
+        response = api_client.get(url + '?search=brand')
+        assert [result['id'] for result in response.data['results']] == [other.id]
+    
+    def test_list_renders_like_the_serializer(self, api_client, create_user):
+        """Test that the projected user list is byte-identical to UserListSerializer output."""
+        user = create_user(email='user@example.com', name='Viewer')
+        others = [create_user(email=f'user{i}@example.com', name=f'Ünïcode “{i}”') for i in range(3)]
+        User.objects.filter(id=others[0].id).update(profile_picture='https://example.com/a.png')
+        api_client.force_authenticate(user=user)
+        
+        response = api_client.get(reverse('user-list'))
+        
+        results = UserListSerializer(User.objects.filter(id__in=[o.id for o in others]).order_by('id'), many=True).data
+        expected = {'count': 3, 'next': None, 'previous': None, 'results': results}
+        assert response.content == JSONRenderer().render(expected)
+
+
+@pytest.mark.django_db
+class TestTokenAuthentication:
+    
+    @pytest.fixture(autouse=True)
+    def clear_recent_users(self):
+        recent_users.clear()
+        yield
+        recent_users.clear()
+    
+    def test_authenticated_request_skips_user_lookup(self, api_client, create_user, django_assert_num_queries):
+        """Test that a token with user claims authenticates without a query."""
+        create_user()
+        create_user(email='other@example.com', name='Other User')
+        response = api_client.post(reverse('login'), {
+            'email': 'user@example.com',
+            'password': 'password123',
+        }, format='json')
+        api_client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        
+        # Only the paginator COUNT and the page SELECT
+        with django_assert_num_queries(2):
+            response = api_client.get(reverse('user-list'))
+        
+        assert response.status_code == status.HTTP_200_OK
+    
+    def test_claims_user_loads_other_fields_in_one_query(self, create_user, django_assert_num_queries):
+        """Test that a user built from claims loads all deferred fields at once."""
+        user = create_user()
+        user.bio = 'About me'
+        user.save()
+        
+        token = UserRefreshToken.for_user(user).access_token
+        
+        with django_assert_num_queries(0):
+            claims_user = user_from_claims(token)
+            assert claims_user.email == user.email
+            assert claims_user.name == user.name
+        
+        with django_assert_num_queries(1):
+            assert claims_user.bio == 'About me'
+            assert claims_user.is_active
+            assert not claims_user.is_staff
+    
+    def test_token_without_claims_is_cached(self, api_client, create_user, django_assert_num_queries):
+        """Test that users fetched for tokens without claims are reused."""
+        user = create_user()
+        create_user(email='other@example.com', name='Other User')
+        token = RefreshToken.for_user(user).access_token
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        url = reverse('user-list')
+        
+        with django_assert_num_queries(3):
+            api_client.get(url)
+        with django_assert_num_queries(2):
+            api_client.get(url)
+    
+    def test_inactive_user_is_rejected_after_save(self, api_client, create_user):
+        """Test that deactivating a user evicts the cached row."""
+        user = create_user()
+        token = RefreshToken.for_user(user).access_token
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        url = reverse('user-list')
+        assert api_client.get(url).status_code == status.HTTP_200_OK
+        
+        user.is_active = False
+        user.save()
+        
+        assert api_client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+    
+    def test_claims_token_is_rejected_after_deactivation(self, api_client, create_user, django_assert_num_queries):
+        """Test that a token carrying user claims stops working once the user is deactivated."""
+        user = create_user()
+        token = UserRefreshToken.for_user(user).access_token
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        url = reverse('user-profile')
+        assert api_client.get(url).status_code == status.HTTP_200_OK
+        
+        user.is_active = False
+        user.save()
+        
+        with django_assert_num_queries(0):
+            assert api_client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+        
+        user.is_active = True
+        user.save()
+        assert api_client.get(url).status_code == status.HTTP_200_OK
+    
+    def test_deactivation_survives_cache_eviction(self, api_client, create_user, django_assert_num_queries):
+        """Test that a deactivated user stays locked out when the cache drops what it knew."""
+        user = create_user()
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {UserRefreshToken.for_user(user).access_token}')
+        url = reverse('user-profile')
+        user.is_active = False
+        user.save()
+        
+        for i in range(400):
+            cache.set(f'unrelated:{i}', i)
+        assert api_client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+        
+        cache.clear()
+        with django_assert_num_queries(1):
+            assert api_client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+    
+    def test_claims_token_is_rejected_after_deletion(self, api_client, create_user):
+        """Test that a token carrying user claims stops working once the user is deleted."""
+        user = create_user()
+        api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {UserRefreshToken.for_user(user).access_token}')
+        user.delete()
+        
+        assert api_client.get(reverse('user-list')).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.fixture(scope='module')
+def google_key():
+    public_key, private_key = rsa.newkeys(1024)
+    return public_key, private_key
+
+
+@pytest.fixture
+def google_cert_server(google_key):
+    """Serve a stand-in for Google's certificate endpoint on localhost."""
+    public_key, _ = google_key
+    
+    class CertHandler(BaseHTTPRequestHandler):
+        max_age = 300
+        hits = 0
+        
+        def do_GET(self):
+            CertHandler.hits += 1
+            body = json.dumps({'test-key': public_key.save_pkcs1().decode()}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', f'public, max-age={CertHandler.max_age}')
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CertHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    google_certs.clear()
+    CertHandler.url = f'http://127.0.0.1:{server.server_port}/certs'
+    yield CertHandler
+    server.shutdown()
+    google_certs.clear()
+
+
+@pytest.fixture
+def google_token(google_key, settings, google_cert_server):
+    settings.GOOGLE_CLIENT_ID = 'test-client-id'
+    settings.GOOGLE_CERTS_URL = google_cert_server.url
+    _, private_key = google_key
+    signer = crypt.RSASigner.from_string(private_key.save_pkcs1().decode(), key_id='test-key')
+    
+    def _google_token(email='google@example.com', audience='test-client-id'):
+        now = int(time.time())
+        payload = {
+            'iss': 'https://accounts.google.com',
+            'aud': audience,
+            'sub': '1234567890',
+            'email': email,
+            'name': 'Google User',
+            'iat': now,
+            'exp': now + 300,
+        }
+        return jwt.encode(signer, payload, key_id='test-key').decode()
+    return _google_token
+
+
+@pytest.mark.django_db
+class TestGoogleAuthentication:
+    
+    @pytest.mark.parametrize('url_name', ['google-auth', 'google-auth-async'])
+    def test_google_login_reuses_cached_certs(self, api_client, google_token, google_cert_server, url_name):
+        """Test that Google logins verify against certs fetched only once."""
+        url = reverse(url_name)
+        
+        for _ in range(3):
+            response = api_client.post(url, {'token_id': google_token()}, format='json')
+            assert response.status_code == status.HTTP_200_OK
+        
+        assert response.json()['user']['email'] == 'google@example.com'
+        assert User.objects.get(email='google@example.com').is_google_user
+        assert google_cert_server.hits == 1
+    
+    def test_google_login_rejects_wrong_audience(self, api_client, google_token):
+        """Test that tokens issued for another client are rejected."""
+        response = api_client.post(reverse('google-auth-async'),
+                                   {'token_id': google_token(audience='other-client')}, format='json')
+        
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        assert not User.objects.filter(email='google@example.com').exists()
+    
+    def test_certs_are_refetched_after_max_age(self, google_token, google_cert_server):
+        """Test that the cert cache honours the Cache-Control max-age."""
+        google_cert_server.max_age = 0
+        
+        google_certs.get_certs()
+        google_certs.get_certs()
+        
+        assert google_cert_server.hits == 2
+    
+    def test_certs_are_refreshed_in_background_before_expiry(self, google_token, google_cert_server):
+        """Test that certs close to expiry are served while a refresh runs."""
+        google_cert_server.max_age = 30
+        
+        first = google_certs.get_certs()
+        second = google_certs.get_certs()
+        
+        assert second == first
+        deadline = time.monotonic() + 5
+        while google_cert_server.hits < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert google_cert_server.hits == 2
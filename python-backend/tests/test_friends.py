@@ -1,11 +1,53 @@
+import asyncio
+import datetime
+import io
+import json
+import re
+import threading
+import time
+from array import array
+from decimal import Decimal
+
 import pytest
-from django.urls import reverse
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.db import connection, connections, transaction
+from django.test import AsyncClient
+from django.urls import include, path, reverse
 from django.db.models import Q
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
 
-from friends.models import FriendRequest, Friendship
+from accounts.tokens import UserRefreshToken
+from friends.graph import (
+    ADD,
+    REMOVE,
+    FriendGraph,
+    SearchBudgetExceeded,
+    change_log_key,
+    current_sequence,
+    database_graph,
+    friend_graph,
+)
+from friends import outbox
+from friends.events import EVENT_LOG_SEQUENCE_KEY, event_log_key, log_events
+from friends.models import FriendRequest, Friendship, OutboxEvent
+from friends.serializers import FriendRequestSerializer, FriendshipSerializer
+from friends.streams import RESET, Subscriber
+from friends.signals import friends_of_friends_changed
+from friends.suggestions import get_suggestions, suggestion_cache_key
+from friends.views import FriendListView, FriendRequestListView
+from social_backend.cache import get_user_version, response_cache_stats
+from social_backend.metrics import request_metrics
+from social_backend.renderers import ORJSONRenderer
+from social_backend.replicas import ReplicaRouter, current_read_database, pin_key
+from social_backend.throttling import LocalBucketStore, bucket_store
 
 User = get_user_model()
 
@@ -13,6 +55,17 @@ User = get_user_model()
 def api_client():
     return APIClient()
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # User ids are reused between tests, so cached per-user data must not leak
+    cache.clear()
+    bucket_store().clear()
+    friend_graph.clear()
+    yield
+    cache.clear()
+    bucket_store().clear()
+    friend_graph.clear()
+
 @pytest.fixture
 def create_user():
     def _create_user(email='user@example.com', password='password123', name='Test User'):
@@ -140,6 +193,239 @@ class TestFriendRequests:
         ).exists()
 
 
+def run_concurrently(calls):
+    """Run each call in its own thread, released together, and return the results."""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+    
+    def worker(index, call):
+        try:
+            barrier.wait()
+            results[index] = call()
+        finally:
+            connection.close()
+    
+    threads = [threading.Thread(target=worker, args=(i, call)) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def authenticated_request(user, method, url, data=None):
+    def _request():
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return getattr(client, method)(url, data, format='json').status_code
+    return _request
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentFriendRequests:
+    
+    def test_concurrent_sends_between_same_pair(self, create_user):
+        """Test that racing requests in both directions make one request and one friendship."""
+        alice = create_user(email='alice@example.com', name='Alice')
+        bob = create_user(email='bob@example.com', name='Bob')
+        calls = [
+            authenticated_request(alice, 'post', reverse('send-friend-request', kwargs={'user_id': bob.id})),
+            authenticated_request(bob, 'post', reverse('send-friend-request', kwargs={'user_id': alice.id})),
+        ] * 6
+        
+        codes = run_concurrently(calls)
+        
+        assert set(codes) <= {status.HTTP_201_CREATED, status.HTTP_400_BAD_REQUEST}
+        assert codes.count(status.HTTP_201_CREATED) == 2
+        assert FriendRequest.objects.count() == 1
+        assert FriendRequest.objects.get().status == FriendRequest.Status.ACCEPTED
+        assert Friendship.objects.count() == 1
+    
+    def test_concurrent_answers_to_same_request(self, create_user, create_friend_request):
+        """Test that a request raced by accepts and rejects is answered exactly once."""
+        friend_request = create_friend_request()
+        receiver = friend_request.receiver
+        calls = [
+            authenticated_request(receiver, 'put', reverse(
+                f'{action}-friend-request', kwargs={'request_id': friend_request.id}))
+            for action in ('accept', 'reject') * 5
+        ]
+        
+        codes = run_concurrently(calls)
+        
+        assert sorted(codes) == [status.HTTP_200_OK] + [status.HTTP_400_BAD_REQUEST] * 9
+        friend_request.refresh_from_db()
+        accepted = friend_request.status == FriendRequest.Status.ACCEPTED
+        assert Friendship.objects.count() == (1 if accepted else 0)
+    
+    def test_concurrent_batch_sends(self, create_user):
+        """Test that racing batches, repeated and in both directions, make one request per pair."""
+        alice = create_user(email='alice@example.com', name='Alice')
+        bob = create_user(email='bob@example.com', name='Bob')
+        carol = create_user(email='carol@example.com', name='Carol')
+        url = reverse('batch-send-friend-requests')
+        calls = [
+            authenticated_request(alice, 'post', url, {'user_ids': [bob.id, carol.id]}),
+            authenticated_request(bob, 'post', url, {'user_ids': [alice.id]}),
+            authenticated_request(carol, 'post', url, {'user_ids': [alice.id]}),
+        ] * 4
+        
+        codes = run_concurrently(calls)
+        
+        assert set(codes) == {status.HTTP_200_OK}
+        assert FriendRequest.objects.count() == 2
+        assert not FriendRequest.objects.filter(status=FriendRequest.Status.PENDING).exists()
+        assert Friendship.objects.count() == 2
+        alice.refresh_from_db()
+        assert alice.friend_count == 2
+
+
+@pytest.mark.django_db
+class TestBatchFriendRequests:
+    
+    def test_batch_send_friend_requests(self, api_client, create_user, create_friendship, create_friend_request):
+        """Test that a batch send reports a result for every requested user."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        friend = create_user(email='friend@example.com', name='Friend')
+        requested = create_user(email='requested@example.com', name='Requested')
+        requester = create_user(email='requester@example.com', name='Requester')
+        new_user = create_user(email='new@example.com', name='New User')
+        create_friendship(user1=sender, user2=friend)
+        create_friend_request(sender=sender, receiver=requested)
+        incoming = create_friend_request(sender=requester, receiver=sender)
+        
+        api_client.force_authenticate(user=sender)
+        url = reverse('batch-send-friend-requests')
+        user_ids = [new_user.id, sender.id, friend.id, requested.id, requester.id, 999999, new_user.id]
+        
+        response = api_client.post(url, {'user_ids': user_ids}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        results = {item['user_id']: item for item in response.data['results']}
+        assert len(response.data['results']) == 6
+        assert results[new_user.id]['result'] == 'sent'
+        assert results[requester.id]['result'] == 'accepted'
+        for user_id in (sender.id, friend.id, requested.id, 999999):
+            assert results[user_id]['result'] == 'error'
+        
+        new_request = FriendRequest.objects.get(sender=sender, receiver=new_user)
+        assert results[new_user.id]['request_id'] == new_request.id
+        incoming.refresh_from_db()
+        assert incoming.status == FriendRequest.Status.ACCEPTED
+        assert Friendship.objects.are_friends(sender, requester)
+    
+    def test_batch_accept_friend_requests(self, api_client, create_user, create_friend_request):
+        """Test that pending requests are accepted together and others are reported."""
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        senders = [create_user(email=f'sender{i}@example.com', name=f'Sender {i}') for i in range(3)]
+        pending = [create_friend_request(sender=sender, receiver=receiver) for sender in senders[:2]]
+        rejected = create_friend_request(sender=senders[2], receiver=receiver,
+                                         status=FriendRequest.Status.REJECTED)
+        not_mine = create_friend_request(sender=senders[0], receiver=senders[1])
+        
+        api_client.force_authenticate(user=receiver)
+        url = reverse('batch-accept-friend-requests')
+        request_ids = [pending[0].id, pending[1].id, rejected.id, not_mine.id]
+        
+        response = api_client.put(url, {'request_ids': request_ids}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['result'] for item in response.data['results']] == ['accepted', 'accepted', 'error', 'error']
+        assert Friendship.objects.friend_ids(receiver) == {senders[0].id, senders[1].id}
+        for friend_request in pending:
+            friend_request.refresh_from_db()
+            assert friend_request.status == FriendRequest.Status.ACCEPTED
+        not_mine.refresh_from_db()
+        assert not_mine.status == FriendRequest.Status.PENDING
+    
+    def test_batch_query_count_does_not_grow_with_batch_size(self, api_client, create_user,
+                                                             django_assert_max_num_queries):
+        """Test that a batch send issues a fixed number of queries."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receivers = [create_user(email=f'receiver{i}@example.com', name=f'Receiver {i}') for i in range(20)]
+        
+        api_client.force_authenticate(user=sender)
+        url = reverse('batch-send-friend-requests')
+        
+        with django_assert_max_num_queries(10):
+            response = api_client.post(url, {'user_ids': [r.id for r in receivers]}, format='json')
+        
+        assert [item['result'] for item in response.data['results']] == ['sent'] * 20
+
+
+@pytest.mark.django_db
+class TestFriendRequestThrottling:
+    
+    @pytest.fixture(autouse=True)
+    def friend_request_rate(self, settings):
+        settings.REST_FRAMEWORK = {
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'friend_requests': '2/min'},
+        }
+    
+    def test_sending_is_throttled_per_user(self, api_client, create_user):
+        """Test that each user has their own friend request bucket."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        other = create_user(email='other@example.com', name='Other User')
+        receivers = [create_user(email=f'receiver{i}@example.com', name=f'Receiver {i}') for i in range(3)]
+        api_client.force_authenticate(user=sender)
+        
+        codes = [api_client.post(reverse('send-friend-request', args=[r.id])).status_code for r in receivers]
+        
+        assert codes == [201, 201, status.HTTP_429_TOO_MANY_REQUESTS]
+        assert FriendRequest.objects.filter(sender=sender).count() == 2
+        api_client.force_authenticate(user=other)
+        assert api_client.post(reverse('send-friend-request', args=[receivers[2].id])).status_code == 201
+    
+    def test_batch_sends_share_the_bucket(self, api_client, create_user):
+        """Test that batch sends draw from the same bucket as single sends."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        api_client.force_authenticate(user=sender)
+        url = reverse('batch-send-friend-requests')
+        
+        api_client.post(reverse('send-friend-request', args=[receiver.id]))
+        api_client.post(url, {'user_ids': [receiver.id]}, format='json')
+        response = api_client.post(url, {'user_ids': [receiver.id]}, format='json')
+        
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    
+    def test_async_send_is_throttled(self, async_client, create_user):
+        """Test that the async send view applies the same throttles."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receivers = [create_user(email=f'receiver{i}@example.com', name=f'Receiver {i}') for i in range(3)]
+        
+        responses = [async_client('post', f'/api/friends/requests/{r.id}/', sender) for r in receivers]
+        
+        assert [r.status_code for r in responses] == [201, 201, status.HTTP_429_TOO_MANY_REQUESTS]
+        assert responses[2].headers['Retry-After'] == '30'
+        assert 'throttled' in responses[2].json()['detail']
+    
+    def test_async_checks_against_network_stores_leave_the_event_loop(self, async_client, create_user, monkeypatch):
+        """Test that bucket checks that wait on the network run off the event loop."""
+        loop_threads = []
+        
+        class NetworkStore(LocalBucketStore):
+            blocking = True
+            
+            def consume(self, key, capacity, refill_rate):
+                try:
+                    asyncio.get_running_loop()
+                    loop_threads.append(True)
+                except RuntimeError:
+                    loop_threads.append(False)
+                return super().consume(key, capacity, refill_rate)
+        
+        store = NetworkStore()
+        monkeypatch.setattr('social_backend.throttling.bucket_store', lambda: store)
+        monkeypatch.setattr('social_backend.async_views.bucket_store', lambda: store)
+        
+        response = async_client('get', '/api/friends/', create_user())
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert loop_threads and not any(loop_threads)
+
+
 @pytest.mark.django_db
 class TestFriendList:
     
@@ -166,8 +452,142 @@ class TestFriendList:
         assert user2.id in friend_ids
         assert user3.id in friend_ids
 
+    @pytest.mark.parametrize('friend_count', [1, 10])
+    def test_list_friends_query_count_is_constant(self, api_client, create_user, create_friendship,
+                                                  django_assert_num_queries, friend_count):
+        """Test that listing friends does not issue a query per friendship."""
+        user = create_user(email='user@example.com', name='User')
+        for i in range(friend_count):
+            # Alternate sides so both user1 and user2 lookups are exercised
+            friend = create_user(email=f'friend{i}@example.com', name=f'Friend {i}')
+            if i % 2:
+                create_friendship(user1=user, user2=friend)
+            else:
+                create_friendship(user1=friend, user2=user)
+        
+        api_client.force_authenticate(user=user)
+        url = reverse('friend-list')
+        
+        # One COUNT for the paginator and one joined SELECT for the page
+        with django_assert_num_queries(2):
+            response = api_client.get(url)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == friend_count
+        assert all(item['friend']['id'] != user.id for item in response.data['results'])
+        assert set(response.data['results'][0]['friend']) == {'id', 'email', 'name', 'profile_picture'}
+    
+    def test_list_friends_is_cached_per_user(self, api_client, create_user, create_friendship,
+                                             django_assert_num_queries):
+        """Test that the friend list is served from the cache until friendships change."""
+        user = create_user(email='user@example.com', name='User')
+        friend = create_user(email='friend@example.com', name='Friend')
+        create_friendship(user1=user, user2=friend)
+        response_cache_stats.reset()
+        
+        api_client.force_authenticate(user=user)
+        url = reverse('friend-list')
+        api_client.get(url)
+        with django_assert_num_queries(0):
+            response = api_client.get(url)
+        assert len(response.data['results']) == 1
+        assert response_cache_stats.snapshot()['FriendListView'] == {'hits': 1, 'misses': 1}
+        
+        # A profile change of the friend shows up in the cached list
+        friend.name = 'Renamed Friend'
+        friend.save()
+        response = api_client.get(url)
+        assert response.data['results'][0]['friend']['name'] == 'Renamed Friend'
+        
+        create_friendship(user1=user, user2=create_user(email='new@example.com', name='New Friend'))
+        response = api_client.get(url)
+        assert len(response.data['results']) == 2
+    
+    def test_list_friends_with_keyset_cursor(self, api_client, create_user, create_friendship):
+        """Test that friends are paged newest first by (created_at, id) cursors."""
+        user = create_user(email='user@example.com', name='User')
+        friendships = [
+            create_friendship(user1=user, user2=create_user(email=f'friend{i}@example.com', name=f'Friend {i}'))
+            for i in range(5)
+        ]
+        # Equal timestamps must still page deterministically by id
+        Friendship.objects.filter(id__in=[f.id for f in friendships[1:3]]).update(
+            created_at=friendships[1].created_at
+        )
+        
+        api_client.force_authenticate(user=user)
+        url = reverse('friend-list') + '?cursor=&page_size=2'
+        
+        seen = []
+        while url:
+            response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        
+        expected = Friendship.objects.filter(user1=user).order_by('-created_at', '-id')
+        assert seen == [friendship.id for friendship in expected]
+        assert len(seen) == 5
+    
+    def test_projected_lists_match_serializers_byte_for_byte(self, api_client, create_user, create_friendship,
+                                                             create_friend_request):
+        """Test that the projected list pages render exactly like the serializers."""
+        user = create_user(email='user@example.com', name='Zoë\u2028User')
+        for i in range(3):
+            other = create_user(email=f'other{i}@example.com', name=f'Other “{i}”')
+            create_friendship(user1=other, user2=user)
+            create_friend_request(sender=other, receiver=user)
+        create_friend_request(sender=user, receiver=create_user(email='new@example.com', name='New'))
+        
+        api_client.force_authenticate(user=user)
+        factory_request = APIRequestFactory().get('/')
+        factory_request.user = user
+        for url_name, serializer_class, queryset in (
+            ('friend-list', FriendshipSerializer, Friendship.objects.for_user(user)),
+            ('friend-request-list', FriendRequestSerializer,
+             FriendRequest.objects.filter(Q(sender=user) | Q(receiver=user))),
+        ):
+            response = api_client.get(reverse(url_name))
+            results = serializer_class(queryset, many=True, context={'request': factory_request}).data
+            expected = {'count': len(results), 'next': None, 'previous': None, 'results': results}
+            assert response.content == JSONRenderer().render(expected)
+    
+    def test_list_friend_requests_query_count_is_constant(self, api_client, create_user, create_friend_request,
+                                                          django_assert_num_queries):
+        """Test that listing friend requests joins both users into the page query."""
+        user = create_user(email='user@example.com', name='User')
+        for i in range(5):
+            create_friend_request(sender=create_user(email=f'sender{i}@example.com'), receiver=user)
+        
+        api_client.force_authenticate(user=user)
+        with django_assert_num_queries(2):
+            response = api_client.get(reverse('friend-request-list'))
+        
+        assert len(response.data['results']) == 5
+        assert response.data['results'][0]['sender']['email'] == 'sender4@example.com'
+    
+    def test_only_profile_changes_invalidate_friends(self, create_user, create_friendship):
+        """Test that friends' cached lists are dropped when the user's public fields change, not on logins."""
+        user = create_user(email='user@example.com', name='User')
+        friend = create_user(email='friend@example.com', name='Friend')
+        create_friendship(user1=user, user2=friend)
+        version = get_user_version(friend.id)
+        
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        user = User.objects.get(id=user.id)
+        user.bio = 'Not shown in friend lists'
+        user.save()
+        user.save(update_fields=['name'])
+        assert get_user_version(friend.id) == version
+        
+        user.name = 'Renamed User'
+        user.save()
+        assert get_user_version(friend.id) > version
 
-@pytest.mark.django_db
+
+# Friendships reach the friend graph when their transaction commits
+@pytest.mark.django_db(transaction=True)
 class TestFriendSuggestions:
     
     def test_get_friend_suggestions(self, api_client, create_user, create_friendship, create_friend_request):
@@ -204,4 +624,1109 @@ class TestFriendSuggestions:
         assert friend1.id not in suggestion_ids
         assert pending_user1.id not in suggestion_ids
         assert pending_user2.id not in suggestion_ids
-        assert user1.id not in suggestion_ids  # Self should not be suggested
\ No newline at end of file
+        assert user1.id not in suggestion_ids  # Self should not be suggested
+    
+    def test_suggestions_are_ranked_by_mutual_friends(self, api_client, create_user, create_friendship):
+        """Test that friends-of-friends are suggested, most mutual friends first."""
+        user = create_user(email='user@example.com', name='User')
+        friend1 = create_user(email='friend1@example.com', name='Friend One')
+        friend2 = create_user(email='friend2@example.com', name='Friend Two')
+        two_mutual = create_user(email='two@example.com', name='Two Mutual')
+        one_mutual = create_user(email='one@example.com', name='One Mutual')
+        create_friendship(user1=user, user2=friend1)
+        create_friendship(user1=user, user2=friend2)
+        create_friendship(user1=friend1, user2=two_mutual)
+        create_friendship(user1=two_mutual, user2=friend2)
+        create_friendship(user1=friend2, user2=one_mutual)
+        
+        api_client.force_authenticate(user=user)
+        response = api_client.get(reverse('friend-suggestions'))
+        
+        assert response.status_code == status.HTTP_200_OK
+        suggestion_ids = [item['id'] for item in response.data['results']]
+        assert suggestion_ids == [two_mutual.id, one_mutual.id]
+    
+    def test_suggestions_cache_is_invalidated(self, api_client, create_user, create_friendship):
+        """Test that a new friendship removes the friend from cached suggestions."""
+        user = create_user(email='user@example.com', name='User')
+        other = create_user(email='other@example.com', name='Other')
+        
+        api_client.force_authenticate(user=user)
+        url = reverse('friend-suggestions')
+        response = api_client.get(url)
+        assert [item['id'] for item in response.data['results']] == [other.id]
+        
+        create_friendship(user1=user, user2=other)
+        
+        response = api_client.get(url)
+        assert response.data['results'] == []
+
+@pytest.mark.django_db
+class TestFriendshipModel:
+    
+    def test_friendship_is_stored_in_canonical_order(self, create_user):
+        """Test that a friendship is saved with the lower user id first."""
+        user1 = create_user(email='user1@example.com', name='User One')
+        user2 = create_user(email='user2@example.com', name='User Two')
+        
+        friendship = Friendship.objects.create(user1=user2, user2=user1)
+        
+        friendship.refresh_from_db()
+        assert (friendship.user1_id, friendship.user2_id) == (user1.id, user2.id)
+    
+    def test_are_friends_is_symmetric(self, create_user, create_friendship):
+        """Test that a friendship check gives the same answer in both directions."""
+        user1 = create_user(email='user1@example.com', name='User One')
+        user2 = create_user(email='user2@example.com', name='User Two')
+        user3 = create_user(email='user3@example.com', name='User Three')
+        create_friendship(user1=user2, user2=user1)
+        
+        assert Friendship.objects.are_friends(user1, user2)
+        assert Friendship.objects.are_friends(user2.id, user1.id)
+        assert not Friendship.objects.are_friends(user1, user3)
+    
+    def test_friend_ids(self, create_user, create_friendship):
+        """Test that friend ids are collected from both sides of the pair."""
+        user1 = create_user(email='user1@example.com', name='User One')
+        user2 = create_user(email='user2@example.com', name='User Two')
+        user3 = create_user(email='user3@example.com', name='User Three')
+        create_friendship(user1=user1, user2=user2)
+        create_friendship(user1=user3, user2=user2)
+        
+        assert Friendship.objects.friend_ids(user2) == {user1.id, user3.id}
+        assert Friendship.objects.friend_ids(user1) == {user2.id}
+
+
+def graph_of(*pairs):
+    graph = FriendGraph()
+    graph.load_edges(array('q', [a for a, _ in pairs]), array('q', [b for _, b in pairs]))
+    return graph
+
+
+class TestFriendGraph:
+    
+    def test_lookups(self):
+        """Test neighbours, friendship checks, mutual counts and distances."""
+        graph = graph_of((1, 2), (1, 3), (2, 3), (3, 4), (4, 6))
+        
+        assert graph.friend_ids(3) == [1, 2, 4]
+        assert graph.friend_ids(5) == graph.friend_ids(99) == []
+        assert graph.are_friends(2, 1) and not graph.are_friends(1, 4)
+        assert graph.degree(3) == 3
+        assert graph.mutual_count(1, 2) == 1
+        assert graph.mutual_count(1, 4) == 1
+        assert graph.distance(1, 1) == 0
+        assert graph.distance(1, 6) == 3
+        assert graph.distance(1, 6, max_hops=2) is None
+        assert graph.distance(1, 5) is None
+    
+    def test_mutual_friends_and_paths(self):
+        """Test mutual friend ids and shortest paths, including changes not yet compacted."""
+        graph = graph_of((1, 2), (1, 3), (1, 4), (2, 3), (2, 4), (4, 5), (5, 6), (6, 7))
+        graph.apply([(ADD, 2, 8), (ADD, 1, 8), (REMOVE, 1, 3)])
+        
+        assert graph.mutual_friend_ids(1, 2) == [4, 8]
+        assert graph.mutual_friend_ids(1, 99) == []
+        assert graph.shortest_path(1, 1) == [1]
+        assert graph.shortest_path(1, 2) == [1, 2]
+        assert graph.shortest_path(3, 7, max_hops=5) == [3, 2, 4, 5, 6, 7]
+        assert graph.shortest_path(3, 7, max_hops=4) is None
+        assert graph.shortest_path(1, 99) is None
+        with pytest.raises(SearchBudgetExceeded):
+            graph.shortest_path(3, 7, max_hops=5, deadline=0)
+    
+    def test_path_search_minds_the_deadline_while_sizing_frontiers(self, monkeypatch):
+        """Test that summing the degrees of a large frontier stops at the deadline."""
+        # Two hubs of a thousand friends each, so the third step sizes a frontier of 999
+        graph = graph_of(*((hub, hub + i) for hub in (1, 5000) for i in range(1, 1001)))
+        degree = graph.degree
+        sized = []
+        
+        def slow_degree(user_id):
+            sized.append(user_id)
+            time.sleep(0.001)
+            return degree(user_id)
+        monkeypatch.setattr(graph, 'degree', slow_degree)
+        
+        with pytest.raises(SearchBudgetExceeded):
+            graph.shortest_path(2, 5001, max_hops=6, deadline=time.monotonic() + 0.05)
+        assert len(sized) < 500
+    
+    def test_changes_on_top_of_the_arrays(self):
+        """Test that changes after loading apply at once and survive compaction."""
+        graph = graph_of((1, 2), (2, 3))
+        
+        graph.apply([(ADD, 3, 7), (REMOVE, 1, 2), (ADD, 3, 7)])
+        assert graph.friend_ids(3) == [2, 7]
+        assert graph.friend_ids(1) == []
+        assert graph.edge_count == 2
+        
+        graph.compact()
+        assert (graph.added, graph.removed) == ({}, {})
+        assert graph.friend_ids(3) == [2, 7]
+        assert graph.friend_ids(7) == [3]
+        assert not graph.are_friends(1, 2)
+        
+        graph.apply([(REMOVE, 3, 7), (ADD, 3, 7)])
+        assert (graph.added, graph.removed) == ({}, {})
+    
+    @pytest.mark.django_db(transaction=True)
+    def test_graph_follows_committed_friendships(self, create_user, create_friendship):
+        """Test that the graph loads from the database and follows committed writes only."""
+        user1 = create_user(email='user1@example.com', name='User One')
+        user2 = create_user(email='user2@example.com', name='User Two')
+        user3 = create_user(email='user3@example.com', name='User Three')
+        create_friendship(user1=user1, user2=user2)
+        assert friend_graph.ensure_current().friend_ids(user1.id) == [user2.id]
+        
+        friendship = create_friendship(user1=user3, user2=user1)
+        with pytest.raises(RuntimeError), transaction.atomic():
+            create_friendship(user1=user2, user2=user3)
+            raise RuntimeError
+        
+        assert friend_graph.friend_ids(user1.id) == [user2.id, user3.id]
+        assert not friend_graph.are_friends(user2.id, user3.id)
+        friendship.delete()
+        assert friend_graph.friend_ids(user3.id) == []
+    
+    @pytest.mark.django_db(transaction=True)
+    def test_workers_replay_the_change_log(self, create_user, create_friendship):
+        """Test that other workers pick up changes from the log and reload when it has gaps."""
+        user1 = create_user(email='user1@example.com', name='User One')
+        user2 = create_user(email='user2@example.com', name='User Two')
+        user3 = create_user(email='user3@example.com', name='User Three')
+        friend_graph.ensure_loaded()
+        other_worker = FriendGraph()
+        other_worker.load()
+        
+        create_friendship(user1=user1, user2=user2)
+        other_worker.sync()
+        assert other_worker.friend_ids(user1.id) == [user2.id]
+        
+        # A change whose log entry is gone, as if evicted
+        create_friendship(user1=user2, user2=user3)
+        cache.delete(change_log_key(current_sequence()))
+        other_worker.sync()
+        assert not other_worker.are_friends(user2.id, user3.id)
+        release = threading.Event()
+        load = other_worker.load
+        other_worker.load = lambda: release.wait(5) and load()
+        other_worker.sync()
+        # Reloads on a thread, answering from the database until it is done
+        assert other_worker.reloading
+        assert other_worker.ensure_current() is database_graph
+        assert database_graph.friend_ids(user2.id) == [user1.id, user3.id]
+        release.set()
+        other_worker.reload_thread.join()
+        assert other_worker.ensure_current() is other_worker
+        assert other_worker.are_friends(user2.id, user3.id)
+    
+    def test_send_turns_away_friends_known_to_the_graph(self, api_client, create_user, db):
+        """Test that sending a request to a friend is rejected from the graph alone."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        # Only the graph knows about this friendship
+        friend_graph.ensure_loaded()
+        friend_graph.apply([(ADD, sender.id, receiver.id)])
+        api_client.force_authenticate(user=sender)
+        
+        response = api_client.post(reverse('send-friend-request', args=[receiver.id]))
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['detail'] == 'You are already friends with this user.'
+        assert not FriendRequest.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestFriendConnections:
+    
+    @pytest.fixture
+    def chain(self, create_user, create_friendship):
+        """Users one to five, each a friend of the next, plus a friend shared by the first and third."""
+        users = [create_user(email=f'user{i}@example.com', name=f'User {i}') for i in range(1, 6)]
+        for user, friend in zip(users, users[1:]):
+            create_friendship(user1=user, user2=friend)
+        shared = create_user(email='shared@example.com', name='Shared Friend')
+        create_friendship(user1=users[0], user2=shared)
+        create_friendship(user1=shared, user2=users[2])
+        return users, shared
+    
+    def test_mutual_friends(self, api_client, chain):
+        """Test listing the friends two users share."""
+        users, shared = chain
+        api_client.force_authenticate(user=users[0])
+        
+        response = api_client.get(reverse('mutual-friends', args=[users[2].id]))
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 2
+        assert [user['id'] for user in response.data['results']] == [users[1].id, shared.id]
+        assert response.data['results'][1]['email'] == 'shared@example.com'
+        
+        response = api_client.get(reverse('mutual-friends', args=[users[4].id]))
+        assert response.data['count'] == 0
+    
+    def test_unknown_user(self, api_client, chain):
+        """Test that both endpoints answer 404 for a user that does not exist."""
+        users, _ = chain
+        api_client.force_authenticate(user=users[0])
+        
+        for name in ('mutual-friends', 'friend-path'):
+            response = api_client.get(reverse(name, args=[99999]))
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+            assert response.data['detail'] == 'User not found.'
+    
+    def test_friend_path(self, api_client, chain, django_assert_num_queries):
+        """Test the shortest chain of friends to another user, in two queries."""
+        users, shared = chain
+        api_client.force_authenticate(user=users[0])
+        friend_graph.ensure_loaded()
+        
+        with django_assert_num_queries(2):
+            response = api_client.get(reverse('friend-path', args=[users[3].id]))
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['degrees'] == 3
+        path = [user['id'] for user in response.data['path']]
+        assert path[0] == users[0].id and path[2:] == [users[2].id, users[3].id]
+        assert path[1] in (users[1].id, shared.id)
+        assert response.data['path'][0]['name'] == 'User 1'
+        
+        response = api_client.get(reverse('friend-path', args=[users[4].id]), {'max_hops': 4})
+        assert response.data['degrees'] == 4
+    
+    def test_database_graph_matches_friend_graph(self, chain):
+        """Test that the fallback used while a graph reloads gives the same answers."""
+        users, shared = chain
+        ids = [user.id for user in users]
+        graph = friend_graph.ensure_current()
+        
+        assert database_graph.mutual_friend_ids(ids[0], ids[2]) == graph.mutual_friend_ids(ids[0], ids[2])
+        assert database_graph.count_friends_of(ids[:2]) == graph.count_friends_of(ids[:2])
+        assert database_graph.distance(ids[0], ids[4], max_hops=4) == 4
+        assert database_graph.shortest_path(ids[0], ids[4], max_hops=3) is None
+        assert database_graph.degree(shared.id) == graph.degree(shared.id) == 2
+    
+    def test_deactivated_users_are_left_out(self, api_client, chain):
+        """Test that mutual friends skip deactivated users and chains through them are no connection."""
+        users, shared = chain
+        User.objects.filter(id__in=[shared.id, users[3].id]).update(is_active=False)
+        api_client.force_authenticate(user=users[0])
+        
+        response = api_client.get(reverse('mutual-friends', args=[users[2].id]))
+        assert response.data['count'] == 1
+        assert [user['id'] for user in response.data['results']] == [users[1].id]
+        
+        response = api_client.get(reverse('friend-path', args=[users[4].id]), {'max_hops': 4})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+    
+    def test_friend_path_hop_limit(self, api_client, chain):
+        """Test that paths longer than max_hops are not found and invalid limits are rejected."""
+        users, _ = chain
+        api_client.force_authenticate(user=users[0])
+        url = reverse('friend-path', args=[users[4].id])
+        
+        response = api_client.get(url)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert response.data['detail'] == 'No connection within 3 hops.'
+        
+        for max_hops in (0, 7, 'far'):
+            response = api_client.get(url, {'max_hops': max_hops})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+            assert 'max_hops' in response.data
+    
+    def test_friend_path_budget(self, api_client, chain, settings):
+        """Test that a search running past its latency budget is abandoned."""
+        users, _ = chain
+        settings.FRIEND_PATH_BUDGET_MS = -1
+        api_client.force_authenticate(user=users[0])
+        
+        response = api_client.get(reverse('friend-path', args=[users[4].id]))
+        
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.data['detail'].code == 'path_search_timeout'
+
+
+def drain_outbox(**options):
+    """Run the outbox worker until nothing is due; return the total (succeeded, failed)."""
+    outcomes = list(outbox.work(threads=2, once=True, **options))
+    return tuple(map(sum, zip(*outcomes)))
+
+
+# The worker's threads only see committed events
+@pytest.mark.django_db(transaction=True)
+class TestOutbox:
+    
+    @pytest.fixture
+    def flaky_handler(self, monkeypatch):
+        """Register a handler for 'test.flaky' events that fails while ``failing`` is set."""
+        calls = []
+        
+        def run(event):
+            calls.append(event.idempotency_key)
+            if run.failing:
+                raise RuntimeError('Service unavailable')
+        
+        run.failing = True
+        run.calls = calls
+        monkeypatch.setitem(outbox.handlers, 'test.flaky', run)
+        return run
+    
+    def test_events_are_written_with_the_friendship(self, api_client, create_user, create_friend_request,
+                                                   create_friendship):
+        """Test that accepting a request records an event, and a rolled back friendship none."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        friend_request = create_friend_request(sender=sender, receiver=receiver)
+        api_client.force_authenticate(user=receiver)
+        
+        response = api_client.put(reverse('accept-friend-request', args=[friend_request.id]))
+        
+        assert response.status_code == status.HTTP_200_OK
+        event = OutboxEvent.objects.get(topic='friendship.created')
+        assert event.payload == {'user_ids': sorted([sender.id, receiver.id])}
+        assert event.processed_at is None
+        
+        other = create_user(email='other@example.com', name='Other User')
+        with pytest.raises(RuntimeError), transaction.atomic():
+            create_friendship(user1=sender, user2=other)
+            raise RuntimeError
+        assert OutboxEvent.objects.filter(topic='friendship.created').count() == 1
+    
+    def test_worker_invalidates_friends_of_friends(self, create_user, create_friendship):
+        """Test that the worker drops cached suggestions of the friends of new friends."""
+        user = create_user(email='user@example.com', name='User')
+        friend = create_user(email='friend@example.com', name='Friend')
+        stranger = create_user(email='stranger@example.com', name='Stranger')
+        create_friendship(user1=friend, user2=user)
+        drain_outbox()
+        get_suggestions(friend.id)
+        
+        create_friendship(user1=user, user2=stranger)
+        assert cache.get(suggestion_cache_key(friend.id)) is not None
+        
+        call_command('drain_outbox', '--once', stdout=io.StringIO())
+        
+        assert cache.get(suggestion_cache_key(friend.id)) is None
+        assert [suggested.id for suggested in get_suggestions(friend.id)][0] == stranger.id
+        assert not OutboxEvent.objects.filter(processed_at__isnull=True).exists()
+    
+    def test_failed_events_are_retried_with_backoff(self, flaky_handler):
+        """Test that failures are recorded, retried later and given up after max_attempts."""
+        outbox.enqueue([('test.flaky', 'flaky:1', {}), ('test.flaky', 'flaky:1', {}), ('test.unknown', 'unknown:1', {})])
+        assert OutboxEvent.objects.count() == 2
+        
+        assert drain_outbox() == (0, 2)
+        event = OutboxEvent.objects.get(idempotency_key='flaky:1')
+        assert event.attempts == 1
+        assert event.last_error == 'RuntimeError: Service unavailable'
+        assert event.available_at > timezone.now()
+        assert OutboxEvent.objects.get(idempotency_key='unknown:1').last_error == "No handler for 'test.unknown'."
+        
+        OutboxEvent.objects.update(available_at=timezone.now())
+        assert drain_outbox(max_attempts=1) == (0, 0)
+        
+        flaky_handler.failing = False
+        assert drain_outbox() == (1, 1)
+        event.refresh_from_db()
+        assert (event.attempts, event.last_error) == (2, '')
+        assert event.processed_at is not None
+        assert flaky_handler.calls == ['flaky:1', 'flaky:1']
+    
+    def test_expired_leases_are_delivered_again(self, flaky_handler):
+        """Test that events claimed by a worker that never finished them are run again."""
+        flaky_handler.failing = False
+        outbox.enqueue([('test.flaky', 'flaky:1', {})])
+        # A worker claims the event and dies before running it
+        assert len(outbox.claim(lease=datetime.timedelta(0))) == 1
+        
+        assert drain_outbox() == (1, 0)
+        assert OutboxEvent.objects.get().attempts == 2
+        
+        old = timezone.now() - outbox.RETENTION - datetime.timedelta(seconds=1)
+        OutboxEvent.objects.update(processed_at=old)
+        assert outbox.purge() == 1
+    
+    def test_busy_workers_purge_on_a_timer(self, flaky_handler):
+        """Test that a worker purges old events even when every poll finds work."""
+        flaky_handler.failing = False
+        outbox.enqueue([('test.flaky', 'old', {})] + [('test.flaky', f'flaky:{i}', {}) for i in range(3)])
+        old = timezone.now() - outbox.RETENTION - datetime.timedelta(seconds=1)
+        OutboxEvent.objects.filter(idempotency_key='old').update(processed_at=old)
+        
+        batches = outbox.work(threads=1, batch_size=1)
+        assert next(batches) == (1, 0)
+        batches.close()
+        
+        assert not OutboxEvent.objects.filter(idempotency_key='old').exists()
+    
+    def test_friend_request_events_are_logged_from_the_outbox(self, api_client, create_user, monkeypatch):
+        """Test that an event the request failed to log on commit is logged by the worker."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        api_client.force_authenticate(user=sender)
+        
+        def unavailable(events):
+            raise ConnectionError('Cache unavailable')
+        monkeypatch.setattr('friends.events.log_events', unavailable)
+        response = api_client.post(reverse('send-friend-request', args=[receiver.id]))
+        
+        assert response.status_code == status.HTTP_201_CREATED
+        event = OutboxEvent.objects.get(topic='friend_request.created')
+        assert event.last_error == 'ConnectionError: Cache unavailable'
+        
+        monkeypatch.undo()
+        OutboxEvent.objects.update(available_at=timezone.now())
+        drain_outbox()
+        sequence = cache.get(EVENT_LOG_SEQUENCE_KEY)
+        assert cache.get(event_log_key(sequence)) == (
+            'friend_request.created', response.data['id'], sender.id, receiver.id)
+
+
+def counters(*users):
+    """Return the (friend_count, pending_incoming_count) of each user as stored."""
+    stored = User.objects.in_bulk([user.id for user in users])
+    return [(stored[u.id].friend_count, stored[u.id].pending_incoming_count) for u in users]
+
+
+@pytest.mark.django_db
+class TestUserCounters:
+    
+    def test_send_and_accept_update_counters(self, api_client, create_user):
+        """Test that sending and accepting a request adjust both users' counters."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        
+        api_client.force_authenticate(user=sender)
+        api_client.post(reverse('send-friend-request', kwargs={'user_id': receiver.id}))
+        assert counters(sender, receiver) == [(0, 0), (0, 1)]
+        
+        friend_request = FriendRequest.objects.get(sender=sender, receiver=receiver)
+        api_client.force_authenticate(user=receiver)
+        api_client.put(reverse('accept-friend-request', kwargs={'request_id': friend_request.id}))
+        assert counters(sender, receiver) == [(1, 0), (1, 0)]
+    
+    def test_reject_only_clears_pending(self, api_client, create_user):
+        """Test that rejecting a request leaves the friend counts alone."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        api_client.force_authenticate(user=sender)
+        api_client.post(reverse('send-friend-request', kwargs={'user_id': receiver.id}))
+        
+        friend_request = FriendRequest.objects.get(sender=sender, receiver=receiver)
+        api_client.force_authenticate(user=receiver)
+        api_client.put(reverse('reject-friend-request', kwargs={'request_id': friend_request.id}))
+        
+        assert counters(sender, receiver) == [(0, 0), (0, 0)]
+    
+    def test_opposite_request_is_counted_as_accepted(self, api_client, create_user):
+        """Test that the automatic accept of an opposite request moves the counters."""
+        user1 = create_user(email='user1@example.com', name='User One')
+        user2 = create_user(email='user2@example.com', name='User Two')
+        api_client.force_authenticate(user=user1)
+        api_client.post(reverse('send-friend-request', kwargs={'user_id': user2.id}))
+        
+        api_client.force_authenticate(user=user2)
+        api_client.post(reverse('send-friend-request', kwargs={'user_id': user1.id}))
+        
+        assert counters(user1, user2) == [(1, 0), (1, 0)]
+    
+    def test_batch_operations_update_counters(self, api_client, create_user, create_friendship):
+        """Test that batch sends and accepts count every request once."""
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        senders = [create_user(email=f'sender{i}@example.com', name=f'Sender {i}') for i in range(3)]
+        for sender in senders:
+            api_client.force_authenticate(user=sender)
+            api_client.post(reverse('batch-send-friend-requests'), {'user_ids': [receiver.id]}, format='json')
+        assert counters(receiver) == [(0, 3)]
+        
+        # A friendship made outside the services is not counted twice on accept
+        create_friendship(user1=senders[0], user2=receiver)
+        User.objects.filter(id__in=[senders[0].id, receiver.id]).update(friend_count=1)
+        
+        api_client.force_authenticate(user=receiver)
+        request_ids = list(FriendRequest.objects.filter(receiver=receiver).values_list('id', flat=True))
+        api_client.put(reverse('batch-accept-friend-requests'), {'request_ids': request_ids}, format='json')
+        
+        assert counters(receiver, *senders) == [(3, 0), (1, 0), (1, 0), (1, 0)]
+    
+    def test_profile_shows_counters_without_extra_queries(self, api_client, create_user,
+                                                         create_friend_request, django_assert_num_queries):
+        """Test that the profile reads the counters from the user row."""
+        user = create_user(email='user@example.com', name='User')
+        create_friend_request(receiver=user)
+        User.objects.filter(id=user.id).update(friend_count=4, pending_incoming_count=1)
+        
+        api_client.force_authenticate(user=user)
+        # The user row itself, nothing counted
+        with django_assert_num_queries(1):
+            response = api_client.get(reverse('user-profile'))
+        
+        assert response.data['friend_count'] == 4
+        assert response.data['pending_incoming_count'] == 1
+    
+    def test_reconcile_command_fixes_drift(self, create_user, create_friendship, create_friend_request):
+        """Test that the reconcile command recounts drifted users only."""
+        user1 = create_user(email='user1@example.com', name='User One')
+        user2 = create_user(email='user2@example.com', name='User Two')
+        user3 = create_user(email='user3@example.com', name='User Three')
+        create_friendship(user1=user1, user2=user2)
+        create_friend_request(sender=user1, receiver=user3)
+        User.objects.filter(id=user1.id).update(friend_count=1)
+        
+        out = io.StringIO()
+        call_command('reconcile_user_counters', '--dry-run', stdout=out)
+        assert '2 users have drifted counters.' in out.getvalue()
+        assert counters(user2, user3) == [(0, 0), (0, 0)]
+        
+        out = io.StringIO()
+        call_command('reconcile_user_counters', '--batch-size', '2', stdout=out)
+        assert 'Fixed the counters of 2 users.' in out.getvalue()
+        assert counters(user1, user2, user3) == [(1, 0), (1, 0), (0, 1)]
+
+
+def assert_index_search(queryset, *index_names):
+    """Assert that the query reads friend requests through one of the named indexes only."""
+    plan = queryset.explain()
+    if connection.vendor == 'postgresql':
+        assert 'Seq Scan on friends_friendrequest' not in plan, plan
+    else:
+        # SQLite reports full table and full index scans as SCAN
+        assert not re.search(r'\bSCAN friends_friendrequest\b', plan), plan
+    assert any(name in plan for name in index_names), plan
+
+
+@pytest.fixture
+def seeded_friend_requests(db):
+    """Seed a few thousand friend requests in mixed states and refresh planner statistics."""
+    users = User.objects.bulk_create([
+        User(email=f'seed{i}@example.com', name=f'Seed {i}') for i in range(300)
+    ])
+    statuses = [FriendRequest.Status.PENDING, FriendRequest.Status.ACCEPTED, FriendRequest.Status.REJECTED]
+    FriendRequest.objects.bulk_create([
+        FriendRequest(sender=sender, receiver=users[(i * 7 + step) % len(users)], status=statuses[step % 3])
+        for i, sender in enumerate(users)
+        for step in range(1, 11)
+    ], ignore_conflicts=True)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return users
+
+
+@pytest.mark.django_db
+class TestFriendRequestIndexes:
+    
+    def test_request_list_uses_indexes(self, seeded_friend_requests):
+        """Test that the sent-or-received list is answered from the sender and receiver indexes."""
+        user = seeded_friend_requests[5]
+        queryset = FriendRequest.objects.filter(Q(sender=user) | Q(receiver=user)).order_by('-created_at', '-id')
+        
+        assert_index_search(queryset, 'friendreq_sender_created_idx')
+        assert_index_search(queryset, 'friendreq_recv_status_created', 'friendreq_pending_recv_idx')
+    
+    def test_pending_requests_use_indexes(self, seeded_friend_requests):
+        """Test that incoming pending requests are found without scanning the table."""
+        user = seeded_friend_requests[5]
+        queryset = FriendRequest.objects.filter(receiver=user, status=FriendRequest.Status.PENDING)
+        
+        assert_index_search(queryset, 'friendreq_recv_status_created', 'friendreq_pending_recv_idx')
+    
+    def test_pair_lookup_uses_unique_index(self, seeded_friend_requests):
+        """Test that the request between two users is a single unique index probe."""
+        sender, receiver = seeded_friend_requests[5], seeded_friend_requests[12]
+        queryset = FriendRequest.objects.filter(sender=sender, receiver=receiver)
+        
+        assert_index_search(queryset, 'sqlite_autoindex_friends_friendrequest', 'friends_friendrequest_sender_id_receiver_id')
+
+
+@pytest.mark.django_db
+class TestRequestMetrics:
+    
+    @pytest.fixture(autouse=True)
+    def reset_metrics(self, settings):
+        settings.METRICS_TOKEN = 'metrics-token'
+        request_metrics.reset()
+        response_cache_stats.reset()
+        yield
+        request_metrics.reset()
+    
+    def test_metrics_record_queries_per_view(self, api_client, create_user, create_friendship):
+        """Test that requests are exported per view with their query counts."""
+        user = create_user(email='user1@example.com', name='User One')
+        create_friendship(user1=user)
+        api_client.force_authenticate(user=user)
+        
+        api_client.get(reverse('friend-list'))
+        api_client.get(reverse('friend-list'))
+        api_client.force_authenticate(user=None)
+        response = api_client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer metrics-token')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'].startswith('text/plain')
+        body = response.content.decode()
+        assert 'http_requests_total{view="friend-list",method="GET",status="200"} 2' in body
+        assert 'http_request_duration_seconds_count{view="friend-list",method="GET"} 2' in body
+        # The second request is served from the response cache without SQL
+        assert 'http_request_db_queries_bucket{view="friend-list",method="GET",le="0"} 1' in body
+        assert 'http_request_serialization_seconds_total{view="friend-list",method="GET"}' in body
+        assert 'response_cache_hits_total{view="FriendListView"} 1' in body
+    
+    def test_metrics_require_token(self, api_client, settings):
+        """Test that metrics are only served with the configured token."""
+        assert api_client.get(reverse('metrics')).status_code == status.HTTP_403_FORBIDDEN
+        
+        settings.METRICS_TOKEN = ''
+        response = api_client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+    
+    def test_slow_requests_are_logged_with_sql(self, api_client, create_user, settings, caplog):
+        """Test that requests over the threshold are logged with their queries."""
+        settings.SLOW_REQUEST_THRESHOLD_MS = 0
+        user = create_user()
+        api_client.force_authenticate(user=user)
+        
+        with caplog.at_level('WARNING', logger='social_backend.slow_requests'):
+            api_client.get(reverse('friend-request-list'))
+        
+        assert 'Slow request GET /api/friends/requests/ (friend-request-list) -> 200' in caplog.text
+        assert 'friends_friendrequest' in caplog.text
+
+
+class TestJSONRendering:
+    
+    @pytest.mark.parametrize('data', [
+        {'id': 1, 'name': 'Zoë', 'bio': 'line\u2028break\u2029', 'nested': [{'a': None, 'b': True}]},
+        {'when': timezone.now(), 'day': datetime.date(2024, 2, 29), 'amount': Decimal('1.50')},
+        {'detail': gettext_lazy('Not found.'), 1: 'int key'},
+        [1, 2 ** 70, 'big integers fall back to json'],
+    ])
+    def test_orjson_renderer_matches_drf(self, data):
+        """Test that the orjson renderer writes the bytes DRF's renderer writes."""
+        assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+    
+    def test_indented_output_is_delegated(self):
+        """Test that a requested indent is honoured."""
+        rendered = ORJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        
+        assert rendered == b'{\n  "a": 1\n}'
+
+
+class AsyncFriendURLs:
+    urlpatterns = [path('api/friends/', include('friends.async_urls'))]
+
+
+@pytest.fixture
+def async_client(settings):
+    """Send requests through the ASGI handler to the async friend views."""
+    settings.ROOT_URLCONF = AsyncFriendURLs
+    client = AsyncClient()
+    
+    def _request(method, url, user=None, headers=None, **data):
+        headers = dict(headers or {})
+        if user is not None:
+            headers['Authorization'] = f'Bearer {UserRefreshToken.for_user(user).access_token}'
+        
+        async def send():
+            return await getattr(client, method)(url, data, content_type='application/json', headers=headers)
+        return async_to_sync(send)()
+    return _request
+
+
+@pytest.mark.django_db
+class TestAsyncFriendViews:
+    
+    def test_async_friend_list_matches_sync_view(self, async_client, create_user, create_friendship):
+        """Test that the async friend list returns the same page as the sync view."""
+        user = create_user(email='user1@example.com', name='User One')
+        create_friendship(user1=user)
+        create_friendship(user1=user, user2=create_user(email='user3@example.com', name='User Three'))
+        request = APIRequestFactory().get('/api/friends/')
+        force_authenticate(request, user=user)
+        expected = json.loads(FriendListView.as_view()(request).render().content)
+        cache.clear()
+        
+        response = async_client('get', '/api/friends/', user)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == expected
+        assert response.json()['count'] == 2
+    
+    def test_async_request_list_query_count_is_constant(self, async_client, create_user, create_friend_request,
+                                                        django_assert_num_queries):
+        """Test that the async request list loads both users of every request in one query."""
+        user = create_user(email='user1@example.com', name='User One')
+        for i in range(5):
+            create_friend_request(sender=create_user(email=f'sender{i}@example.com'), receiver=user)
+        
+        # COUNT(*) and the page
+        with django_assert_num_queries(2):
+            response = async_client('get', '/api/friends/requests/', user)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()['results']) == 5
+        assert response.json()['results'][0]['sender']['email'] == 'sender4@example.com'
+    
+    def test_async_send_and_accept_friend_request(self, async_client, create_user):
+        """Test the async send and accept endpoints end to end."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        
+        response = async_client('post', f'/api/friends/requests/{receiver.id}/', sender)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()['receiver']['email'] == 'receiver@example.com'
+        
+        response = async_client('put', f"/api/friends/requests/{response.json()['id']}/accept/", receiver)
+        assert response.status_code == status.HTTP_200_OK
+        assert Friendship.objects.are_friends(sender, receiver)
+        
+        response = async_client('post', f'/api/friends/requests/{receiver.id}/', sender)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json() == {'detail': 'You are already friends with this user.'}
+    
+    def test_async_request_list_shares_etags_with_sync_view(self, async_client, create_user, create_friend_request):
+        """Test that the async request list validates the sync view's ETag and answers 304."""
+        user = create_user(email='user1@example.com', name='User One')
+        create_friend_request(sender=create_user(email='sender@example.com'), receiver=user)
+        request = APIRequestFactory().get('/api/friends/requests/')
+        force_authenticate(request, user=user)
+        etag = FriendRequestListView.as_view()(request)['ETag']
+        
+        response = async_client('get', '/api/friends/requests/', user, headers={'If-None-Match': etag})
+        
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+        response = async_client('get', '/api/friends/requests/', user)
+        assert response['ETag'] == etag
+        assert response.json()['count'] == 1
+    
+    def test_async_views_require_authentication(self, async_client):
+        """Test that the async views reject anonymous requests like the sync ones."""
+        response = async_client('get', '/api/friends/suggestions/')
+        
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        assert 'WWW-Authenticate' in response.headers
+        assert async_client('delete', '/api/friends/').status_code == status.HTTP_405_METHOD_NOT_ALLOWED
+
+
+def event_stream_scope(user=None, query_string=b'', method='GET', headers=()):
+    headers = list(headers)
+    if user is not None:
+        headers.append((b'authorization', f'Bearer {UserRefreshToken.for_user(user).access_token}'.encode()))
+    return {'type': 'http', 'method': method, 'path': '/api/friends/events/', 'headers': headers,
+            'query_string': query_string}
+
+
+def parse_event(message):
+    """Return the fields of the server-sent event in an ASGI body message, with data decoded."""
+    fields = dict(line.split(': ', 1) for line in message['body'].decode().strip().split('\n'))
+    fields['data'] = json.loads(fields['data'])
+    return fields
+
+
+class EventStreams:
+    """Open event streams on the ASGI app from a coroutine and read their events."""
+    
+    def __init__(self):
+        from social_backend.asgi import application
+        self.application = application
+        self.streams = []
+    
+    async def connect(self, user=None, **scope):
+        stream = ApplicationCommunicator(self.application, event_stream_scope(user, **scope))
+        self.streams.append(stream)
+        await stream.send_input({'type': 'http.request', 'body': b''})
+        return stream, await stream.receive_output(1)
+    
+    async def close(self):
+        for stream in self.streams:
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait(1)
+
+
+# Events are logged when their transaction commits
+@pytest.mark.django_db(transaction=True)
+class TestFriendEventStream:
+    
+    @pytest.fixture(autouse=True)
+    def fast_polling(self, settings):
+        settings.FRIEND_EVENTS_POLL_SECONDS = 0.01
+    
+    def test_events_replace_polling_the_request_list(self, create_user):
+        """Test that both sides receive every change as the item the request list would return."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        sender_client, receiver_client = APIClient(), APIClient()
+        sender_client.force_authenticate(user=sender)
+        receiver_client.force_authenticate(user=receiver)
+        streams = EventStreams()
+        
+        async def scenario():
+            receiver_stream, start = await streams.connect(receiver)
+            sender_stream, _ = await streams.connect(sender)
+            ready = parse_event(await receiver_stream.receive_output(1))
+            await sender_stream.receive_output(1)
+            
+            await sync_to_async(sender_client.post)(reverse('send-friend-request', args=[receiver.id]))
+            created = [parse_event(await stream.receive_output(1)) for stream in (receiver_stream, sender_stream)]
+            polled = await sync_to_async(receiver_client.get)(reverse('friend-request-list'))
+            
+            request_id = polled.json()['results'][0]['id']
+            await sync_to_async(receiver_client.put)(reverse('accept-friend-request', args=[request_id]))
+            accepted = [parse_event(await stream.receive_output(1)) for stream in (receiver_stream, sender_stream)]
+            polled_again = await sync_to_async(receiver_client.get)(reverse('friend-request-list'))
+            await streams.close()
+            return start, ready, created, polled.json(), accepted, polled_again.json()
+        
+        start, ready, created, polled, accepted, polled_again = async_to_sync(scenario)()
+        
+        assert start['status'] == status.HTTP_200_OK
+        assert (b'content-type', b'text/event-stream') in start['headers']
+        assert ready['event'] == 'ready'
+        for event in created:
+            assert event['event'] == 'friend_request.created'
+            assert event['data']['friend_request'] == polled['results'][0]
+        for event in accepted:
+            assert event['event'] == 'friend_request.accepted'
+            assert event['data']['friend_request'] == polled_again['results'][0]
+        assert accepted[0]['data']['friend_request']['status'] == 'accepted'
+    
+    def test_connections_are_authenticated(self, create_user):
+        """Test that streams need a valid access token, given as a header or a query parameter."""
+        user = create_user()
+        token = UserRefreshToken.for_user(user).access_token
+        streams = EventStreams()
+        
+        async def scenario():
+            _, anonymous = await streams.connect()
+            _, invalid = await streams.connect(query_string=b'token=not-a-token')
+            _, post = await streams.connect(user, method='POST')
+            _, with_query = await streams.connect(query_string=f'token={token}'.encode())
+            await streams.close()
+            return anonymous, invalid, post, with_query
+        
+        anonymous, invalid, post, with_query = async_to_sync(scenario)()
+        
+        assert anonymous['status'] == invalid['status'] == status.HTTP_401_UNAUTHORIZED
+        assert (b'www-authenticate', b'Bearer realm="api"') in anonymous['headers']
+        assert post['status'] == status.HTTP_405_METHOD_NOT_ALLOWED
+        assert with_query['status'] == status.HTTP_200_OK
+    
+    def test_streams_allow_configured_origins(self, create_user, settings):
+        """Test that the stream sends the CORS headers of Django's responses to allowed origins."""
+        settings.CORS_ALLOWED_ORIGINS = ['http://localhost:3000']
+        user = create_user()
+        streams = EventStreams()
+        
+        async def scenario():
+            _, allowed = await streams.connect(user, headers=[(b'origin', b'http://localhost:3000')])
+            _, other = await streams.connect(user, headers=[(b'origin', b'http://evil.example')])
+            _, anonymous = await streams.connect(headers=[(b'origin', b'http://localhost:3000')])
+            _, preflight = await streams.connect(method='OPTIONS', headers=[
+                (b'origin', b'http://localhost:3000'), (b'access-control-request-method', b'GET'),
+            ])
+            await streams.close()
+            return allowed, other, anonymous, preflight
+        
+        allowed, other, anonymous, preflight = async_to_sync(scenario)()
+        
+        assert allowed['status'] == status.HTTP_200_OK
+        for response in (allowed, anonymous, preflight):
+            assert (b'access-control-allow-origin', b'http://localhost:3000') in response['headers']
+            assert (b'access-control-allow-credentials', b'true') in response['headers']
+        assert anonymous['status'] == status.HTTP_401_UNAUTHORIZED
+        assert preflight['status'] == status.HTTP_200_OK
+        assert not any(name == b'access-control-allow-origin' for name, _ in other['headers'])
+    
+    def test_streams_end_when_the_token_expires(self, create_user):
+        """Test that a stream is closed with an expired event once its access token expires."""
+        user = create_user()
+        token = UserRefreshToken.for_user(user).access_token
+        token.set_exp(lifetime=datetime.timedelta(seconds=1.5))
+        streams = EventStreams()
+        
+        async def scenario():
+            stream, start = await streams.connect(query_string=f'token={token}'.encode())
+            await stream.receive_output(1)
+            while (expired := await stream.receive_output(3))['body'] == b': keepalive\n\n':
+                pass
+            await stream.wait(1)
+            return start, expired
+        
+        start, expired = async_to_sync(scenario)()
+        
+        assert start['status'] == status.HTTP_200_OK
+        assert expired['body'] == b'event: expired\ndata: {}\n\n'
+        assert not expired.get('more_body')
+    
+    def test_streams_end_when_the_user_is_deactivated(self, create_user, settings):
+        """Test that a deactivated user's stream is closed at the next heartbeat."""
+        settings.FRIEND_EVENTS_HEARTBEAT_SECONDS = 0.05
+        user = create_user()
+        streams = EventStreams()
+        
+        async def scenario():
+            stream, _ = await streams.connect(user)
+            await stream.receive_output(1)
+            user.is_active = False
+            await sync_to_async(user.save)()
+            while (message := await stream.receive_output(1))['body'] == b': keepalive\n\n':
+                pass
+            await stream.wait(1)
+            return message
+        
+        assert async_to_sync(scenario)()['body'] == b'event: expired\ndata: {}\n\n'
+    
+    def test_streams_that_missed_events_are_reset(self, create_user):
+        """Test that a stream is told to reload and closed when log entries expired unread."""
+        user = create_user()
+        streams = EventStreams()
+        
+        async def scenario():
+            stream, _ = await streams.connect(user)
+            await stream.receive_output(1)
+            await sync_to_async(log_events)([('friend_request.created', 1, 2, user.id)])
+            await sync_to_async(cache.delete)(event_log_key(await sync_to_async(cache.get)(EVENT_LOG_SEQUENCE_KEY)))
+            reset = await stream.receive_output(1)
+            await stream.wait(1)
+            return reset
+        
+        reset = async_to_sync(scenario)()
+        
+        assert reset['body'] == b'event: reset\ndata: {}\n\n'
+        assert not reset.get('more_body')
+    
+    def test_slow_subscribers_are_reset(self):
+        """Test that a subscriber's queue is replaced by a reset once it is full."""
+        subscriber = Subscriber(user_id=1, limit=2)
+        
+        for event in range(4):
+            subscriber.put(event)
+        
+        assert [subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())] == [0, 1, RESET]
+        assert subscriber.closed
+
+
+@pytest.fixture
+def replica(db, settings, tmp_path):
+    """A second SQLite database acting as a replica that never receives the primary's writes."""
+    alias = 'replica'
+    connections.settings[alias] = {**connections.settings['default'], 'NAME': str(tmp_path / 'replica.sqlite3')}
+    call_command('migrate', database=alias, verbosity=0)
+    settings.DATABASE_REPLICAS = [alias]
+    yield alias
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+def bearer(user):
+    return f'Bearer {UserRefreshToken.for_user(user).access_token}'
+
+
+class TestReadReplicas:
+    
+    def test_get_requests_read_from_replica(self, api_client, create_user, replica):
+        """Test that reads of unpinned GET requests go to the replica."""
+        user = create_user()
+        User.objects.using(replica).create(id=1000, email='replica-only@example.com', name='Replica Only')
+        # Signing up pins the user like any other write
+        cache.clear()
+        api_client.credentials(HTTP_AUTHORIZATION=bearer(user))
+        
+        response = api_client.get(reverse('user-list'))
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert [row['email'] for row in response.data['results']] == ['replica-only@example.com']
+    
+    def test_writers_read_their_writes_from_primary(self, api_client, create_user, replica):
+        """Test that both sides of a new friend request are pinned to the primary."""
+        sender = create_user(email='sender@example.com', name='Sender User')
+        receiver = create_user(email='receiver@example.com', name='Receiver User')
+        cache.clear()
+        api_client.credentials(HTTP_AUTHORIZATION=bearer(sender))
+        
+        response = api_client.post(reverse('send-friend-request', args=[receiver.id]))
+        assert response.status_code == status.HTTP_201_CREATED
+        assert cache.get(pin_key(sender.id)) and cache.get(pin_key(receiver.id))
+        
+        assert len(api_client.get(reverse('friend-request-list')).data['results']) == 1
+        api_client.credentials(HTTP_AUTHORIZATION=bearer(receiver))
+        response = api_client.put(reverse('accept-friend-request', args=[response.data['id']]))
+        assert response.status_code == status.HTTP_200_OK
+        assert len(api_client.get(reverse('friend-list')).data['results']) == 1
+        
+        # Once the pins expire, reads return to the replica, which has not caught up
+        cache.clear()
+        assert api_client.get(reverse('friend-list')).data['results'] == []
+    
+    def test_failed_writes_do_not_pin(self, api_client, create_user, replica):
+        """Test that rejected write requests leave the user on the replicas."""
+        user = create_user()
+        cache.clear()
+        api_client.credentials(HTTP_AUTHORIZATION=bearer(user))
+        
+        response = api_client.post(reverse('send-friend-request', args=[user.id]))
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert cache.get(pin_key(user.id)) is None
+    
+    def test_fan_out_does_not_pin_friends(self, create_user, create_friendship, replica):
+        """Test that friends invalidated by the outbox fan-out keep reading from the replicas."""
+        alice = create_user(email='alice@example.com', name='Alice')
+        bob = create_user(email='bob@example.com', name='Bob')
+        carol = create_user(email='carol@example.com', name='Carol')
+        create_friendship(user1=alice, user2=carol)
+        cache.clear()
+        version = get_user_version(carol.id)
+        
+        friendship = create_friendship(user1=alice, user2=bob)
+        friends_of_friends_changed(OutboxEvent(payload={'user_ids': [friendship.user1_id, friendship.user2_id]}))
+        
+        assert cache.get(pin_key(alice.id)) and cache.get(pin_key(bob.id))
+        assert cache.get(pin_key(carol.id)) is None
+        assert get_user_version(carol.id) > version
+    
+    def test_replica_reads_after_fan_out_are_not_kept(self, api_client, settings, create_user, create_friendship, replica):
+        """Test that replica reads right after a bump are neither cached nor validated."""
+        alice = create_user(email='alice@example.com', name='Alice')
+        carol = create_user(email='carol@example.com', name='Carol')
+        create_friendship(user1=alice, user2=carol)
+        cache.clear()
+        friends_of_friends_changed(OutboxEvent(payload={'user_ids': [alice.id]}))
+        api_client.credentials(HTTP_AUTHORIZATION=bearer(carol))
+        response_cache_stats.reset()
+        
+        # The replica has not seen the friendship yet
+        for _ in range(2):
+            response = api_client.get(reverse('friend-list'))
+            assert response.data['results'] == []
+            assert 'ETag' not in response
+        assert response_cache_stats.snapshot()['FriendListView'] == {'hits': 0, 'misses': 2}
+        
+        settings.REPLICA_PIN_SECONDS = 0
+        assert 'ETag' in api_client.get(reverse('friend-list'))
+    
+    def test_friend_graph_loads_from_primary(self, create_user, replica):
+        """Test that reloading the graph inside a replica-routed request reads the primary."""
+        friendship = Friendship.objects.create(user1=create_user(), user2=create_user(email='friend@example.com'))
+        token = current_read_database.set(replica)
+        try:
+            friend_graph.load()
+        finally:
+            current_read_database.reset(token)
+        
+        assert friend_graph.are_friends(friendship.user1_id, friendship.user2_id)
+    
+    def test_router_writes_and_migrates_primary_only(self, settings):
+        """Test that writes and migrations never target a replica."""
+        settings.DATABASE_REPLICAS = ['replica']
+        router = ReplicaRouter()
+        token = current_read_database.set('replica')
+        try:
+            assert router.db_for_read(User) == 'replica'
+            assert router.db_for_write(User) == 'default'
+        finally:
+            current_read_database.reset(token)
+        assert router.db_for_read(User) == 'default'
+        assert router.allow_migrate('replica', 'accounts') is False
+        assert router.allow_migrate('default', 'accounts') is None